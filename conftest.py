@@ -0,0 +1,18 @@
+""" fixtures shared by the tests
+"""
+import pytest
+from seis_database import DbUtils
+
+
+@pytest.fixture
+def project_database(tmp_path, monkeypatch):
+    """a plain sqlite project database in tmp_path, connections get the pragmas but
+    not spatialite, so tables with a geometry column cannot be made with their
+    create_table methods
+    """
+    database = tmp_path / "project.sqlite"
+    monkeypatch.setattr(DbUtils, "database", database)
+    monkeypatch.setattr(
+        DbUtils, "init_connection", classmethod(lambda cls, c: cls.set_pragmas(c))
+    )
+    return database
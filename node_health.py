@@ -0,0 +1,177 @@
+""" health of the Quantum and NuSeis nodes across their deployments. The history of a
+    node are its test records by serial number, read along the index on the serial
+    number and test time. The rolling statistics of the attributes are taken over the
+    last NODE_HISTORY_WINDOW deployments of a node and a node drifts when the rolling
+    mean of an attribute has moved from its baseline, the mean of its first
+    deployments, by more than the tolerance of the attribute. The statistics of the
+    whole fleet are computed at once from cumulative sums over the records ordered by
+    node
+"""
+import numpy as np
+import pandas as pd
+from seis_quantum_database import QuantumDb
+from seis_nuseis_database import NuseisDb
+from seis_settings import NODE_HISTORY_WINDOW, NODE_DRIFT_TOLERANCE, node_plt_settings
+
+
+class NodeHealth:
+    """rolling statistics and drift of the attributes of the nodes of node_type
+    ('QUANTUM' or 'NUSEIS'), tolerances {attribute: tolerance} overrides the default
+    tolerances in the units of the attribute
+    """
+
+    # {node type: (database class, serial number column, test time column, attributes)}
+    node_types = {
+        "QUANTUM": (
+            QuantumDb,
+            "qtm_sn",
+            "test_time",
+            ["noise", "tilt", "resistance", "thd", "frequency", "damping"],
+        ),
+        "NUSEIS": (
+            NuseisDb,
+            "nuseis_sn",
+            "time_lastscan",
+            ["noise", "tilt", "resistance", "impedance", "thd"],
+        ),
+    }
+
+    def __init__(
+        self,
+        node_type: str = "QUANTUM",
+        window: int = NODE_HISTORY_WINDOW,
+        tolerances: dict = None,
+    ):
+        self.node_db, self.serial_column, self.time_column, self.attributes = (
+            self.node_types[node_type]
+        )
+        self.window = window
+        self.tolerances = self.default_tolerances() | (tolerances or {})
+
+    def default_tolerances(self) -> dict[str, float]:
+        """NODE_DRIFT_TOLERANCE of the plot range of the attributes that are in
+        node_plt_settings, damping is plotted in % of the stored value
+        """
+        tolerances = {}
+        for attribute in self.attributes:
+            if plt_setting := node_plt_settings.get(attribute):
+                scale = 0.01 if attribute == "damping" else 1.0
+                tolerances[attribute] = (
+                    NODE_DRIFT_TOLERANCE
+                    * (plt_setting["max"] - plt_setting["min"])
+                    * scale
+                )
+
+        return tolerances
+
+    def get_history(self, serials: list = None) -> pd.DataFrame:
+        """the test records of the nodes with serials, of all nodes if None"""
+        return self.node_db.get_node_history(serials)
+
+    def get_trends(self, history_df: pd.DataFrame) -> pd.DataFrame:
+        """rolling mean and standard deviation of the attributes over the last window
+        deployments of the node and the drift of the rolling mean from the baseline
+        of the node, for every record of history_df
+        returns:
+          pandas dataframe ordered by serial number and test time with for each
+          attribute the columns <attribute>, _mean, _std and _drift
+        """
+        history_df = history_df.sort_values(
+            [self.serial_column, self.time_column], kind="stable"
+        ).reset_index(drop=True)
+        serials = history_df[self.serial_column]
+        values = history_df[self.attributes].astype("float64")
+        is_first = history_df.groupby(serials, sort=False).cumcount() < self.window
+        baselines = (
+            values.where(is_first).groupby(serials, sort=False).transform("mean")
+        )
+        means, stds = self.rolling_statistics(
+            serials.to_numpy(), values.to_numpy(), baselines.to_numpy()
+        )
+
+        trends_df = history_df[
+            [
+                column
+                for column in [self.serial_column, self.time_column, "line", "station"]
+                if column in history_df.columns
+            ]
+        ].copy()
+        trends_df[self.attributes] = values
+        for i, attribute in enumerate(self.attributes):
+            trends_df[f"{attribute}_mean"] = means[:, i]
+            trends_df[f"{attribute}_std"] = stds[:, i]
+            trends_df[f"{attribute}_drift"] = means[:, i] - baselines[attribute]
+
+        return trends_df
+
+    def rolling_statistics(
+        self, serials: np.ndarray, values: np.ndarray, shifts: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """rolling mean and standard deviation over the last window values of the
+        same serial of the columns of values, the rows ordered by serial. The sums of
+        a window are the difference of the cumulative sums at its ends, so all nodes
+        are done at once. The values are shifted by shifts, like the baselines of the
+        nodes, to keep the cumulative sums of squares accurate. Missing values are
+        left out, the standard deviation needs two values
+        """
+        rows = values.shape[0]
+        is_start = np.ones(rows, dtype=bool)
+        is_start[1:] = serials[1:] != serials[:-1]
+        starts = np.maximum.accumulate(np.where(is_start, np.arange(rows), 0))
+        window_starts = np.maximum(starts, np.arange(rows) - self.window + 1)
+
+        is_valid = ~np.isnan(values)
+        shifted = np.where(is_valid, values - np.nan_to_num(shifts), 0.0)
+
+        def window_sums(array):
+            cumulative = np.zeros((rows + 1, array.shape[1]))
+            np.cumsum(array, axis=0, out=cumulative[1:])
+            return cumulative[1:] - cumulative[window_starts]
+
+        counts = window_sums(is_valid.astype("float64"))
+        sums = window_sums(shifted)
+        sums_sq = window_sums(shifted * shifted)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+            variances = (sums_sq - sums * sums / counts) / (counts - 1)
+            stds = np.where(counts > 1, np.sqrt(np.maximum(variances, 0.0)), np.nan)
+
+        return means + np.nan_to_num(shifts), stds
+
+    def get_drifting_nodes(self, trends_df: pd.DataFrame) -> pd.DataFrame:
+        """the last record of each node of trends_df made by get_trends with its number
+        of deployments and for each attribute with a tolerance if its drift is beyond
+        the tolerance (<attribute>_flag), drifting is True if any attribute is
+        returns:
+          pandas dataframe with a row by node
+        """
+        grouped = trends_df.groupby(self.serial_column, sort=False)
+        nodes_df = grouped.tail(1).set_index(self.serial_column)
+        nodes_df.insert(0, "deployments", grouped.size())
+
+        flag_columns = []
+        for attribute, tolerance in self.tolerances.items():
+            nodes_df[f"{attribute}_flag"] = (
+                nodes_df[f"{attribute}_drift"].abs() > tolerance
+            )
+            flag_columns.append(f"{attribute}_flag")
+
+        nodes_df["drifting"] = nodes_df[flag_columns].any(axis=1)
+        return nodes_df.reset_index()
+
+    def analyse(self, serials: list = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """trends and drifting nodes of the nodes with serials, of all nodes if None"""
+        trends_df = self.get_trends(self.get_history(serials))
+        return trends_df, self.get_drifting_nodes(trends_df)
+
+
+if __name__ == "__main__":
+    for node_type in NodeHealth.node_types:
+        _, nodes_df = NodeHealth(node_type).analyse()
+        drifting_df = nodes_df[nodes_df["drifting"]]
+        print(
+            f"{node_type}: {drifting_df.shape[0]} of {nodes_df.shape[0]} nodes drift "
+            f"beyond tolerance"
+        )
+        if not drifting_df.empty:
+            print(drifting_df.to_string(index=False))
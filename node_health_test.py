@@ -0,0 +1,71 @@
+""" test the rolling statistics and drift of node_health against a rolling window of
+    pandas by node
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from node_health import NodeHealth
+
+ATTRIBUTES = NodeHealth.node_types["QUANTUM"][3]
+
+
+@pytest.fixture
+def history_df():
+    rng = np.random.default_rng(25)
+    serials = np.repeat([1003, 1001, 1002, 1004], [7, 3, 1, 12])
+    history_df = pd.DataFrame(
+        {
+            "qtm_sn": serials,
+            "test_time": pd.date_range("2021-03-05", periods=len(serials), freq="h"),
+            "line": 1001,
+            "station": np.arange(len(serials)),
+        }
+    )
+    for attribute in ATTRIBUTES:
+        history_df[attribute] = rng.normal(20.0, 2.0, len(serials))
+
+    # values with a large offset and a small spread and missing values
+    history_df["frequency"] += 1e6
+    history_df.loc[[2, 4, 5, 15, 16], "noise"] = np.nan
+    history_df.loc[7:9, "thd"] = np.nan
+    # a node that drifts in tilt
+    history_df.loc[history_df["qtm_sn"] == 1004, "tilt"] += np.linspace(0, 10, 12)
+    return history_df.sample(frac=1, random_state=1)
+
+
+def test_trends_match_pandas_rolling(history_df):
+    node_health = NodeHealth("QUANTUM", window=4)
+    trends_df = node_health.get_trends(history_df)
+
+    expected_df = history_df.sort_values(["qtm_sn", "test_time"]).reset_index(drop=True)
+    grouped = expected_df.groupby("qtm_sn")[ATTRIBUTES]
+    rolling = grouped.rolling(4, min_periods=1)
+    baselines = grouped.transform(lambda values: values.iloc[:4].mean())
+    assert trends_df[["qtm_sn", "test_time"]].equals(
+        expected_df[["qtm_sn", "test_time"]]
+    )
+    for attribute in ATTRIBUTES:
+        means = rolling[attribute].mean().to_numpy()
+        stds = rolling[attribute].std().to_numpy()
+        np.testing.assert_allclose(trends_df[f"{attribute}_mean"], means, rtol=1e-12)
+        np.testing.assert_allclose(trends_df[f"{attribute}_std"], stds, rtol=1e-6)
+        np.testing.assert_allclose(
+            trends_df[f"{attribute}_drift"],
+            means - baselines[attribute],
+            rtol=1e-6,
+            atol=1e-9,
+        )
+
+
+def test_drifting_nodes(history_df):
+    node_health = NodeHealth(
+        "QUANTUM", window=4, tolerances={attribute: 3.0 for attribute in ATTRIBUTES}
+    )
+    nodes_df = node_health.get_drifting_nodes(node_health.get_trends(history_df))
+    assert nodes_df["qtm_sn"].tolist() == [1001, 1002, 1003, 1004]
+    assert nodes_df["deployments"].tolist() == [3, 1, 7, 12]
+    # the node of a single deployment has no standard deviation and no drift
+    assert np.isnan(nodes_df.loc[1, "noise_std"])
+    assert (nodes_df.loc[1, [f"{a}_drift" for a in ATTRIBUTES]] == 0).all()
+    assert nodes_df["tilt_flag"].tolist() == [False, False, False, True]
+    assert nodes_df["drifting"].tolist() == [False, False, False, True]
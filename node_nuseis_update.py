@@ -1,131 +1,158 @@
 ''' Read noise test for GTI nodes and store to database
 '''
-from datetime import datetime, timedelta
-import dataclasses
-from vp_update import PROGRESS_SKIPS
+from datetime import datetime
+import numpy as np
 import pandas as pd
 import seis_utils
 from seis_nuseis_database import NuseisDb
-from seis_settings import DATA_FILES_NUSEIS, FilesNodeTable, NuseisTable
+from seis_cache import DataCache
+from seis_settings import DATA_FILES_NUSEIS, GMT_OFFSET, FilesNodeTable
 
-
-PROGRESS_SKIPS = 200
+# attributes a node must have a positive value for
+REQUIRED_KEYS = ['tilt', 'noise', 'resistance', 'impedance', 'thd']
 node_db = NuseisDb()
 
 class Rcv:
+    suffixes = ['.csv']
 
     @classmethod
     def read_nodes(cls):
         for filename in DATA_FILES_NUSEIS.glob('*.*'):
 
-            if not filename.is_file() or filename.suffix.lower() != '.csv':
-                continue
-
-            node_file = FilesNodeTable(*[None]*2)
-
-            node_file.file_name = filename.name
-            node_file.file_date = (
-                datetime.fromtimestamp(filename.stat().st_mtime).strftime(
-                    '%Y-%m-%d %H:%M:%S')
-            )
-
-            id_file = node_db.update_node_file(node_file)
-            if id_file == -1:
+            if not filename.is_file() or filename.suffix.lower() not in cls.suffixes:
                 continue
 
             try:
-                nuseis_df = pd.read_csv(filename)
+                node_file = cls.parse_file(filename)
 
             except PermissionError:
-                node_db.delete_node_file(id_file)
-                nuseis_df = pd.DataFrame()
-
-            nuseis_df = nuseis_df.drop_duplicates(
-                subset=['Serial_Number'], keep='last')
-            node_records = []
-
-            progress_bar = seis_utils.set_progress_bar(
-                nuseis_df.shape[0], filename.name, PROGRESS_SKIPS
-            )
-
-            count = 0
-            for _, nuseis_row in nuseis_df.iterrows():
-
-                node_record = cls.parse_node_line(nuseis_row)
+                node_file = None
 
-                if node_record.nuseis_sn:
-                    node_record.id_file = id_file
-                    node_records.append(node_record)
+            if node_file:
+                cls.store_file(*node_file)
 
-                if count % PROGRESS_SKIPS == 0:
-                    next(progress_bar)
-                count += 1
-
-            if error_message := node_db.update_node_attributes_records(node_records):
-                print(f'\n{error_message}')
-                node_db.delete_node_file(id_file)
-
-            progress_bar.finish()
+    @classmethod
+    def parse_file(cls, filename):
+        ''' parse the node file if it is new or has changed without writing to
+            the database, so it can run in a worker thread
+            returns:
+              the arguments of store_file, None if the file is in the database and
+              unchanged
+        '''
+        file_signature, is_unchanged = seis_utils.file_signature(
+            filename, node_db.get_node_file_signature(filename.name)
+        )
+        if is_unchanged:
+            return None
+
+        nuseis_df = pd.read_csv(filename)
+        nuseis_df = nuseis_df.drop_duplicates(
+            subset=['Serial_Number'], keep='last')
+        nodes_df, rejects_df = cls.parse_nodes(nuseis_df)
+        seis_utils.report_rejects(filename, rejects_df)
+        return filename, file_signature, nodes_df
 
     @staticmethod
-    def parse_node_line(nuseis_row):
-        empty_record = NuseisTable(*[None]*13)
-        node_record = NuseisTable(*[None]*13)
-
-        try:
-            node_record.nuseis_sn = int(nuseis_row['Serial_Number'])
-            node_record.line = int(nuseis_row['Line'])
-            node_record.station = int(nuseis_row['Station'])
-            node_record.rcvr_index = 1
-            node_record.tilt = (
-                float(180.0 - nuseis_row['Tilt_Angle'])
-                if nuseis_row['Tilt_Angle'] > 0 else None
-            )
-            node_record.noise = (
-                float(nuseis_row['Spread_Noise']) * 0.001
-                if nuseis_row['Spread_Noise'] > 0 else None
-            )
-            node_record.resistance = (
-                float(nuseis_row['Resistance'])
-                if nuseis_row['Resistance'] > 0 else None
-            )
-            node_record.impedance = (
-                float(nuseis_row['Impedance'])
-                if nuseis_row['Impedance'] > 0 else None
+    def store_file(filename, file_signature, nodes_df):
+        ''' add the node file and store the records parsed by parse_file, a changed
+            file replaces its records. The file is removed again if the records
+            cannot be stored
+        '''
+        node_file = FilesNodeTable(*[None]*5)
+
+        node_file.file_name = filename.name
+        node_file.file_size, node_file.file_mtime, node_file.file_hash = (
+            file_signature
+        )
+        node_file.file_date = (
+            datetime.fromtimestamp(filename.stat().st_mtime).strftime(
+                '%Y-%m-%d %H:%M:%S')
+        )
+
+        id_file = node_db.update_node_file(node_file)
+        if id_file == -1:
+            return
+
+        nodes_df['id_file'] = id_file
+        if error_message := node_db.update_node_attributes_records(nodes_df):
+            print(f'\n{error_message}')
+            node_db.delete_node_file(id_file)
+
+        else:
+            DataCache().update(
+                'NUSEIS', set(pd.to_datetime(nodes_df['time_lastscan']).dt.date)
             )
-            node_record.thd = (
-                float(nuseis_row['Total_Harmonic_Distortion'])
-                if nuseis_row['Total_Harmonic_Distortion'] > 0 else None
-            )
-            node_record.time_deployment = (
-                datetime.strptime(
-                    nuseis_row['Deployment_Date_Time_UTC'], '%d-%m-%y %H:%M') +
-                    timedelta(hours=4)).strftime('%Y-%m-%d %H:%M:%S')
-            node_record.time_lastscan = (
-                datetime.strptime(nuseis_row['DLast_Scan_UTC'], '%d-%m-%y %H:%M') +
-                timedelta(hours=4)).strftime('%Y-%m-%d %H:%M:%S')
-
-        except (ValueError, TypeError):
-            return empty_record
-
 
+    @staticmethod
+    def parse_nodes(nuseis_df):
+        ''' column-wise parse of the rows of a NuSeis report to the node attributes,
+            the times are converted from UTC to local time. A row is rejected if it
+            has no serial number, a value that cannot be converted, is scanned on
+            the day of deployment, has no positive value for an attribute of the
+            analysis or the sum of these attributes is below 0.5
+            returns:
+              nodes_df: DataFrame with the node attributes of the rows that are kept
+              rejects_df: the rejected rows of nuseis_df with the reason in column
+                reason
+        '''
+        reasons = pd.Series(None, index=nuseis_df.index, dtype=object)
+
+        def reject(rows, reason):
+            reasons.mask(reasons.isna() & rows, reason, inplace=True)
+
+        def number(column):
+            values = pd.to_numeric(nuseis_df[column], errors='coerce')
+            reject(nuseis_df[column].notna() & values.isna(), f'invalid {column}')
+            return values
+
+        def integer(column):
+            values = number(column)
+            reject(values.isna(), f'invalid {column}')
+            return np.trunc(values)
+
+        def positive(column):
+            values = number(column)
+            return values.where(values > 0)
+
+        def local_time(column):
+            values = pd.to_datetime(
+                nuseis_df[column], format='%d-%m-%y %H:%M', errors='coerce'
+            )
+            reject(values.isna(), f'invalid {column}')
+            return (values + GMT_OFFSET).dt.strftime('%Y-%m-%d %H:%M:%S')
+
+        nuseis_sn = integer('Serial_Number')
+        reject(nuseis_sn == 0, 'no serial number')
+        nodes_df = pd.DataFrame({
+            'nuseis_sn': nuseis_sn,
+            'line': integer('Line'),
+            'station': integer('Station'),
+            'rcvr_index': 1,
+            'tilt': 180.0 - positive('Tilt_Angle'),
+            'noise': positive('Spread_Noise') * 0.001,
+            'resistance': positive('Resistance'),
+            'impedance': positive('Impedance'),
+            'thd': positive('Total_Harmonic_Distortion'),
+            'time_deployment': local_time('Deployment_Date_Time_UTC'),
+            'time_lastscan': local_time('DLast_Scan_UTC'),
+        })
         # skip records where scan date is same as the deployment date
-        if node_record.time_lastscan[:10] == node_record.time_deployment[:10]:
-            return empty_record
-
-        # only except records where there are numerical values for all of the below keys
-        keys = [
-            'tilt', 'noise', 'resistance', 'impedance', 'thd'
-        ]
-        try:
-            r = sum([v for k, v in dataclasses.asdict(node_record).items() if k in keys])
-            if r < 0.5:
-                return empty_record
-
-        except TypeError:
-            return empty_record
-
-        return node_record
+        reject(
+            nodes_df['time_lastscan'].str[:10] == nodes_df['time_deployment'].str[:10],
+            'scanned on the day of deployment'
+        )
+        # only accept records with numerical values for all of the below keys
+        for key in REQUIRED_KEYS:
+            reject(nodes_df[key].isna(), f'no positive {key}')
+
+        reject(nodes_df[REQUIRED_KEYS].sum(axis=1) < 0.5, 'attributes sum below 0.5')
+
+        rejected = reasons.notna()
+        nodes_df = nodes_df[~rejected].astype(
+            {'nuseis_sn': 'int64', 'line': 'int64', 'station': 'int64'}
+        )
+        rejects_df = nuseis_df[rejected].assign(reason=reasons[rejected])
+        return nodes_df.reset_index(drop=True), rejects_df
 
 
 def main():
@@ -1,125 +1,246 @@
 """ Read noise test for Quantum nodes and store to database
 """
+import os
 from datetime import datetime
-import dataclasses
+import numpy as np
 import pandas as pd
+import openpyxl
 import seis_utils
 from seis_quantum_database import QuantumDb
-from seis_settings import DATA_FILES_QUANTUM, FilesNodeTable, QuantumTable
-
-PROGRESS_SKIPS = 200
+from seis_cache import DataCache
+from seis_settings import DATA_FILES_QUANTUM, FilesNodeTable
+
+# columns of a BITS report, by index the text and time columns, the others are numbers
+BITS_COLUMNS = 24
+BITS_TEXT_COLUMNS = [0, 3, 4, 7, 14, 23]
+BITS_TIME_COLUMNS = [5]
+# folder next to the BITS reports with the reports read before
+BITS_CACHE = "bits_cache"
+# attributes a node must have a positive value for
+REQUIRED_KEYS = [
+    "tilt",
+    "resistance",
+    "noise",
+    "thd",
+    "frequency",
+    "damping",
+    "sensitivity",
+]
 node_db = QuantumDb()
 
 
 class Rcv:
+    suffixes = [".xlsx"]
+
     @classmethod
     def read_nodes(cls):
         for filename in DATA_FILES_QUANTUM.glob("*.*"):
-            if not filename.is_file() or filename.suffix.lower() != ".xlsx":
-                continue
-
-            node_file = FilesNodeTable(*[None] * 2)
-
-            node_file.file_name = filename.name
-            node_file.file_date = datetime.fromtimestamp(
-                filename.stat().st_mtime
-            ).strftime("%Y-%m-%d %H:%M:%S")
-
-            id_file = node_db.update_node_file(node_file)
-            if id_file == -1:
+            if not filename.is_file() or filename.suffix.lower() not in cls.suffixes:
                 continue
 
             try:
-                bits_df = pd.read_excel(filename, header=None, skiprows=1)
+                node_file = cls.parse_file(filename)
 
             except PermissionError:
-                node_db.delete_node_file(id_file)
-                bits_df = pd.DataFrame()
+                node_file = None
 
-            if bits_df.empty:
-                continue
-            bits_df.sort_values(by=[1, 2], inplace=True)
-            bits_df = bits_df.drop_duplicates(subset=[0], keep="last")
-            node_records = []
+            if node_file:
+                cls.store_file(*node_file)
 
-            progress_bar = seis_utils.set_progress_bar(
-                bits_df.shape[0], filename.name, PROGRESS_SKIPS
-            )
+    @classmethod
+    def parse_file(cls, filename):
+        """parse the node file if it is new or has changed without writing to the
+        database, so it can run in a worker thread
+        returns:
+          the arguments of store_file, None if the file is unchanged in the database or
+          empty
+        """
+        file_signature, is_unchanged = seis_utils.file_signature(
+            filename, node_db.get_node_file_signature(filename.name)
+        )
+        if is_unchanged:
+            return None
+
+        bits_df = cls.read_bits_cached(filename, file_signature)
+        if bits_df.empty:
+            return None
+
+        bits_df.sort_values(by=[1, 2], inplace=True)
+        bits_df = bits_df.drop_duplicates(subset=[0], keep="last")
+        nodes_df, rejects_df = cls.parse_nodes(bits_df)
+        seis_utils.report_rejects(filename, rejects_df)
+        return filename, file_signature, nodes_df
 
-            count = 0
-            for _, bits_row in bits_df.iterrows():
-                node_record = cls.parse_node_line(bits_row)
+    @staticmethod
+    def read_bits(filename):
+        """stream the rows below the header row of the first sheet of the BITS report
+        workbook and keep its BITS_COLUMNS columns, with the text, time or number
+        dtype of each column. Empty rows are skipped
+        """
+        workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+        try:
+            bits_rows = [
+                bits_row + (None,) * (BITS_COLUMNS - len(bits_row))
+                for bits_row in workbook.worksheets[0].iter_rows(
+                    min_row=2, max_col=BITS_COLUMNS, values_only=True
+                )
+                if any(value is not None for value in bits_row)
+            ]
+
+        finally:
+            workbook.close()
+
+        bits_df = pd.DataFrame(bits_rows, columns=range(BITS_COLUMNS), dtype=object)
+        for column in bits_df.columns:
+            if column in BITS_TEXT_COLUMNS:
+                bits_df[column] = bits_df[column].map(
+                    lambda value: None if value is None else str(value)
+                )
+
+            elif column in BITS_TIME_COLUMNS:
+                bits_df[column] = pd.to_datetime(bits_df[column], errors="coerce")
+
+            else:
+                bits_df[column] = pd.to_numeric(
+                    bits_df[column], errors="coerce"
+                ).astype("float64")
+
+        return bits_df
 
-                if node_record.qtm_sn:
-                    node_record.id_file = id_file
-                    node_records.append(node_record)
+    @classmethod
+    def read_bits_cached(cls, filename, file_signature):
+        """read_bits of the workbook from its Parquet file in the folder BITS_CACHE
+        next to the workbook, keyed on the size, mtime and hash of the workbook so a
+        changed workbook is read again. Without the cache the workbook is read
+        """
+        if not DataCache().enabled:
+            return cls.read_bits(filename)
+
+        file_size, file_mtime, file_hash = file_signature
+        cache_folder = filename.parent / BITS_CACHE
+        cache_file = (
+            cache_folder
+            / f"{filename.name}.{file_size}_{int(file_mtime)}_{file_hash}.parquet"
+        )
+        try:
+            # parquet only takes text column names
+            return pd.read_parquet(cache_file).rename(columns=int)
 
-                if count % PROGRESS_SKIPS == 0:
-                    progress_bar.next()
-                count += 1
+        except FileNotFoundError:
+            pass
 
-            if error_message := node_db.update_node_attributes_records(node_records):
-                print(f"\n{error_message}")
-                node_db.delete_node_file(id_file)
+        bits_df = cls.read_bits(filename)
+        cache_folder.mkdir(exist_ok=True)
+        cache_tmp = cache_file.with_suffix(".tmp")
+        bits_df.rename(columns=str).to_parquet(cache_tmp, index=False)
+        os.replace(cache_tmp, cache_file)
+        for stale_file in cache_folder.glob(f"{filename.name}.*.parquet"):
+            if stale_file != cache_file:
+                stale_file.unlink(missing_ok=True)
 
-            progress_bar.finish()
+        return bits_df
 
     @staticmethod
-    def parse_node_line(bits_row):
-        empty_record = QuantumTable(*[None] * 26)
-        node_record = QuantumTable(*[None] * 26)
-
-        try:
-            node_record.qtm_sn = bits_row[0]
-            node_record.line = int(bits_row[1])
-            node_record.station = int(bits_row[2])
-            node_record.rcvr_index = 1
-            node_record.software = bits_row[3]
-            node_record.geoph_model = bits_row[4]
-            node_record.test_time = bits_row[5].strftime("%Y-%m-%d %H:%M:%S")
-            node_record.temp = bits_row[6] if bits_row[6] > 0 else None
-            node_record.bits_type = bits_row[7]
-            node_record.tilt = bits_row[8] if bits_row[8] > 0 else None
-            node_record.config_id = bits_row[9]
-            node_record.resistance = float(bits_row[10]) if bits_row[10] > 0 else None
-            node_record.noise = bits_row[12] if bits_row[12] > 0 else None
-            node_record.thd = bits_row[13] if bits_row[13] > 0 else None
-            node_record.polarity = bits_row[14]
-            node_record.frequency = bits_row[15] if bits_row[15] > 0 else None
-            node_record.damping = bits_row[16] if bits_row[16] > 0 else None
-            node_record.sensitivity = bits_row[17] if bits_row[17] > 0 else None
-            node_record.dyn_range = bits_row[18]
-            node_record.ein = bits_row[19]
-            node_record.gain = bits_row[20]
-            node_record.offset = bits_row[21]
-            node_record.gps_time = int(bits_row[22])
-            node_record.ext_geophone = 1 if bits_row[23] == "TRUE" else 0
-
-        except (ValueError, TypeError):
-            return empty_record
-
-        # only except records where there are numerical values for all of the below keys
-        keys = [
-            "tilt",
-            "resistance",
-            "noise",
-            "thd",
-            "frequency",
-            "damping",
-            "sensitivity",
-        ]
-        try:
-            _ = sum(
-                [v for k, v in dataclasses.asdict(node_record).items() if k in keys]
+    def store_file(filename, file_signature, nodes_df):
+        """add the node file and store the records parsed by parse_file, a changed
+        file replaces its records. The file is removed again if the records cannot be
+        stored
+        """
+        node_file = FilesNodeTable(*[None] * 5)
+
+        node_file.file_name = filename.name
+        node_file.file_size, node_file.file_mtime, node_file.file_hash = (
+            file_signature
+        )
+        node_file.file_date = datetime.fromtimestamp(filename.stat().st_mtime).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+
+        id_file = node_db.update_node_file(node_file)
+        if id_file == -1:
+            return
+
+        nodes_df["id_file"] = id_file
+        if error_message := node_db.update_node_attributes_records(nodes_df):
+            print(f"\n{error_message}")
+            node_db.delete_node_file(id_file)
+
+        else:
+            DataCache().update(
+                "QUANTUM", set(pd.to_datetime(nodes_df["test_time"]).dt.date)
             )
 
-        except TypeError:
-            return empty_record
-
-        if node_record.line > 99999:
-            return empty_record
-
-        return node_record
+    @staticmethod
+    def parse_nodes(bits_df):
+        """column-wise parse of the rows of a BITS report, as read by read_bits, to the
+        node attributes. A row is rejected if it has no serial number, test time,
+        line, station or gps time, no positive value for an attribute of the analysis
+        or a line above 99999. Other attributes that are not positive are set to
+        None, read_bits has already set the cells that are not a number to NaN
+        returns:
+          nodes_df: DataFrame with the node attributes of the rows that are kept
+          rejects_df: the rejected rows of bits_df with the reason in column reason
+        """
+        reasons = pd.Series(None, index=bits_df.index, dtype=object)
+
+        def reject(rows, reason):
+            reasons.mask(reasons.isna() & rows, reason, inplace=True)
+
+        def integer(column, name):
+            reject(bits_df[column].isna(), f"invalid {name}")
+            return np.trunc(bits_df[column])
+
+        def positive(column):
+            return bits_df[column].where(bits_df[column] > 0)
+
+        reject(
+            bits_df[0].isna() | (bits_df[0].astype(str).str.strip() == ""),
+            "no serial number",
+        )
+        test_time = pd.to_datetime(bits_df[5], errors="coerce")
+        reject(test_time.isna(), "invalid test time")
+        # a text TRUE or a boolean cell of the workbook
+        ext_geophone = bits_df[23].astype(str).str.upper() == "TRUE"
+        nodes_df = pd.DataFrame(
+            {
+                "qtm_sn": bits_df[0],
+                "line": integer(1, "line"),
+                "station": integer(2, "station"),
+                "rcvr_index": 1,
+                "software": bits_df[3],
+                "geoph_model": bits_df[4],
+                "test_time": test_time.dt.strftime("%Y-%m-%d %H:%M:%S"),
+                "temp": positive(6),
+                "bits_type": bits_df[7],
+                "tilt": positive(8),
+                "config_id": bits_df[9],
+                "resistance": positive(10),
+                "noise": positive(12),
+                "thd": positive(13),
+                "polarity": bits_df[14],
+                "frequency": positive(15),
+                "damping": positive(16),
+                "sensitivity": positive(17),
+                "dyn_range": bits_df[18],
+                "ein": bits_df[19],
+                "gain": bits_df[20],
+                "offset": bits_df[21],
+                "gps_time": integer(22, "gps time"),
+                "ext_geophone": ext_geophone.astype(int),
+            }
+        )
+        # only accept records with numerical values for all of the below keys
+        for key in REQUIRED_KEYS:
+            reject(nodes_df[key].isna(), f"no positive {key}")
+
+        reject(nodes_df["line"] > 99999, "line above 99999")
+
+        rejected = reasons.notna()
+        nodes_df = nodes_df[~rejected].astype(
+            {"line": "int64", "station": "int64", "gps_time": "int64"}
+        )
+        rejects_df = bits_df[rejected].assign(reason=reasons[rejected])
+        return nodes_df.reset_index(drop=True), rejects_df
 
 
 def main():
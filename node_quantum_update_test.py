@@ -0,0 +1,129 @@
+""" test the column-wise parse of the rows of a BITS report, the streaming read of
+    the workbook and its Parquet cache
+"""
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import openpyxl
+import seis_utils
+import seis_cache
+from node_quantum_update import (
+    Rcv,
+    BITS_COLUMNS,
+    BITS_TEXT_COLUMNS,
+    BITS_TIME_COLUMNS,
+    BITS_CACHE,
+)
+
+
+def bits_row(qtm_sn="Q0001", line=1001.0, tilt=1.5):
+    bits_row = dict.fromkeys(range(BITS_COLUMNS), 1.0)
+    bits_row.update(
+        {
+            0: qtm_sn,
+            1: line,
+            2: 2002.0,
+            3: "1.2.3",
+            4: "SM-24",
+            5: datetime.datetime(2021, 3, 5, 10, 20, 30),
+            7: "Full",
+            8: tilt,
+            14: "Normal",
+            22: 1614939630.0,
+            23: "TRUE",
+        }
+    )
+    return bits_row
+
+
+def bits_df(bits_rows):
+    """the rows with the dtypes of the columns read_bits gives them"""
+    bits_df = pd.DataFrame(bits_rows, columns=range(BITS_COLUMNS))
+    for column in bits_df.columns:
+        if column in BITS_TIME_COLUMNS:
+            bits_df[column] = pd.to_datetime(bits_df[column])
+
+        elif column not in BITS_TEXT_COLUMNS:
+            bits_df[column] = pd.to_numeric(bits_df[column], errors="coerce")
+
+    return bits_df
+
+
+def test_parse_nodes_rejects():
+    nodes_df, rejects_df = Rcv.parse_nodes(
+        bits_df(
+            [
+                bits_row(),
+                bits_row(qtm_sn=None),
+                bits_row(qtm_sn=np.nan),
+                bits_row(qtm_sn="  "),
+                bits_row(tilt="high"),
+                bits_row(line=100000.0),
+            ]
+        )
+    )
+    assert nodes_df["qtm_sn"].tolist() == ["Q0001"]
+    assert nodes_df.loc[0, "line"] == 1001
+    assert nodes_df.loc[0, "ext_geophone"] == 1
+    assert nodes_df.loc[0, "test_time"] == "2021-03-05 10:20:30"
+    assert rejects_df["reason"].tolist() == [
+        "no serial number",
+        "no serial number",
+        "no serial number",
+        "no positive tilt",
+        "line above 99999",
+    ]
+
+
+@pytest.fixture
+def bits_workbook(tmp_path):
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.append([f"header {column}" for column in range(BITS_COLUMNS)])
+    worksheet.append(list(bits_row().values()))
+    # empty rows are skipped and short rows are padded
+    worksheet.append([])
+    worksheet.append(["Q0002", 1003, "2004", 4])
+    filename = tmp_path / "bits.xlsx"
+    workbook.save(filename)
+    return filename
+
+
+def test_read_bits_dtypes(bits_workbook):
+    bits_df = Rcv.read_bits(bits_workbook)
+    assert bits_df.shape == (2, BITS_COLUMNS)
+    assert bits_df[0].tolist() == ["Q0001", "Q0002"]
+    # a number in a text column is read as text, text in a number column as a number
+    assert bits_df[3].tolist() == ["1.2.3", "4"]
+    assert bits_df[2].tolist() == [2002.0, 2004.0]
+    assert bits_df[5].tolist()[0] == pd.Timestamp(2021, 3, 5, 10, 20, 30)
+    assert bits_df.loc[0, 23] == "TRUE"
+    assert bits_df.loc[1, [5, 8, 23]].isna().all()
+    for column in set(range(BITS_COLUMNS)) - {*BITS_TEXT_COLUMNS, *BITS_TIME_COLUMNS}:
+        assert bits_df[column].dtype == "float64"
+
+
+def test_read_bits_cached(project_database, bits_workbook, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(seis_cache, "DATA_CACHE", True)
+    file_signature = seis_utils.file_signature(bits_workbook)[0]
+    bits_df = Rcv.read_bits_cached(bits_workbook, file_signature)
+    cache_files = list((bits_workbook.parent / BITS_CACHE).glob("*.parquet"))
+    assert len(cache_files) == 1
+
+    # the workbook is not read again while it has the same signature
+    read_bits = Rcv.read_bits
+    monkeypatch.setattr(Rcv, "read_bits", None)
+    pd.testing.assert_frame_equal(
+        Rcv.read_bits_cached(bits_workbook, file_signature), bits_df
+    )
+
+    # a changed workbook is read again and replaces its stale cache file
+    monkeypatch.setattr(Rcv, "read_bits", read_bits)
+    changed_signature = (*file_signature[:2], "changed")
+    pd.testing.assert_frame_equal(
+        Rcv.read_bits_cached(bits_workbook, changed_signature), bits_df
+    )
+    assert list((bits_workbook.parent / BITS_CACHE).glob("*.parquet")) != cache_files
+    assert len(list((bits_workbook.parent / BITS_CACHE).glob("*.parquet"))) == 1
@@ -3,6 +3,7 @@
 import sys
 from pathlib import Path
 from seis_settings import RcvrTable
+from seis_database import DbUtils
 from seis_quantum_database import QuantumDb
 
 rcv_db = QuantumDb()
@@ -10,7 +11,11 @@ rcv_db = QuantumDb()
 class Rcv:
 
     @classmethod
-    def read_rcvr(cls, rcvr_file):
+    def read_rcvr(cls, rcvr_file, report_changes=False):
+        ''' store the receiver points of rcvr_file, points in the database get the
+            coordinates of the file. With report_changes the points with changed
+            coordinates are returned as a DataFrame, see get_rcvr_point_changes
+        '''
         with open(rcvr_file, 'rt') as f:
             rcvr_lines = f.readlines()
 
@@ -38,19 +43,35 @@ class Rcv:
             else:
                 pass
 
-        rcv_db.update_rcvr_point_records(rcvr_points)
+        # one connection so the changes are read before the points are updated
+        with DbUtils.session():
+            rcvr_changes = (
+                rcv_db.get_rcvr_point_changes(rcvr_points) if report_changes else None
+            )
+            count = rcv_db.update_rcvr_point_records(rcvr_points)
 
+        print(f'\n{count} of {len(rcvr_points)} receiver points inserted or updated')
+        return rcvr_changes
 
-def main(file_name):
+
+def main(file_name, report_changes=False):
     file_name = Path(file_name)
     rcv_db.create_table_rcvr_points()
     rcv = Rcv()
-    rcv.read_rcvr(file_name)
+    rcvr_changes = rcv.read_rcvr(file_name, report_changes=report_changes)
+    if report_changes:
+        print(f'{len(rcvr_changes)} receiver points have changed coordinates')
+        if not rcvr_changes.empty:
+            changes_file = file_name.with_suffix('.changes.csv')
+            rcvr_changes.to_csv(changes_file, index=False)
+            print(f'changes written to {changes_file}')
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
+    # with --changes the receiver points with changed coordinates are reported
+    args = [arg for arg in sys.argv[1:] if arg != '--changes']
+    if len(args) != 1:
         print('give the file with receiver coordinates')
         exit()
 
-    main(sys.argv[1])
+    main(args[0], report_changes='--changes' in sys.argv[1:])
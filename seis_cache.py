@@ -0,0 +1,182 @@
+""" columnar cache of the vaps, vp and node records of the database with a Parquet
+    partition per table and production date, so analyses over many days read only
+    the columns they need from the partitions instead of querying the database.
+    A partition is named after the number and last id of the records of its date,
+    records added, or removed or replaced through the file registry, change them so
+    a stale partition is never read. The cache is written by the ingest when a file
+    is stored and by the reads for the dates missing in the cache. It is enabled
+    with DATA_CACHE in seis_config and needs pyarrow, else the records are read from
+    the database. Only the project database is cached, other databases, like one
+    opened in the plots, are read and not written next to
+"""
+import os
+import datetime
+from functools import partial
+from pathlib import Path
+import pandas as pd
+from seis_database import DbUtils
+from seis_vibe_database import VpDb
+from seis_quantum_database import QuantumDb
+from seis_nuseis_database import NuseisDb
+from seis_settings import DATA_CACHE
+
+try:
+    import pyarrow
+
+except ImportError:
+    pyarrow = None
+
+
+class DataCache:
+    """Parquet partitions in the folder <database name>_cache next to the database"""
+
+    # {table: (database table, timestamp column the production date is taken from,
+    # getter of the records between two dates of the database class of the table)}
+    tables = {
+        "VAPS": (
+            VpDb.table_vaps,
+            "time_break",
+            partial(VpDb.get_vp_data_between, "VAPS"),
+        ),
+        "VP": (VpDb.table_vp, "time_break", partial(VpDb.get_vp_data_between, "VP")),
+        "QUANTUM": (
+            QuantumDb.table_node_attributes,
+            "test_time",
+            QuantumDb.get_node_data_between,
+        ),
+        "NUSEIS": (
+            NuseisDb.table_node_attributes,
+            "time_lastscan",
+            NuseisDb.get_node_data_between,
+        ),
+    }
+    # columns not kept in the partitions
+    skip_columns = ["geom"]
+
+    def __init__(self, database: any = None):
+        self.database = Path(database or DbUtils.database)
+        self.folder = self.database.parent / f"{self.database.stem}_cache"
+
+    @property
+    def enabled(self) -> bool:
+        return bool(
+            DATA_CACHE and pyarrow and self.database == Path(DbUtils.database)
+        )
+
+    def get_records(
+        self,
+        table: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: list[str] = None,
+    ) -> pd.DataFrame:
+        """the records of table from start_date up to and including end_date read from
+        the database with the getter of its database class
+        """
+        get_records_between = self.tables[table][2]
+        return get_records_between(
+            start_date, end_date, columns=columns, database=self.database
+        ).drop(columns=self.skip_columns, errors="ignore")
+
+    def date_states(
+        self, table: str, start_date: datetime.date, end_date: datetime.date
+    ) -> dict[str, tuple[int, int]]:
+        """returns {date: (number of records, last id)} of the dates from start_date up
+        to and including end_date that have records, read from the index on the
+        timestamp column only
+        """
+        db_table, date_column, _ = self.tables[table]
+        sql_string = (
+            f"SELECT SUBSTR({date_column}, 1, 10) AS date, COUNT(*) AS records, "
+            f"MAX(id) AS last_id FROM {db_table} "
+            f"WHERE {date_column} >= :start_date AND {date_column} < :end_date "
+            f"GROUP BY date ORDER BY date;"
+        )
+        states_df = DbUtils.read_sql_query(
+            sql_string,
+            params=DbUtils.date_range(start_date, end_date),
+            database=self.database,
+        )
+        return {
+            date: (records, last_id)
+            for date, records, last_id in states_df.itertuples(index=False)
+        }
+
+    def partition_file(self, table: str, date: str, state: tuple[int, int]) -> Path:
+        records, last_id = state
+        return self.folder / table.lower() / f"{date}_{records}_{last_id}.parquet"
+
+    def write_partition(
+        self, table: str, date: str, state: tuple[int, int]
+    ) -> pd.DataFrame:
+        """write the records of the date to its partition, remove the stale partitions
+        of the date and return the records
+        """
+        production_date = datetime.date.fromisoformat(date)
+        records_df = self.get_records(table, production_date, production_date)
+
+        partition = self.partition_file(table, date, state)
+        partition.parent.mkdir(parents=True, exist_ok=True)
+        partition_tmp = partition.with_suffix(".tmp")
+        records_df.to_parquet(partition_tmp, index=False)
+        os.replace(partition_tmp, partition)
+        self.remove_partitions(table, date, keep=partition)
+        return records_df
+
+    def remove_partitions(self, table: str, date: str, keep: Path = None) -> None:
+        for partition in (self.folder / table.lower()).glob(f"{date}_*.parquet"):
+            if partition != keep:
+                partition.unlink(missing_ok=True)
+
+    def update(self, table: str, dates: any) -> None:
+        """write the partitions of the production dates of a file that has been
+        stored, called by the ingest. A date without records loses its partition
+        """
+        if not self.enabled:
+            return
+
+        for date in sorted(dates):
+            states = self.date_states(table, date, date)
+            date = date.strftime("%Y-%m-%d")
+            if date in states:
+                self.write_partition(table, date, states[date])
+
+            else:
+                self.remove_partitions(table, date)
+
+    def read(
+        self,
+        table: str,
+        start_date: datetime.date,
+        end_date: datetime.date = None,
+        columns: list[str] = None,
+    ) -> pd.DataFrame:
+        """returns the records of table ('VAPS', 'VP', 'QUANTUM' or 'NUSEIS') from
+        start_date up to and including end_date (default start_date), with only
+        columns if given. A date missing in the cache or with a stale partition is
+        read from the database and written to the cache
+        """
+        end_date = end_date or start_date
+        if not self.enabled:
+            return self.get_records(table, start_date, end_date, columns)
+
+        records_dfs = []
+        for date, state in self.date_states(table, start_date, end_date).items():
+            try:
+                records_df = pd.read_parquet(
+                    self.partition_file(table, date, state), columns=columns
+                )
+
+            # not cached yet, or replaced by the ingest since the states were read
+            except FileNotFoundError:
+                records_df = self.write_partition(table, date, state)
+                records_df = records_df[columns] if columns else records_df
+
+            records_dfs.append(records_df)
+
+        # no records, the getter gives the empty frame with the columns of the table
+        if not records_dfs:
+            return self.get_records(table, start_date, end_date, columns)
+
+        # categories differ by date, set them again for the combined dates
+        return DbUtils.typed_df(pd.concat(records_dfs, ignore_index=True))
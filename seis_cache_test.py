@@ -0,0 +1,53 @@
+""" test the reads of the Parquet cache
+"""
+import datetime
+import pytest
+import seis_cache
+from seis_cache import DataCache
+from seis_database import DbUtils
+from seis_vibe_database import VpDb
+
+
+@pytest.fixture
+def vaps_database(project_database):
+    with DbUtils.session() as connection:
+        connection.execute(
+            f"CREATE TABLE {VpDb.table_vaps} (id INTEGER PRIMARY KEY, "
+            f"file_id INTEGER, vibrator INTEGER, time_break TIMESTAMP, geom BLOB);"
+        )
+        connection.executemany(
+            f"INSERT INTO {VpDb.table_vaps} (file_id, vibrator, time_break) "
+            f"VALUES (1, ?, ?);",
+            [(7, "2021-03-05 10:20:30.123000"), (8, "2021-03-05 23:59:59")],
+        )
+
+    return project_database
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_read_date_without_records(vaps_database, monkeypatch, enabled):
+    if enabled:
+        pytest.importorskip("pyarrow")
+
+    monkeypatch.setattr(seis_cache, "DATA_CACHE", enabled)
+    data_cache = DataCache()
+    assert data_cache.enabled == enabled
+
+    vaps_df = data_cache.read("VAPS", datetime.date(2021, 3, 5))
+    assert vaps_df["vibrator"].tolist() == [7, 8]
+    assert list(vaps_df.columns) == ["id", "file_id", "vibrator", "time_break"]
+
+    # a day without records keeps the columns, like vp_activity expects
+    vaps_df = data_cache.read("VAPS", datetime.date(2021, 3, 6))
+    assert vaps_df.empty
+    assert list(vaps_df.columns) == ["id", "file_id", "vibrator", "time_break"]
+    assert data_cache.read("VAPS", datetime.date(2021, 3, 6), columns=["vibrator"])[
+        "vibrator"
+    ].empty
+    assert (data_cache.folder / "vaps").is_dir() == enabled
+
+
+def test_other_database_is_not_cached(vaps_database, tmp_path, monkeypatch):
+    monkeypatch.setattr(seis_cache, "DATA_CACHE", True)
+    data_cache = DataCache(tmp_path / "other.sqlite")
+    assert not data_cache.enabled
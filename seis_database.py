@@ -1,10 +1,23 @@
 """ module for seistools database interaction using sqlite3
 """
+import datetime
+import dataclasses
+from contextlib import contextmanager
 from functools import wraps
+import itertools
+import threading
+from pathlib import Path, PureWindowsPath
+import numpy as np
 import pandas as pd
 import sqlite3
-from sqlalchemy import create_engine
-from seis_settings import DATABASE
+from sqlalchemy import create_engine, event
+from seis_settings import (
+    DATABASE,
+    EPSG_PSD93,
+    BATCH_SIZE,
+    SQLITE_PROFILES,
+    SQLITE_PROFILE,
+)
 
 
 class DbUtils:
@@ -12,15 +25,166 @@ class DbUtils:
 
     database = DATABASE
 
+    # {column: definition} a files table registers its files with, see register_file
+    file_registry_columns = {
+        "file_key": "VARCHAR(100)",
+        "file_size": "INTEGER",
+        "file_mtime": "REAL",
+        "file_hash": "VARCHAR(32)",
+    }
+    # {pragma: value} set on every connection, see use_profile
+    pragmas = SQLITE_PROFILES.get(SQLITE_PROFILE, {})
+    # connection of the session of the current thread, see session
+    _local = threading.local()
+    # {database: engine} so an engine and its connection pool are made once
+    _engines = {}
+
+    # dtypes of the columns of a DataFrame read from the database, see typed_df.
+    # Easting and northing stay float64 as float32 would round off the decimals
+    timestamp_columns = [
+        "time_break",
+        "test_time",
+        "time_deployment",
+        "time_lastscan",
+        "date_time",
+        "production_date",
+    ]
+    column_dtypes = {
+        "vibrator": "int16",
+        "line": "int32",
+        "station": "int32",
+        "point": "int32",
+        **dict.fromkeys(
+            [
+                "elevation",
+                "drive",
+                "avg_phase",
+                "peak_phase",
+                "avg_dist",
+                "peak_dist",
+                "avg_force",
+                "peak_force",
+                "avg_stiffness",
+                "avg_viscosity",
+                "hdop",
+                "offset",
+                "distance",
+                "time",
+                "velocity",
+                "temp",
+                "tilt",
+                "resistance",
+                "noise",
+                "thd",
+                "frequency",
+                "damping",
+                "sensitivity",
+                "dyn_range",
+                "ein",
+                "gain",
+                "impedance",
+                "input_voltage",
+                "temperature",
+            ],
+            "float32",
+        ),
+        **dict.fromkeys(
+            [
+                "qc_flag",
+                "fleet_nr",
+                "positioning",
+                "sps_type",
+                "source_type",
+                "bits_type",
+                "polarity",
+            ],
+            "category",
+        ),
+    }
+
+    @classmethod
+    def use_profile(cls, profile: str) -> None:
+        """set the pragmas of the connections opened from now on to the profile in
+        sqlite_profiles of seis_config, like bulk_load for a backfill
+        """
+        cls.pragmas = SQLITE_PROFILES[profile]
+
+    @classmethod
+    def set_pragmas(cls, connection: sqlite3.Connection) -> None:
+        """set the pragmas of the profile on the connection, outside a transaction as
+        the journal mode cannot change inside one
+        """
+        cursor = connection.cursor()
+        for pragma, value in cls.pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value};")
+        cursor.close()
+
+    @classmethod
+    def init_connection(cls, connection: sqlite3.Connection) -> None:
+        """set the pragmas and load spatialite on a new connection"""
+        cls.set_pragmas(connection)
+        connection.enable_load_extension(True)
+        connection.execute('SELECT load_extension("mod_spatialite")')
+
+    @classmethod
+    def open_connection(cls) -> sqlite3.Connection:
+        connection = sqlite3.connect(cls.database)
+        cls.init_connection(connection)
+        return connection
+
+    @classmethod
+    def session_connection(cls) -> sqlite3.Connection | None:
+        """returns the connection of the session of the current thread, None if there
+        is no session
+        """
+        return getattr(cls._local, "connection", None)
+
+    @classmethod
+    @contextmanager
+    def session(cls, strict: bool = False):
+        """context manager for a transaction on one connection with spatialite loaded
+        once. Decorated methods called in the session reuse the connection, the
+        transaction is committed at the end or rolled back on an exception. Nested
+        sessions join the outer session. With strict a decorated method raises its
+        sqlite3.Error instead of printing it, so the whole transaction is rolled back
+        and the caller knows it failed
+        """
+        if cls.session_connection():
+            yield cls.session_connection()
+            return
+
+        connection = cls.open_connection()
+        # transactions are managed explicitly: BEGIN here and a savepoint per call
+        connection.isolation_level = None
+        connection.execute("BEGIN;")
+        cls._local.connection = connection
+        cls._local.strict = strict
+        try:
+            yield connection
+            if connection.in_transaction:
+                connection.execute("COMMIT;")
+
+        except Exception:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK;")
+            raise
+
+        finally:
+            cls._local.connection = None
+            cls._local.strict = False
+            connection.close()
+
     @classmethod
     def connect(cls, func):
         @wraps(func)
         def wrapper(*args, **kwargs):
+            if connection := cls.session_connection():
+                return cls._call_in_session(connection, func, *args, **kwargs)
+
             result = None
+            connection = None
             try:
-                connection = sqlite3.connect(cls.database)
-                connection.enable_load_extension(True)
-                connection.execute('SELECT load_extension("mod_spatialite")')
+                connection = cls.open_connection()
                 cursor = connection.cursor()
                 result = func(*args, cursor, **kwargs)
                 connection.commit()
@@ -38,14 +202,64 @@ class DbUtils:
         return wrapper
 
     @classmethod
-    def get_db_engine(cls):
-        return create_engine(f"sqlite:///{cls.database}")
+    def _call_in_session(cls, connection, func, *args, **kwargs):
+        """call func with a cursor of the session connection inside a savepoint, so an
+        error only rolls back the changes of func as it would without a session
+        """
+        result = None
+        cursor = connection.cursor()
+        cursor.execute("SAVEPOINT connect;")
+        try:
+            result = func(*args, cursor, **kwargs)
+            if connection.in_transaction:
+                cursor.execute("RELEASE connect;")
+
+        except sqlite3.Error as error:
+            if connection.in_transaction:
+                cursor.execute("ROLLBACK TO connect;")
+                cursor.execute("RELEASE connect;")
+
+            if getattr(cls._local, "strict", False):
+                raise
+
+            print(f"Error while connect to sqlite {cls.database}: {error}")
+
+        finally:
+            # executescript commits the pending transaction, begin a new one
+            if not connection.in_transaction:
+                cursor.execute("BEGIN;")
+            cursor.close()
+
+        return result
+
+    @classmethod
+    def get_db_engine(cls, database: any = None):
+        """returns the engine of database (default the project database), the engine
+        is created once and then taken from the cache. The connections of the project
+        database are set up like the connections of open_connection, so queries can
+        use spatialite. Other databases, like one opened in the plots, get plain
+        connections, as the pragmas of the profile, like the journal mode, would stay
+        in the file
+        """
+        database = Path(database or cls.database)
+        if (engine := cls._engines.get(database)) is None:
+            engine = create_engine(f"sqlite:///{database}")
+            if database == Path(cls.database):
+                event.listen(
+                    engine,
+                    "connect",
+                    lambda dbapi_connection, _: cls.init_connection(dbapi_connection),
+                )
+            engine = cls._engines.setdefault(database, engine)
+
+        return engine
 
     @classmethod
     def create_database(cls):
         connection = None
         try:
             connection = sqlite3.connect(cls.database)
+            cls.set_pragmas(connection)
             connection.enable_load_extension(True)
             connection.execute('SELECT load_extension("mod_spatialite")')
             connection.execute("SELECT InitSpatialMetaData(1);")
@@ -57,7 +271,422 @@ class DbUtils:
             if connection:
                 connection.close()
 
+    @staticmethod
+    def table_exists(cursor: any, table: str) -> bool:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?;",
+            (table,),
+        )
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def add_column(cursor: any, table: str, column: str, definition: str) -> None:
+        """add column with definition to table if the column does not exist"""
+        cursor.execute(f"PRAGMA table_info({table});")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
+
+    @staticmethod
+    def file_key(file_name: str, folder: str = None) -> str:
+        """normalized name a file is registered on, the name without folder in lower
+        case. Files of the same name in different folders, like the sps files of the
+        blocks, are kept apart by folder
+        """
+        file_key = PureWindowsPath(file_name).name
+        return (f"{folder}/{file_key}" if folder else file_key).lower()
+
+    @classmethod
+    def create_file_registry(cls, cursor: any, files_table: str) -> None:
+        """add the registry columns to files_table if they do not exist and the unique
+        index on file_key, see register_file
+        """
+        for column, definition in cls.file_registry_columns.items():
+            cls.add_column(cursor, files_table, column, definition)
+
+        cursor.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{files_table}_file_key "
+            f"ON {files_table} (file_key);"
+        )
+
+    @classmethod
+    def get_file_signature(
+        cls, cursor: any, files_table: str, file_name: str, folder: str = None
+    ) -> tuple | None:
+        """returns (file_size, file_mtime, file_hash) of the file registered in
+        files_table with the key of file_name in folder, None if it is not registered
+        """
+        cursor.execute(
+            f"SELECT file_size, file_mtime, file_hash FROM {files_table} "
+            f"WHERE file_key = ?;",
+            (cls.file_key(file_name, folder),),
+        )
+        return cursor.fetchone()
+
+    @classmethod
+    def register_file(
+        cls,
+        cursor: any,
+        files_table: str,
+        file_record: any,
+        records_tables: dict,
+        folder: str = None,
+    ) -> int:
+        """register the file of file_record, a files table dataclass with the
+        file_size, file_mtime and file_hash of the file, in files_table on the key of
+        its file_name in folder. A registered file is changed if its size or hash
+        differ, the records of a changed file in records_tables {table: file id
+        column} are deleted and its registration is replaced by file_record, keeping
+        its id. A file registered before the hash was kept is taken as unchanged.
+        returns:
+          -1, if the file is registered and unchanged, its mtime is updated
+          n, the id of the new or changed file
+        """
+        file_columns = {
+            column: value
+            for column, value in dataclasses.asdict(file_record).items()
+            if column != "id"
+        }
+        file_columns["file_key"] = cls.file_key(file_record.file_name, folder)
+        cursor.execute(
+            f"SELECT id, file_size, file_hash FROM {files_table} WHERE file_key = ?;",
+            (file_columns["file_key"],),
+        )
+        if not (registered := cursor.fetchone()):
+            cursor.execute(
+                f"INSERT INTO {files_table} ({', '.join(file_columns)}) "
+                f"VALUES ({', '.join(['?'] * len(file_columns))});",
+                tuple(file_columns.values()),
+            )
+            return cursor.lastrowid
+
+        file_id, file_size, file_hash = registered
+        if file_hash is None or (file_size, file_hash) == (
+            file_record.file_size,
+            file_record.file_hash,
+        ):
+            cursor.execute(
+                f"UPDATE {files_table} SET "
+                f"file_size = ?, file_mtime = ?, file_hash = ? WHERE id = ?;",
+                (
+                    file_record.file_size,
+                    file_record.file_mtime,
+                    file_record.file_hash,
+                    file_id,
+                ),
+            )
+            return -1
+
+        for table, file_id_column in records_tables.items():
+            cursor.execute(
+                f"DELETE FROM {table} WHERE {file_id_column} = ?;", (file_id,)
+            )
+
+        cursor.execute(
+            f"UPDATE {files_table} SET "
+            f"{', '.join(f'{column} = ?' for column in file_columns)} WHERE id = ?;",
+            (*file_columns.values(), file_id),
+        )
+        print(f"\n{file_record.file_name} has changed and is replaced ...", end="")
+        return file_id
+
+    @staticmethod
+    def create_indexes(cursor: any, table: str, indexes: dict) -> None:
+        """create the indexes {index name: columns} on table if they do not exist"""
+        for index_name, index_columns in indexes.items():
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({index_columns});"
+            )
+
+    @classmethod
+    def create_spatial_index(cls, cursor: any, table: str) -> None:
+        """R*Tree spatial index on the geom column of table, spatialite keeps it up
+        to date on insert, update and delete
+        """
+        if not cls.table_exists(cursor, f"idx_{table}_geom"):
+            cursor.execute(f'SELECT CreateSpatialIndex("{table}", "geom");')
+
+    @staticmethod
+    def spatial_index_filter(table: str, search_frame: str) -> str:
+        """condition on the rows of table with a geom inside the bounding box of
+        search_frame, taken from the spatial index instead of a scan of the table
+        """
+        return (
+            f"{table}.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE "
+            f"f_table_name = '{table}' AND f_geometry_column = 'geom' AND "
+            f"search_frame = {search_frame})"
+        )
+
+    @classmethod
+    def get_within_bbox(
+        cls,
+        table: str,
+        bbox: tuple[float, float, float, float],
+        columns: list[str] = None,
+    ) -> pd.DataFrame:
+        """retrieve the records of table with a geom inside
+        bbox (min_easting, min_northing, max_easting, max_northing)
+        """
+        select_columns = ", ".join(columns) if columns else "*"
+        search_frame = f"BuildMbr(?, ?, ?, ?, {EPSG_PSD93})"
+        sql_string = (
+            f"SELECT {select_columns} FROM {table} WHERE "
+            f"{cls.spatial_index_filter(table, search_frame)};"
+        )
+        return cls.read_sql_query(sql_string, params=tuple(bbox))
+
+    @classmethod
+    def get_within_radius(
+        cls,
+        table: str,
+        easting: float,
+        northing: float,
+        radius: float,
+        columns: list[str] = None,
+    ) -> pd.DataFrame:
+        """retrieve the records of table with a geom within radius meters of
+        (easting, northing)
+        """
+        select_columns = ", ".join(columns) if columns else "*"
+        search_frame = f"BuildCircleMbr(:easting, :northing, :radius, {EPSG_PSD93})"
+        sql_string = (
+            f"SELECT {select_columns} FROM {table} WHERE "
+            f"{cls.spatial_index_filter(table, search_frame)} AND "
+            f"ST_Distance(geom, MakePoint(:easting, :northing, {EPSG_PSD93})) "
+            f"<= :radius;"
+        )
+        return cls.read_sql_query(
+            sql_string,
+            params={"easting": easting, "northing": northing, "radius": radius},
+        )
+
+    @classmethod
+    def get_within_polygon(
+        cls, table: str, polygon: any, columns: list[str] = None
+    ) -> pd.DataFrame:
+        """retrieve the records of table with a geom inside polygon, a shapely
+        Polygon, like a swath of swath_gis, or its WKT in EPSG_PSD93 coordinates
+        """
+        select_columns = ", ".join(columns) if columns else "*"
+        search_frame = f"GeomFromText(:polygon, {EPSG_PSD93})"
+        sql_string = (
+            f"SELECT {select_columns} FROM {table} WHERE "
+            f"{cls.spatial_index_filter(table, search_frame)} AND "
+            f"ST_Within(geom, {search_frame});"
+        )
+        return cls.read_sql_query(
+            sql_string, params={"polygon": getattr(polygon, "wkt", polygon)}
+        )
+
+    @staticmethod
+    def date_range(
+        start_date: datetime.date, end_date: datetime.date = None
+    ) -> dict[str, str]:
+        """parameters :start_date and :end_date for the half open range of timestamps
+        column >= :start_date AND column < :end_date from start_date up to and including
+        end_date (default start_date). Unlike DATE(column) = ... the range can use an
+        index on the column
+        """
+        end_date = end_date or start_date
+        return {
+            "start_date": start_date.strftime("%Y-%m-%d"),
+            "end_date": (end_date + datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+        }
+
+    @classmethod
+    def typed_df(cls, df: pd.DataFrame) -> pd.DataFrame:
+        """parse the timestamp columns of df to datetime64 and set the columns of
+        column_dtypes to their compact dtype. An integer column with NULLs is left
+        as float64
+        """
+        dtypes = {}
+        for column in df.columns:
+            if column in cls.timestamp_columns:
+                df[column] = pd.to_datetime(df[column], format="ISO8601")
+
+            elif (dtype := cls.column_dtypes.get(column)) is not None:
+                if dtype.startswith("int") and df[column].isna().any():
+                    continue
+
+                dtypes[column] = dtype
+
+        return df.astype(dtypes)
+
+    @classmethod
+    def read_sql_query(
+        cls,
+        sql_string: str,
+        params: any = None,
+        typed: bool = True,
+        database: any = None,
+    ) -> pd.DataFrame:
+        """read the query in a DataFrame, in a session with the session connection so
+        the uncommitted records of the session are included. With database, other
+        than the project database, the query is read from that database instead. The
+        columns get the dtypes of typed_df unless typed is False
+        """
+        if database and Path(database) != Path(cls.database):
+            connection = cls.get_db_engine(database)
+
+        else:
+            connection = cls.session_connection() or cls.get_db_engine()
+
+        df = pd.read_sql_query(sql_string, con=connection, params=params)
+        return cls.typed_df(df) if typed else df
+
     @classmethod
     def db_table_to_df(cls, db_table: str) -> pd.DataFrame:
-        db_engine = cls.get_db_engine()
-        return pd.read_sql_query(f"select * from {db_table}", con=db_engine)
+        return cls.read_sql_query(f"select * from {db_table}")
+
+    @staticmethod
+    def df_to_rows(df: pd.DataFrame, columns: list) -> list:
+        """convert columns of df to a list of row tuples with native python values,
+        sqlite3 does not accept numpy scalars or pandas Timestamps as parameters
+        """
+        values = []
+        for column in columns:
+            array = df[column].to_numpy()
+            if np.issubdtype(array.dtype, np.datetime64):
+                array = array.astype("datetime64[us]")
+            values.append(array.tolist())
+
+        return list(zip(*values))
+
+    @classmethod
+    def records_to_rows(cls, records: any, fields: list) -> any:
+        """generate row tuples of fields from records, records can be a DataFrame, a
+        numpy structured array, an iterable of (dataclass) records with fields as
+        attributes or an iterable of tuples already in the order of fields
+        """
+        if isinstance(records, np.ndarray):
+            records = pd.DataFrame(records)
+
+        if isinstance(records, pd.DataFrame):
+            yield from cls.df_to_rows(records, fields)
+            return
+
+        for record in records:
+            if isinstance(record, tuple):
+                yield record
+
+            else:
+                yield tuple(getattr(record, field) for field in fields)
+
+    @classmethod
+    def bulk_insert(
+        cls,
+        cursor: any,
+        table: str,
+        columns: list | dict,
+        records: any,
+        geometry: bool = False,
+        on_conflict: str = None,
+        upsert: list = None,
+        batch_size: int = BATCH_SIZE,
+        verbose: bool = False,
+    ) -> int:
+        """insert records in table with executemany in batches of batch_size rows
+        arguments:
+          cursor: cursor of an open connection
+          table: name of the database table
+          columns: list of column names, or a dict {column: field} if the record field
+            has a different name than the table column
+          records: see records_to_rows
+          geometry: if True the geom column is set to MakePoint(easting, northing),
+            columns must then include easting and northing
+          on_conflict: conflict resolution for the insert, e.g. 'IGNORE'
+          upsert: columns of a unique constraint, a record with the values of an
+            existing row in these columns updates the other columns (and geom) of
+            that row if they differ, or if the row has no geometry, instead of being
+            inserted
+          verbose: if True the number of records inserted so far is printed after
+            each batch
+        returns:
+          number of records inserted or updated
+        """
+        if isinstance(columns, dict):
+            fields = list(columns.values())
+            columns = list(columns.keys())
+
+        else:
+            fields = columns
+
+        # numbered parameters so easting and northing are bound only once per row
+        columns_sql = ", ".join(columns)
+        values_sql = ", ".join(f"?{i}" for i in range(1, len(columns) + 1))
+        if geometry:
+            columns_sql += ", geom"
+            values_sql += (
+                f", MakePoint(?{columns.index('easting') + 1}, "
+                f"?{columns.index('northing') + 1}, {EPSG_PSD93})"
+            )
+
+        insert_sql = f"INSERT OR {on_conflict}" if on_conflict else "INSERT"
+        sql_string = f"{insert_sql} INTO {table} ({columns_sql}) VALUES ({values_sql})"
+        if upsert:
+            update_columns = [column for column in columns if column not in upsert]
+            # a row is only updated if it changes, or if it has no geometry yet
+            conditions = [
+                f"{column} IS NOT excluded.{column}" for column in update_columns
+            ]
+            if geometry:
+                update_columns.append("geom")
+                conditions.append("geom IS NULL")
+
+            sql_string += (
+                f" ON CONFLICT ({', '.join(upsert)}) DO UPDATE SET "
+                + ", ".join(
+                    f"{column} = excluded.{column}" for column in update_columns
+                )
+                + f" WHERE {' OR '.join(conditions)}"
+            )
+
+        sql_string += ";"
+
+        if verbose:
+            print()
+
+        count = 0
+        rows = cls.records_to_rows(records, fields)
+        while batch := list(itertools.islice(rows, batch_size)):
+            cursor.executemany(sql_string, batch)
+            count += cursor.rowcount
+            if verbose:
+                print(f"\rinsert {count} records in {table}", end="")
+
+        return count
+
+    @staticmethod
+    def get_ids(
+        cursor: any, table: str, key_columns: list, keys: list
+    ) -> tuple[np.ndarray, list]:
+        """resolve the ids of the rows of table by the values of key_columns, the
+        columns of a unique constraint. The ids of the range of the first key column
+        of keys are read once and all keys are matched in one vectorised step
+        arguments:
+          keys: list of tuples with the values of key_columns
+        returns:
+          ids: numpy array with the id of each key, -1 if it is not in table
+          unknown_keys: list of the keys not in table, each key once
+        """
+        if not keys:
+            return np.array([], dtype=np.int64), []
+
+        first_keys = [key[0] for key in keys if key[0] is not None]
+        if not first_keys:
+            return np.full(len(keys), -1, dtype=np.int64), list(dict.fromkeys(keys))
+
+        cursor.execute(
+            f"SELECT id, {', '.join(key_columns)} FROM {table} "
+            f"WHERE {key_columns[0]} BETWEEN ? AND ?;",
+            (min(first_keys), max(first_keys)),
+        )
+        rows_df = pd.DataFrame(cursor.fetchall(), columns=["id", *key_columns])
+        positions = pd.MultiIndex.from_frame(rows_df[key_columns]).get_indexer(
+            pd.MultiIndex.from_tuples(keys, names=key_columns)
+        )
+        # position -1 of a key not in table picks the -1 appended to the ids
+        ids = np.append(rows_df["id"].to_numpy(dtype=np.int64), -1)[positions]
+        unknown_keys = list(
+            dict.fromkeys(key for key, key_id in zip(keys, ids.tolist()) if key_id < 0)
+        )
+        return ids, unknown_keys
@@ -0,0 +1,141 @@
+""" test DbUtils on a plain sqlite database, spatialite is not needed
+"""
+import dataclasses
+import pandas as pd
+import pytest
+from seis_database import DbUtils
+
+
+@pytest.fixture
+def cursor(project_database):
+    with DbUtils.session() as connection:
+        connection.execute(
+            "CREATE TABLE points (id INTEGER PRIMARY KEY, line INTEGER, "
+            "point INTEGER, value REAL, UNIQUE (line, point));"
+        )
+        cursor = connection.cursor()
+        yield cursor
+        cursor.close()
+
+
+def test_bulk_insert_prints_progress_only_verbose(cursor, capsys):
+    columns = ["line", "point", "value"]
+    records = pd.DataFrame({"line": 1, "point": range(5), "value": 0.5})
+    count = DbUtils.bulk_insert(cursor, "points", columns, records[:3], batch_size=2)
+    assert count == 3
+    assert capsys.readouterr().out == ""
+
+    count = DbUtils.bulk_insert(
+        cursor, "points", columns, records[3:], batch_size=1, verbose=True
+    )
+    assert count == 2
+    assert capsys.readouterr().out == (
+        "\n\rinsert 1 records in points\rinsert 2 records in points"
+    )
+
+
+def test_get_ids_of_unknown_and_duplicate_keys(cursor):
+    cursor.executemany(
+        "INSERT INTO points (id, line, point) VALUES (?, ?, ?);",
+        [(11, 1, 1), (12, 1, 2), (13, 2, 1), (14, 3, 5)],
+    )
+    keys = [(1, 2), (2, 2), (1, 2), (3, 5), (2, 2), (None, 1), (9, 1), (1, 1)]
+    ids, unknown_keys = DbUtils.get_ids(cursor, "points", ["line", "point"], keys)
+    assert ids.tolist() == [12, -1, 12, 14, -1, -1, -1, 11]
+    # each unknown key once, in the order of keys
+    assert unknown_keys == [(2, 2), (None, 1), (9, 1)]
+
+
+def test_get_ids_without_rows(cursor):
+    ids, unknown_keys = DbUtils.get_ids(cursor, "points", ["line", "point"], [])
+    assert (ids.tolist(), unknown_keys) == ([], [])
+    ids, unknown_keys = DbUtils.get_ids(
+        cursor, "points", ["line", "point"], [(None, 1), (None, 1)]
+    )
+    assert (ids.tolist(), unknown_keys) == ([-1, -1], [(None, 1)])
+    ids, unknown_keys = DbUtils.get_ids(
+        cursor, "points", ["line", "point"], [(1, 1), (1, 1)]
+    )
+    assert (ids.tolist(), unknown_keys) == ([-1, -1], [(1, 1)])
+
+
+@dataclasses.dataclass
+class FilesTable:
+    id: int
+    file_name: str
+    file_size: int
+    file_mtime: float
+    file_hash: str
+
+
+@pytest.fixture
+def files_cursor(cursor):
+    cursor.execute(
+        "CREATE TABLE files (id INTEGER PRIMARY KEY, file_name VARCHAR(100));"
+    )
+    DbUtils.create_file_registry(cursor, "files")
+    cursor.execute("CREATE TABLE records (id INTEGER PRIMARY KEY, file_id INTEGER);")
+    return cursor
+
+
+def register(cursor, file_name, file_size, file_mtime, file_hash, folder=None):
+    file_id = DbUtils.register_file(
+        cursor,
+        "files",
+        FilesTable(None, file_name, file_size, file_mtime, file_hash),
+        {"records": "file_id"},
+        folder,
+    )
+    if file_id != -1:
+        cursor.execute("INSERT INTO records (file_id) VALUES (?);", (file_id,))
+
+    return file_id
+
+
+def registered(cursor):
+    cursor.execute(
+        "SELECT id, file_key, file_size, file_mtime, file_hash FROM files ORDER BY id;"
+    )
+    return cursor.fetchall()
+
+
+def records(cursor):
+    cursor.execute("SELECT file_id FROM records ORDER BY id;")
+    return [file_id for (file_id,) in cursor.fetchall()]
+
+
+def test_register_file_skips_unchanged_file(files_cursor):
+    assert register(files_cursor, "Vib.vaps", 100, 1.0, "a") == 1
+    # a copy or touch of the file only updates its mtime
+    assert register(files_cursor, "Vib.vaps", 100, 2.0, "a") == -1
+    # the key is the name without folder in lower case
+    assert register(files_cursor, "C:\\data\\VIB.VAPS", 100, 3.0, "a") == -1
+    assert registered(files_cursor) == [(1, "vib.vaps", 100, 3.0, "a")]
+    assert records(files_cursor) == [1]
+
+
+def test_register_file_replaces_changed_file(files_cursor):
+    assert register(files_cursor, "Vib.vaps", 100, 1.0, "a") == 1
+    assert register(files_cursor, "Other.vaps", 50, 1.0, "o") == 2
+    # a file of the same size with another hash has changed, it keeps its id
+    assert register(files_cursor, "Vib.vaps", 100, 2.0, "b") == 1
+    assert register(files_cursor, "Vib.vaps", 120, 3.0, "c") == 1
+    assert registered(files_cursor) == [
+        (1, "vib.vaps", 120, 3.0, "c"),
+        (2, "other.vaps", 50, 1.0, "o"),
+    ]
+    # only the records of the last registration of the changed file are kept
+    assert records(files_cursor) == [2, 1]
+
+
+def test_register_file_by_folder_and_without_hash(files_cursor):
+    assert register(files_cursor, "Block.sps", 100, 1.0, "a", "block_a") == 1
+    assert register(files_cursor, "Block.sps", 100, 1.0, "a", "block_b") == 2
+    # a file registered before the hash was kept is taken as unchanged
+    files_cursor.execute("UPDATE files SET file_hash = NULL WHERE id = 2;")
+    assert register(files_cursor, "Block.sps", 200, 2.0, "b", "block_b") == -1
+    assert registered(files_cursor) == [
+        (1, "block_a/block.sps", 100, 1.0, "a"),
+        (2, "block_b/block.sps", 200, 2.0, "b"),
+    ]
+    assert records(files_cursor) == [1, 2]
@@ -0,0 +1,257 @@
+""" migrate an existing project database to the current schema without reloading the
+    data. The version of the database is kept in the table schema_version, migrations
+    with a higher version are applied in order and the database is analyzed after.
+    With --rebuild-summary the vaps summaries are computed again from the vaps
+    records, after the tolerances in vp_plt_settings have changed
+"""
+import sys
+import datetime
+import seis_utils
+from seis_database import DbUtils
+from seis_vibe_database import VpDb
+from seis_sps_database import SpsDb
+from seis_quantum_database import QuantumDb
+from seis_nuseis_database import NuseisDb
+from seis_weather_database import WeatherDb
+from seis_settings import (
+    DATA_FILES_VAPS,
+    DATA_FILES_VP,
+    DATA_FILES_SPS,
+    DATA_FILES_QUANTUM,
+    DATA_FILES_NUSEIS,
+    DATA_FILES_WEATHER,
+)
+
+TABLE_SCHEMA_VERSION = "schema_version"
+
+
+def add_indexes(cursor):
+    """secondary indexes on time_break, (vibrator, time_break), (line, point),
+    file_id and the node serial number and test time
+    """
+    for table, indexes in [
+        (VpDb.table_vaps, VpDb.vaps_indexes),
+        (VpDb.table_vp, VpDb.vp_indexes),
+        (SpsDb.table_sps, SpsDb.sps_indexes),
+        (QuantumDb.table_node_attributes, QuantumDb.node_attributes_indexes),
+        (NuseisDb.table_node_attributes, NuseisDb.node_attributes_indexes),
+    ]:
+        if DbUtils.table_exists(cursor, table):
+            DbUtils.create_indexes(cursor, table, indexes)
+
+
+def add_vaps_file_state(cursor):
+    """byte offset and last line read of vaps files for incremental reads"""
+    if DbUtils.table_exists(cursor, VpDb.table_vaps_files):
+        DbUtils.add_column(cursor, VpDb.table_vaps_files, "file_offset", "INTEGER")
+        DbUtils.add_column(
+            cursor, VpDb.table_vaps_files, "last_signature", "VARCHAR(255)"
+        )
+
+
+def add_file_registry(cursor):
+    """file key, size, mtime and hash of the files tables with a unique index on the
+    key. The key is set from the file name, and the block of the sps files, a file
+    registered twice only keeps the key of its first registration. The size, mtime
+    and hash are set for the files found in the data folders, other files stay
+    registered without them and are taken as unchanged
+    """
+    # (files table, data folder, glob pattern, files are kept apart by folder)
+    for files_table, folder, pattern, by_folder in [
+        (VpDb.table_vaps_files, DATA_FILES_VAPS, "*.*", False),
+        (VpDb.table_vp_files, DATA_FILES_VP, "*.*", False),
+        (SpsDb.table_sps_files, DATA_FILES_SPS, "*/*.*", True),
+        (QuantumDb.table_node_files, DATA_FILES_QUANTUM, "*.*", False),
+        (NuseisDb.table_node_files, DATA_FILES_NUSEIS, "*.*", False),
+        (WeatherDb.table_weather_files, DATA_FILES_WEATHER, "*.*", False),
+    ]:
+        if not DbUtils.table_exists(cursor, files_table):
+            continue
+
+        for column, definition in DbUtils.file_registry_columns.items():
+            DbUtils.add_column(cursor, files_table, column, definition)
+
+        cursor.execute(f"SELECT file_key FROM {files_table} WHERE file_key NOT NULL;")
+        file_keys = {file_key for (file_key,) in cursor.fetchall()}
+        block_column = "block_name" if by_folder else "NULL"
+        cursor.execute(
+            f"SELECT id, file_name, {block_column} FROM {files_table} "
+            f"WHERE file_key IS NULL ORDER BY id;"
+        )
+        key_rows = []
+        for file_id, file_name, block_name in cursor.fetchall():
+            if (key := DbUtils.file_key(file_name, block_name)) not in file_keys:
+                file_keys.add(key)
+                key_rows.append((key, file_id))
+
+        cursor.executemany(
+            f"UPDATE {files_table} SET file_key = ? WHERE id = ?;", key_rows
+        )
+        DbUtils.create_file_registry(cursor, files_table)
+
+        if not (folder and folder.is_dir()):
+            continue
+
+        signature_rows = []
+        for filename in folder.glob(pattern):
+            key = DbUtils.file_key(
+                filename.name, filename.parent.name if by_folder else None
+            )
+            if filename.is_file() and key in file_keys:
+                signature_rows.append((*seis_utils.file_signature(filename)[0], key))
+        cursor.executemany(
+            f"UPDATE {files_table} SET file_size = ?, file_mtime = ?, file_hash = ? "
+            f"WHERE file_key = ? AND file_hash IS NULL;",
+            signature_rows,
+        )
+
+
+def add_vaps_summary(cursor):
+    """daily and hourly vaps summaries by vibrator computed from the vaps records"""
+    if DbUtils.table_exists(cursor, VpDb.table_vaps):
+        VpDb.create_vaps_summary(cursor)
+
+
+def add_spatial_indexes(cursor):
+    """R*Tree spatial indexes on the geom columns of the vaps, vp, sps and receiver
+    points, built from the geometries in the tables
+    """
+    for table in [
+        VpDb.table_vaps,
+        VpDb.table_vp,
+        SpsDb.table_sps,
+        QuantumDb.table_rcvr_points,
+    ]:
+        if DbUtils.table_exists(cursor, table):
+            DbUtils.create_spatial_index(cursor, table)
+
+
+def add_node_history_indexes(cursor):
+    """indexes on the node serial number and test time for the node history, they
+    replace the indexes on the serial number only
+    """
+    for table, indexes, serial_index in [
+        (
+            QuantumDb.table_node_attributes,
+            QuantumDb.node_attributes_indexes,
+            "idx_quantum_qtm_sn",
+        ),
+        (
+            NuseisDb.table_node_attributes,
+            NuseisDb.node_attributes_indexes,
+            "idx_nuseis_nuseis_sn",
+        ),
+    ]:
+        if DbUtils.table_exists(cursor, table):
+            DbUtils.create_indexes(cursor, table, indexes)
+            cursor.execute(f"DROP INDEX IF EXISTS {serial_index};")
+
+
+def add_sps_block_file_keys(cursor):
+    """key the sps files on their block and name, so a file of the same name in
+    another block is registered as a file of its own instead of replacing the file
+    of the first block. A file registered more than once in a block keeps the
+    registration that has a key, else its first, the other registrations and their
+    records are deleted before the unique index on the key is created again
+    """
+    if not DbUtils.table_exists(cursor, SpsDb.table_sps_files):
+        return
+
+    cursor.execute(
+        f"SELECT id, file_name, block_name FROM {SpsDb.table_sps_files} "
+        f"ORDER BY file_key IS NULL, id;"
+    )
+    key_rows = {}
+    duplicate_ids = []
+    for file_id, file_name, block_name in cursor.fetchall():
+        if (key := DbUtils.file_key(file_name, block_name)) in key_rows:
+            duplicate_ids.append((file_id,))
+
+        else:
+            key_rows[key] = file_id
+
+    if DbUtils.table_exists(cursor, SpsDb.table_sps):
+        cursor.executemany(
+            f"DELETE FROM {SpsDb.table_sps} WHERE file_id = ?;", duplicate_ids
+        )
+
+    cursor.executemany(
+        f"DELETE FROM {SpsDb.table_sps_files} WHERE id = ?;", duplicate_ids
+    )
+    # a new key may be the old key of another file until all keys are set
+    cursor.execute(f"DROP INDEX IF EXISTS idx_{SpsDb.table_sps_files}_file_key;")
+    cursor.executemany(
+        f"UPDATE {SpsDb.table_sps_files} SET file_key = ? WHERE id = ?;",
+        key_rows.items(),
+    )
+    DbUtils.create_file_registry(cursor, SpsDb.table_sps_files)
+
+
+# {version: (description, migration)}, a migration takes the cursor and must also
+# work on a database where the tables were created with the current schema
+MIGRATIONS = {
+    1: ("secondary indexes", add_indexes),
+    2: ("vaps file offset and last signature", add_vaps_file_state),
+    3: ("file registry", add_file_registry),
+    4: ("vaps summaries", add_vaps_summary),
+    5: ("spatial indexes", add_spatial_indexes),
+    6: ("node serial number and test time indexes", add_node_history_indexes),
+    7: ("sps file keys by block", add_sps_block_file_keys),
+}
+
+
+@DbUtils.connect
+def get_schema_version(cursor) -> int:
+    """returns the schema version of the database, 0 if it has never been migrated"""
+    if not DbUtils.table_exists(cursor, TABLE_SCHEMA_VERSION):
+        return 0
+
+    cursor.execute(f"SELECT MAX(version) FROM {TABLE_SCHEMA_VERSION};")
+    return cursor.fetchone()[0] or 0
+
+
+def migrate():
+    """apply the pending migrations and their versions in one transaction, so a
+    migration that fails rolls back all of them, and analyze the database. The
+    session opens the transaction with BEGIN, the DDL of the migrations would
+    otherwise be committed by each statement
+    """
+    with DbUtils.session() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TABLE_SCHEMA_VERSION} ("
+            f"version INTEGER PRIMARY KEY, "
+            f"description VARCHAR(100), "
+            f"applied TIMESTAMP);"
+        )
+        schema_version = get_schema_version()
+        for version, (description, migration) in sorted(MIGRATIONS.items()):
+            if version <= schema_version:
+                continue
+
+            print(f"migrate database to version {version}: {description}")
+            migration(cursor)
+            cursor.execute(
+                f"INSERT INTO {TABLE_SCHEMA_VERSION} (version, description, applied) "
+                f"VALUES (?, ?, ?);",
+                (version, description, datetime.datetime.now()),
+            )
+
+        cursor.execute("ANALYZE;")
+        cursor.close()
+
+    print(f"database {DbUtils.database} is at version {max(MIGRATIONS)}")
+
+
+def rebuild_summary():
+    """compute the vaps summaries again from all vaps records in one transaction"""
+    with DbUtils.session():
+        VpDb.rebuild_vaps_summary()
+
+    print(f"vaps summaries of {DbUtils.database} are rebuilt")
+
+
+if __name__ == "__main__":
+    migrate()
+    if "--rebuild-summary" in sys.argv[1:]:
+        rebuild_summary()
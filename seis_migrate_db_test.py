@@ -0,0 +1,82 @@
+""" test that migrate only applies the migrations above the schema version and the
+    migration of the sps file keys to their block
+"""
+import pytest
+from seis_database import DbUtils
+from seis_sps_database import SpsDb
+from seis_migrate_db import (
+    TABLE_SCHEMA_VERSION,
+    MIGRATIONS,
+    migrate,
+    get_schema_version,
+)
+
+
+@pytest.fixture
+def sps_database(project_database):
+    SpsDb.create_table_sps_files()
+    with DbUtils.session() as connection:
+        connection.execute(
+            f"CREATE TABLE {SpsDb.table_sps} (id INTEGER PRIMARY KEY, file_id INTEGER);"
+        )
+        # keyed on the file name only, a file of the same name in another block or
+        # registered twice in a block has no key
+        connection.executemany(
+            f"INSERT INTO {SpsDb.table_sps_files} (id, file_name, block_name, file_key) "
+            f"VALUES (?, ?, ?, ?);",
+            [
+                (1, "A.sps", "block_b", None),
+                (2, "A.sps", "block_a", "a.sps"),
+                (3, "A.sps", "block_a", None),
+                (4, "B.sps", "block_a", "b.sps"),
+            ],
+        )
+        connection.executemany(
+            f"INSERT INTO {SpsDb.table_sps} (file_id) VALUES (?);",
+            [(1,), (2,), (3,), (3,), (4,)],
+        )
+        # the migrations before the sps file keys by block have been applied
+        connection.execute(
+            f"CREATE TABLE {TABLE_SCHEMA_VERSION} (version INTEGER PRIMARY KEY, "
+            f"description VARCHAR(100), applied TIMESTAMP);"
+        )
+        connection.executemany(
+            f"INSERT INTO {TABLE_SCHEMA_VERSION} (version) VALUES (?);",
+            [(version,) for version in range(1, 7)],
+        )
+
+    return project_database
+
+
+def test_sps_file_keys_by_block(sps_database):
+    migrate()
+    assert get_schema_version() == max(MIGRATIONS) == 7
+    with DbUtils.session() as connection:
+        # the file registered twice keeps the registration with a key
+        assert connection.execute(
+            f"SELECT id, file_key FROM {SpsDb.table_sps_files} ORDER BY id;"
+        ).fetchall() == [
+            (1, "block_b/a.sps"),
+            (2, "block_a/a.sps"),
+            (4, "block_a/b.sps"),
+        ]
+        assert connection.execute(
+            f"SELECT file_id FROM {SpsDb.table_sps} ORDER BY id;"
+        ).fetchall() == [(1,), (2,), (4,)]
+        assert connection.execute(
+            f"SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?;",
+            (SpsDb.table_sps_files,),
+        ).fetchall() == [(f"idx_{SpsDb.table_sps_files}_file_key",)]
+
+    # the migrations are applied once
+    with DbUtils.session() as connection:
+        connection.execute(f"UPDATE {SpsDb.table_sps_files} SET file_key = NULL;")
+
+    migrate()
+    with DbUtils.session() as connection:
+        assert connection.execute(
+            f"SELECT COUNT(file_key) FROM {SpsDb.table_sps_files};"
+        ).fetchone() == (0,)
+        assert connection.execute(
+            f"SELECT COUNT(*) FROM {TABLE_SCHEMA_VERSION};"
+        ).fetchone() == (7,)
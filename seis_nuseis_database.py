@@ -1,6 +1,5 @@
 import datetime
 import pandas as pd
-import seis_utils
 from seis_database import DbUtils
 
 
@@ -10,6 +9,15 @@ class NuseisDb:
     table_rcvr_points = 'rcvr_points'
     table_node_files = 'nuseis_files'
     table_node_attributes = 'nuseis_attributes'
+    # a receiver point is unique by its line, station and index
+    rcvr_keys = ['line', 'station', 'rcvr_index']
+    # secondary indexes {index name: columns}, see also seis_migrate_db
+    node_attributes_indexes = {
+        'idx_nuseis_nuseis_sn_time_lastscan': 'nuseis_sn, time_lastscan',
+        'idx_nuseis_time_lastscan': 'time_lastscan',
+        'idx_nuseis_id_file': 'id_file',
+        'idx_nuseis_id_point': 'id_point',
+    }
 
     @classmethod
     @DbUtils.connect
@@ -32,9 +40,14 @@ class NuseisDb:
             f'CREATE TABLE {cls.table_node_files} ('
             f'id INTEGER PRIMARY KEY, '
             f'file_name VARCHAR(100), '
-            f'file_date TIMESTAMP);'
+            f'file_date TIMESTAMP, '
+            f'file_key VARCHAR(100), '
+            f'file_size INTEGER, '
+            f'file_mtime REAL, '
+            f'file_hash VARCHAR(32));'
         )
         cursor.executescript(sql_string)
+        DbUtils.create_file_registry(cursor, cls.table_node_files)
         print(f'create table {cls.table_node_files}')
 
     @classmethod
@@ -57,89 +70,64 @@ class NuseisDb:
             f'time_lastscan TIME_STAMP);'
         )
         cursor.executescript(sql_string)
+        DbUtils.create_indexes(
+            cursor, cls.table_node_attributes, cls.node_attributes_indexes
+        )
         print(f'create table {cls.table_node_attributes}')
 
+    @classmethod
+    @DbUtils.connect
+    def get_node_file_signature(cls, file_name, cursor):
+        ''' returns (file_size, file_mtime, file_hash) the node file is registered
+            with, None if it is not in the database
+        '''
+        return DbUtils.get_file_signature(cursor, cls.table_node_files, file_name)
+
     @classmethod
     @DbUtils.connect
     def update_node_file(cls, node_file, cursor):
-        ''' method to to check if file_name exists in the database, if it does not then
-            add the filename to the data base
+        ''' method to register the node file, the records of a changed file are
+            deleted, see DbUtils.register_file
             returns:
-            -1, if file is found
-            n, new file_id number if no file is found
+            -1, if the file is found and unchanged
+            n, file_id of the new or changed file
         '''
-        # check if file exists
-        sql_string = (
-            f'SELECT id FROM {cls.table_node_files} WHERE '
-            f'file_name like \'%{node_file.file_name}\' ;'
+        return DbUtils.register_file(
+            cursor, cls.table_node_files, node_file,
+            {cls.table_node_attributes: 'id_file'},
         )
-        cursor.execute(sql_string)
-        try:
-            _ = cursor.fetchone()[0]
-            return -1
-
-        except TypeError:
-            # no id was found so go on to create one
-            pass
-
-        sql_string = (
-            f'INSERT INTO {cls.table_node_files} ('
-            f'file_name, file_date) '
-            f'VALUES (?, ?) '
-        )
-        cursor.execute(sql_string, (node_file.file_name, node_file.file_date))
-        return cursor.lastrowid
 
     @classmethod
     @DbUtils.connect
-    def update_node_attributes_records(cls, node_records, cursor):
-        progress_message = seis_utils.progress_message_generator(
-            f'populate database for table: {cls.table_node_attributes}                  ')
-
+    def update_node_attributes_records(cls, nodes_df, cursor):
+        ''' store the node attributes of the DataFrame nodes_df made by the node
+            update, returns an error message if a receiver point is not in the
+            database
+        '''
         # get the receiver ids and check all nodes have an rcvr_id
-        sql_get_rcvr_id_string = (
-            f'SELECT id FROM {cls.table_rcvr_points} WHERE '
-            f'line = ? AND '
-            f'station = ? AND '
-            f'rcvr_index = ?;'
+        rcvr_ids, unknown_points = DbUtils.get_ids(
+            cursor,
+            cls.table_rcvr_points,
+            cls.rcvr_keys,
+            list(nodes_df[cls.rcvr_keys].itertuples(index=False, name=None)),
         )
-        rcvr_ids = []
-        for node_record in node_records:
-            cursor.execute(sql_get_rcvr_id_string, (
-                node_record.line,
-                node_record.station,
-                node_record.rcvr_index
-            ))
-            try:
-                rcvr_ids.append(cursor.fetchone()[0])
-
-            except TypeError:
-                return (
-                    f'({node_record.line}, {node_record.station}) is not a receiver '
-                    f'point in the database'
+        if unknown_points:
+            return (
+                f'{len(unknown_points)} receiver points are not in the database: '
+                + ', '.join(
+                    f'({line}, {station})' for line, station, _ in unknown_points
                 )
+            )
+
+        nodes_df = nodes_df.assign(id_point=rcvr_ids)
 
-        sql_insert_string = (
-            f'INSERT INTO {cls.table_node_attributes} ('
-            f'id_file, id_point, nuseis_sn, tilt, noise, resistance, '
-            f'impedance, thd, time_deployment, time_lastscan) '
-            f'VALUES ({", ".join(["?"]*10)}); '
+        node_columns = [
+            'id_file', 'id_point', 'nuseis_sn', 'tilt', 'noise', 'resistance',
+            'impedance', 'thd', 'time_deployment', 'time_lastscan',
+        ]
+        DbUtils.bulk_insert(
+            cursor, cls.table_node_attributes, node_columns, nodes_df
         )
-        for rcvr_id, node_record in zip(rcvr_ids, node_records):
-            cursor.execute(sql_insert_string, (
-                node_record.id_file,
-                rcvr_id,
-                node_record.nuseis_sn,
-                node_record.tilt,
-                node_record.noise,
-                node_record.resistance,
-                node_record.impedance,
-                node_record.thd,
-                node_record.time_deployment,
-                node_record.time_lastscan,
-            ))
-
-            next(progress_message)
 
     @classmethod
     @DbUtils.connect
@@ -158,20 +146,67 @@ class NuseisDb:
             returns:
               pandas dataframe with node attributes for production date
         '''
-        engine = DbUtils().get_db_engine()
-        sql_string = (f'SELECT * FROM {cls.table_node_attributes} WHERE '
-                      f'DATE(time_lastscan) = \'{production_date.strftime("%Y-%m-%d")}\';')
-        return pd.read_sql_query(sql_string, con=engine)
+        return cls.get_node_data_between(production_date, production_date)
 
     @classmethod
-    def get_node_data_by_node(cls, qtm_sn: str) -> pd.DataFrame:
-        ''' retrieve node data by quantum node serial number
+    def get_node_data_between(
+        cls,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: list[str] = None,
+        database: any = None,
+    ) -> pd.DataFrame:
+        ''' retrieve node data from start_date up to and including end_date, with
+            only columns if given, ordered by time of the last scan, from database
+            if it is not the project database
+        '''
+        select_columns = ', '.join(columns) if columns else '*'
+        sql_string = (
+            f'SELECT {select_columns} FROM {cls.table_node_attributes} WHERE '
+            f'time_lastscan >= :start_date AND time_lastscan < :end_date '
+            f'ORDER BY time_lastscan;'
+        )
+        return DbUtils.read_sql_query(
+            sql_string,
+            params=DbUtils.date_range(start_date, end_date),
+            database=database,
+        )
+
+    @classmethod
+    def get_node_data_by_node(cls, nuseis_sn: int) -> pd.DataFrame:
+        ''' retrieve node data by nuseis node serial number
             arguments:
-              qtm_sn: serial number of quantum node (str)
+              nuseis_sn: serial number of nuseis node (int)
             returns:
-              pandas dataframe with node attributes for qtm_sn
+              pandas dataframe with node attributes for nuseis_sn ordered by time of
+              the last scan
         '''
-        engine = DbUtils().get_db_engine()
         sql_string = (f'SELECT * FROM {cls.table_node_attributes} WHERE '
-                      f'qtm_sn = {qtm_sn};')
-        return pd.read_sql_query(sql_string, con=engine)
+                      f'nuseis_sn = :nuseis_sn ORDER BY time_lastscan;')
+        return DbUtils.read_sql_query(
+            sql_string, params={'nuseis_sn': int(nuseis_sn)}
+        )
+
+    @classmethod
+    def get_node_history(cls, nuseis_sns: list[int] = None) -> pd.DataFrame:
+        ''' retrieve the node data with the line and station of the deployment of
+            the nodes with serial numbers nuseis_sns, of all nodes if None
+            returns:
+              pandas dataframe with node attributes ordered by serial number and
+              time of the last scan, along the index on (nuseis_sn, time_lastscan)
+        '''
+        params = {
+            f'nuseis_sn_{i}': int(nuseis_sn)
+            for i, nuseis_sn in enumerate(nuseis_sns or [])
+        }
+        where_sql = (
+            f'WHERE node.nuseis_sn IN ({", ".join(f":{param}" for param in params)}) '
+            if nuseis_sns else ''
+        )
+        sql_string = (
+            f'SELECT node.*, rcv.line, rcv.station '
+            f'FROM {cls.table_node_attributes} AS node '
+            f'INNER JOIN {cls.table_rcvr_points} AS rcv ON rcv.id = node.id_point '
+            f'{where_sql}ORDER BY node.nuseis_sn, node.time_lastscan;'
+        )
+        return DbUtils.read_sql_query(sql_string, params=params)
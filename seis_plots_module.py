@@ -9,10 +9,11 @@ from collections import Counter
 import numpy as np
 import pandas as pd
 from scipy import stats
-from sqlalchemy import create_engine
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import matplotlib.ticker as mtick
+import seis_database
+from seis_cache import DataCache
 from seis_settings import (
     FLEETS,
     DATABASE,
@@ -44,16 +45,14 @@ class DbUtils:
 
     def get_data_by_date(self, type_data, production_date):
         """retrieve data by date"""
-        engine = create_engine(f"sqlite:///{self.database}")
+        engine = seis_database.DbUtils.get_db_engine(self.database)
         match type_data.upper():
             case "VP":
                 file_table = "vaps_files"
-                data_table = "vaps_records"
-                date_field = "time_break"
+                cache_table = "VAPS"
             case "NODE":
                 file_table = 'node_quantum_files'
-                data_table = "node_quantum_attributes"
-                date_field = "test_time"
+                cache_table = "QUANTUM"
             case other:
                 assert False, f'{type_data} is invalid, must be "VP" or "NODE"'
 
@@ -80,11 +79,7 @@ class DbUtils:
 
         # extract data
         try:
-            sql_string = (
-                f"SELECT * FROM {data_table} WHERE "
-                f'DATE({date_field}) = \'{production_date.strftime("%Y-%m-%d")}\';'
-            )
-            return pd.read_sql_query(sql_string, con=engine)
+            return DataCache(self.database).read(cache_table, production_date)
 
         except Exception as e:
             print(f"Error: {e} for {engine}")
@@ -444,15 +439,9 @@ class VpActivity:
 
     def populate_vps_by_second(self):
         for vib in range(1, FLEETS + 1):
-            # get time strings and convert to datetime objects
             vib_data = self.vp_records_df[self.vp_records_df["vibrator"] == vib][
                 "time_break"
-            ]
-            if not vib_data.empty:
-                vib_data = pd.to_datetime(vib_data, format="ISO8601").to_list()
-
-            else:
-                vib_data = []
+            ].to_list()
 
             for vp_time in vib_data:
                 vp_seconds = int(
@@ -1,7 +1,6 @@
 import datetime
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point
-import seis_utils
 from seis_settings import EPSG_PSD93
 from seis_database import DbUtils
 
@@ -13,6 +12,16 @@ class QuantumDb:
     table_node_files = "node_quantum_files"
     table_node_attributes = "node_quantum_attributes"
     table_receivers = "rcvr_points"
+    rcvr_columns = ["line", "station", "rcvr_index", "easting", "northing", "elevation"]
+    # a receiver point is unique by its line, station and index
+    rcvr_keys = ["line", "station", "rcvr_index"]
+    # secondary indexes {index name: columns}, see also seis_migrate_db
+    node_attributes_indexes = {
+        "idx_quantum_qtm_sn_test_time": "qtm_sn, test_time",
+        "idx_quantum_test_time": "test_time",
+        "idx_quantum_id_file": "id_file",
+        "idx_quantum_id_point": "id_point",
+    }
 
     @classmethod
     @DbUtils.connect
@@ -59,6 +68,7 @@ class QuantumDb:
             f'"geom", {EPSG_PSD93}, "POINT", "XY");'
         )
         cursor.execute(sql_string)
+        DbUtils.create_spatial_index(cursor, cls.table_rcvr_points)
         print(f"create table {cls.table_rcvr_points}")
 
     @classmethod
@@ -68,9 +78,14 @@ class QuantumDb:
             f"CREATE TABLE {cls.table_node_files} ("
             f"id INTEGER PRIMARY KEY, "
             f"file_name VARCHAR(100), "
-            f"file_date TIMESTAMP);"
+            f"file_date TIMESTAMP, "
+            f"file_key VARCHAR(100), "
+            f"file_size INTEGER, "
+            f"file_mtime REAL, "
+            f"file_hash VARCHAR(32));"
         )
         cursor.executescript(sql_string)
+        DbUtils.create_file_registry(cursor, cls.table_node_files)
         print(f"create table {cls.table_node_files}")
 
     @classmethod
@@ -105,153 +120,141 @@ class QuantumDb:
             f"ext_geophone BOOLEAN);"
         )
         cursor.executescript(sql_string)
+        DbUtils.create_indexes(
+            cursor, cls.table_node_attributes, cls.node_attributes_indexes
+        )
         print(f"create table {cls.table_node_attributes}")
 
     @classmethod
     @DbUtils.connect
     def update_rcvr_point_records(cls, rcv_records, cursor):
-        progress_message = seis_utils.progress_message_generator(
-            f"populate database for table: {cls.table_rcvr_points}                      "
+        """insert the receiver points in one pass, a (line, station, rcvr_index) point
+        that is already in the database gets the coordinates of the record if they
+        have changed, like a re-surveyed point, or a geometry if it has none
+        returns:
+          number of receiver points inserted or updated
+        """
+        count = DbUtils.bulk_insert(
+            cursor,
+            cls.table_rcvr_points,
+            cls.rcvr_columns,
+            rcv_records,
+            geometry=True,
+            upsert=cls.rcvr_keys,
         )
+        return count
 
-        sql_select_string = (
-            f"SELECT id FROM {cls.table_rcvr_points} WHERE "
-            f"line = ? AND "
-            f"station = ? AND "
-            f"rcvr_index = ?;"
+    @classmethod
+    def get_rcvr_point_changes(cls, rcv_records) -> pd.DataFrame:
+        """returns the receiver points of rcv_records that are in the database with
+        other coordinates, with the database (_old) and record (_new) easting,
+        northing and elevation and the distance the point has moved. Call it before
+        update_rcvr_point_records, in a session to have the same connection
+        """
+        rcvr_df = pd.DataFrame(
+            DbUtils.records_to_rows(rcv_records, cls.rcvr_columns),
+            columns=cls.rcvr_columns,
+        ).drop_duplicates(subset=cls.rcvr_keys, keep="last")
+        if rcvr_df.empty:
+            return rcvr_df
+
+        sql_string = (
+            f"SELECT {', '.join(cls.rcvr_columns)} FROM {cls.table_rcvr_points} "
+            f"WHERE line BETWEEN ? AND ?;"
         )
-        sql_insert_string = (
-            f"INSERT INTO {cls.table_rcvr_points} ("
-            f"line, station, rcvr_index, easting, northing, elevation, geom) "
-            f'VALUES ({", ".join(["?"]*6)}, MakePoint(?, ?, ?)); '
+        db_rcvr_df = DbUtils.read_sql_query(
+            sql_string,
+            params=(int(rcvr_df["line"].min()), int(rcvr_df["line"].max())),
+            typed=False,
         )
+        changes_df = db_rcvr_df.merge(
+            rcvr_df, on=cls.rcvr_keys, suffixes=("_old", "_new")
+        )
+        changed = np.zeros(len(changes_df), dtype=bool)
+        for column in ["easting", "northing", "elevation"]:
+            old, new = changes_df[f"{column}_old"], changes_df[f"{column}_new"]
+            changed |= ((old != new) & ~(old.isna() & new.isna())).to_numpy()
 
-        for rcv_record in rcv_records:
-            cursor.execute(
-                sql_select_string,
-                (rcv_record.line, rcv_record.station, rcv_record.rcvr_index),
-            )
-            try:
-                _ = cursor.fetchone()[0]
-
-            except TypeError:
-                point = Point(rcv_record.easting, rcv_record.northing)
-                cursor.execute(
-                    sql_insert_string,
-                    (
-                        rcv_record.line,
-                        rcv_record.station,
-                        rcv_record.rcvr_index,
-                        rcv_record.easting,
-                        rcv_record.northing,
-                        rcv_record.elevation,
-                        point.x,
-                        point.y,
-                        EPSG_PSD93,
-                    ),
-                )
+        changes_df = changes_df[changed].reset_index(drop=True)
+        changes_df["moved"] = np.hypot(
+            changes_df["easting_new"] - changes_df["easting_old"],
+            changes_df["northing_new"] - changes_df["northing_old"],
+        )
+        return changes_df
 
-                next(progress_message)
+    @classmethod
+    @DbUtils.connect
+    def get_node_file_signature(cls, file_name, cursor):
+        """returns (file_size, file_mtime, file_hash) the node file is registered
+        with, None if it is not in the database
+        """
+        return DbUtils.get_file_signature(cursor, cls.table_node_files, file_name)
 
     @classmethod
     @DbUtils.connect
     def update_node_file(cls, node_file, cursor):
-        """method to to check if file_name exists in the database, if it does not then
-        add the filename to the data base
+        """method to register the node file, the records of a changed file are
+        deleted, see DbUtils.register_file
         returns:
-        -1, if file is found
-        n, new file_id number if no file is found
+        -1, if the file is found and unchanged
+        n, file_id of the new or changed file
         """
-        # check if file exists
-        sql_string = (
-            f"SELECT id FROM {cls.table_node_files} WHERE "
-            f"file_name like '%{node_file.file_name}' ;"
-        )
-        cursor.execute(sql_string)
-        try:
-            _ = cursor.fetchone()[0]
-            return -1
-
-        except TypeError:
-            # no id was found so go on to create one
-            pass
-
-        sql_string = (
-            f"INSERT INTO {cls.table_node_files} ("
-            f"file_name, file_date) "
-            f"VALUES (?, ?) "
+        return DbUtils.register_file(
+            cursor,
+            cls.table_node_files,
+            node_file,
+            {cls.table_node_attributes: "id_file"},
         )
-        cursor.execute(sql_string, (node_file.file_name, node_file.file_date))
-        return cursor.lastrowid
 
     @classmethod
     @DbUtils.connect
-    def update_node_attributes_records(cls, node_records, cursor):
-        progress_message = seis_utils.progress_message_generator(
-            f"populate database for table: {cls.table_node_attributes}                  "
-        )
-
+    def update_node_attributes_records(cls, nodes_df, cursor):
+        """store the node attributes of the DataFrame nodes_df made by the node
+        update, returns an error message if a receiver point is not in the database
+        """
         # get the receiver ids and check all nodes have an rcvr_id
-        sql_get_rcvr_id_string = (
-            f"SELECT id FROM {cls.table_rcvr_points} WHERE "
-            f"line = ? AND "
-            f"station = ? AND "
-            f"rcvr_index = ?;"
+        rcvr_ids, unknown_points = DbUtils.get_ids(
+            cursor,
+            cls.table_rcvr_points,
+            cls.rcvr_keys,
+            list(nodes_df[cls.rcvr_keys].itertuples(index=False, name=None)),
         )
-        rcvr_ids = []
-        for node_record in node_records:
-            cursor.execute(
-                sql_get_rcvr_id_string,
-                (node_record.line, node_record.station, node_record.rcvr_index),
-            )
-            try:
-                rcvr_ids.append(cursor.fetchone()[0])
-
-            except TypeError:
-                return (
-                    f"({node_record.line}, {node_record.station}) is not a receiver point "
-                    f"in the database"
+        if unknown_points:
+            return (
+                f"{len(unknown_points)} receiver points are not in the database: "
+                + ", ".join(
+                    f"({line}, {station})" for line, station, _ in unknown_points
                 )
-
-        sql_insert_string = (
-            f"INSERT INTO {cls.table_node_attributes} ("
-            f"id_file, id_point, qtm_sn, software, geoph_model, test_time, temp, "
-            f"bits_type, tilt, config_id, resistance, noise, thd, polarity, "
-            f"frequency, damping, sensitivity, dyn_range, ein, gain, offset, "
-            f"gps_time, ext_geophone) "
-            f'VALUES ({", ".join(["?"]*23)}); '
-        )
-        for rcvr_id, node_record in zip(rcvr_ids, node_records):
-            cursor.execute(
-                sql_insert_string,
-                (
-                    node_record.id_file,
-                    rcvr_id,
-                    node_record.qtm_sn,
-                    node_record.software,
-                    node_record.geoph_model,
-                    node_record.test_time,
-                    node_record.temp,
-                    node_record.bits_type,
-                    node_record.tilt,
-                    node_record.config_id,
-                    node_record.resistance,
-                    node_record.noise,
-                    node_record.thd,
-                    node_record.polarity,
-                    node_record.frequency,
-                    node_record.damping,
-                    node_record.sensitivity,
-                    node_record.dyn_range,
-                    node_record.ein,
-                    node_record.gain,
-                    node_record.offset,
-                    node_record.gps_time,
-                    node_record.ext_geophone,
-                ),
             )
 
-            next(progress_message)
+        nodes_df = nodes_df.assign(id_point=rcvr_ids)
+
+        node_columns = [
+            "id_file",
+            "id_point",
+            "qtm_sn",
+            "software",
+            "geoph_model",
+            "test_time",
+            "temp",
+            "bits_type",
+            "tilt",
+            "config_id",
+            "resistance",
+            "noise",
+            "thd",
+            "polarity",
+            "frequency",
+            "damping",
+            "sensitivity",
+            "dyn_range",
+            "ein",
+            "gain",
+            "offset",
+            "gps_time",
+            "ext_geophone",
+        ]
+        DbUtils.bulk_insert(cursor, cls.table_node_attributes, node_columns, nodes_df)
 
     @classmethod
     @DbUtils.connect
@@ -268,14 +271,39 @@ class QuantumDb:
         returns:
           pandas dataframe with node attributes for production date
         """
-        engine = DbUtils().get_db_engine()
         sql_string = (
             f"SELECT node.* FROM {cls.table_node_attributes} AS node "
             f"INNER JOIN {cls.table_receivers} AS rcv ON rcv.id = node.id_point "
-            f'WHERE DATE(node.test_time) = \'{production_date.strftime("%Y-%m-%d")}\' '
+            f"WHERE node.test_time >= :start_date AND node.test_time < :end_date "
             f"ORDER BY rcv.line ASC, rcv.station ASC;"
         )
-        return pd.read_sql_query(sql_string, con=engine)
+        return DbUtils.read_sql_query(
+            sql_string, params=DbUtils.date_range(production_date)
+        )
+
+    @classmethod
+    def get_node_data_between(
+        cls,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: list[str] = None,
+        database: any = None,
+    ) -> pd.DataFrame:
+        """retrieve node data from start_date up to and including end_date, with only
+        columns if given, ordered by test time, from database if it is not the
+        project database
+        """
+        select_columns = ", ".join(columns) if columns else "*"
+        sql_string = (
+            f"SELECT {select_columns} FROM {cls.table_node_attributes} WHERE "
+            f"test_time >= :start_date AND test_time < :end_date "
+            f"ORDER BY test_time;"
+        )
+        return DbUtils.read_sql_query(
+            sql_string,
+            params=DbUtils.date_range(start_date, end_date),
+            database=database,
+        )
 
     @classmethod
     def get_node_data_by_node(cls, qtm_sn: str) -> pd.DataFrame:
@@ -283,10 +311,59 @@ class QuantumDb:
         arguments:
           qtm_sn: serial number of quantum node (str)
         returns:
-          pandas dataframe with node attributes for qtm_sn
+          pandas dataframe with node attributes for qtm_sn ordered by test time
+        """
+        sql_string = (
+            f"SELECT * FROM {cls.table_node_attributes} WHERE qtm_sn = :qtm_sn "
+            f"ORDER BY test_time;"
+        )
+        return DbUtils.read_sql_query(sql_string, params={"qtm_sn": str(qtm_sn)})
+
+    @classmethod
+    def get_node_history(cls, qtm_sns: list[str] = None) -> pd.DataFrame:
+        """retrieve the node data with the line and station of the deployment of the
+        nodes with serial numbers qtm_sns, of all nodes if None
+        returns:
+          pandas dataframe with node attributes ordered by serial number and test
+          time, along the index on (qtm_sn, test_time)
         """
-        engine = DbUtils().get_db_engine()
+        params = {f"qtm_sn_{i}": str(qtm_sn) for i, qtm_sn in enumerate(qtm_sns or [])}
+        where_sql = (
+            f"WHERE node.qtm_sn IN ({', '.join(f':{param}' for param in params)}) "
+            if qtm_sns
+            else ""
+        )
         sql_string = (
-            f"SELECT * FROM {cls.table_node_attributes} WHERE " f"qtm_sn = {qtm_sn};"
+            f"SELECT node.*, rcv.line, rcv.station "
+            f"FROM {cls.table_node_attributes} AS node "
+            f"INNER JOIN {cls.table_receivers} AS rcv ON rcv.id = node.id_point "
+            f"{where_sql}ORDER BY node.qtm_sn, node.test_time;"
+        )
+        return DbUtils.read_sql_query(sql_string, params=params)
+
+    @classmethod
+    def get_rcvr_points_in_bbox(
+        cls, bbox: tuple[float, float, float, float], columns: list[str] = None
+    ) -> pd.DataFrame:
+        """retrieve receiver points inside bbox (min_easting, min_northing,
+        max_easting, max_northing)
+        """
+        return DbUtils.get_within_bbox(cls.table_rcvr_points, bbox, columns=columns)
+
+    @classmethod
+    def get_rcvr_points_in_radius(
+        cls, easting: float, northing: float, radius: float, columns: list[str] = None
+    ) -> pd.DataFrame:
+        """retrieve receiver points within radius meters of (easting, northing)"""
+        return DbUtils.get_within_radius(
+            cls.table_rcvr_points, easting, northing, radius, columns=columns
+        )
+
+    @classmethod
+    def get_rcvr_points_in_polygon(
+        cls, polygon: any, columns: list[str] = None
+    ) -> pd.DataFrame:
+        """retrieve receiver points inside polygon, a shapely Polygon or its WKT"""
+        return DbUtils.get_within_polygon(
+            cls.table_rcvr_points, polygon, columns=columns
         )
-        return pd.read_sql_query(sql_string, con=engine)
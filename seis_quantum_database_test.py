@@ -0,0 +1,82 @@
+""" test the upsert of the receiver points on (line, station, rcvr_index) and the
+    changes of their coordinates, without the geometry so spatialite is not needed
+"""
+import pandas as pd
+import pytest
+from seis_database import DbUtils
+from seis_quantum_database import QuantumDb
+
+
+@pytest.fixture
+def rcvr_database(project_database):
+    with DbUtils.session() as connection:
+        connection.execute(
+            f"CREATE TABLE {QuantumDb.table_rcvr_points} (id INTEGER PRIMARY KEY, "
+            f"line INTEGER NOT NULL, rcvr_index INTEGER NOT NULL, "
+            f"station INTEGER NOT NULL, easting DOUBLE PRECISION, "
+            f"northing DOUBLE PRECISION, elevation REAL, "
+            f"UNIQUE (line, station, rcvr_index));"
+        )
+
+    return project_database
+
+
+def upsert(rcvr_df):
+    with DbUtils.session() as connection:
+        return DbUtils.bulk_insert(
+            connection.cursor(),
+            QuantumDb.table_rcvr_points,
+            QuantumDb.rcvr_columns,
+            rcvr_df,
+            upsert=QuantumDb.rcvr_keys,
+        )
+
+
+def rcvr_points():
+    with DbUtils.session() as connection:
+        return connection.execute(
+            f"SELECT id, {', '.join(QuantumDb.rcvr_columns)} "
+            f"FROM {QuantumDb.table_rcvr_points} ORDER BY id;"
+        ).fetchall()
+
+
+def rcvr_df(rows):
+    return pd.DataFrame(rows, columns=QuantumDb.rcvr_columns)
+
+
+def test_upsert_rcvr_points(rcvr_database):
+    assert (
+        upsert(
+            rcvr_df(
+                [
+                    (1001, 2002, 1, 500000.0, 2500000.0, 120.5),
+                    (1001, 2004, 1, 500050.0, 2500000.0, 121.5),
+                    (1001, 2004, 2, 500050.0, 2500001.0, 121.5),
+                ]
+            )
+        )
+        == 3
+    )
+    new_df = rcvr_df(
+        [
+            # unchanged
+            (1001, 2002, 1, 500000.0, 2500000.0, 120.5),
+            # re-surveyed
+            (1001, 2004, 1, 500053.0, 2500004.0, 121.5),
+            # new
+            (1003, 2002, 1, 500000.0, 2500100.0, 119.5),
+        ]
+    )
+    changes_df = QuantumDb.get_rcvr_point_changes(new_df)
+    assert changes_df[[*QuantumDb.rcvr_keys, "moved"]].values.tolist() == [
+        [1001, 2004, 1, 5.0]
+    ]
+    # only the new and the changed points are counted, the changed point keeps its id
+    assert upsert(new_df) == 2
+    assert rcvr_points() == [
+        (1, 1001, 2002, 1, 500000.0, 2500000.0, 120.5),
+        (2, 1001, 2004, 1, 500053.0, 2500004.0, 121.5),
+        (3, 1001, 2004, 2, 500050.0, 2500001.0, 121.5),
+        (4, 1003, 2002, 1, 500000.0, 2500100.0, 119.5),
+    ]
+    assert QuantumDb.get_rcvr_point_changes(new_df).empty
@@ -43,15 +43,62 @@ RESULTS_FOLDER = (
     PROJECT_PATH / files["RESULTS_FOLDER"] if files["RESULTS_FOLDER"] else None
 )
 DATABASE = PROJECT_PATH / files["DATABASE"]
+# queue depth and throughput of seis_watcher
+WATCH_STATUS_FILE = DATABASE.parent / "seis_watcher_status.json"
 
 FLEETS = seis_config["general"]["FLEETS"]
 SWEEP_TIME = seis_config["general"]["SWEEP_TIME"]
 PAD_DOWN_TIME = seis_config["general"]["PAD_DOWN_TIME"]
 # if distance < DENSE_CRITERIUM then dense_flag is true
 DENSE_CRITERIUM = seis_config["general"]["DENSE_CRITERIUM"]
+# number of lines read, parsed and stored at a time when reading vaps, vp and sps files
+CHUNK_SIZE = seis_config["general"].get("CHUNK_SIZE", 50_000)
+# number of rows per executemany when inserting records in the database
+BATCH_SIZE = seis_config["general"].get("BATCH_SIZE", 10_000)
+# number of processes parsing vaps, vp and sps files when a folder is read, 1 parses
+# the files one after another in the process that stores them
+PARSE_WORKERS = seis_config["general"].get("PARSE_WORKERS", 1)
+# seconds between scans of the data folders and number of files parsed at a time by
+# seis_watcher, a file is ingested once it is unchanged between two scans
+WATCH_INTERVAL = seis_config["general"].get("WATCH_INTERVAL", 5)
+WATCH_WORKERS = seis_config["general"].get("WATCH_WORKERS", 2)
+# keep a Parquet partition per table and production date of the vaps, vp and node
+# records for the plots and analyses, see seis_cache
+DATA_CACHE = seis_config["general"].get("DATA_CACHE", False)
+# rolling statistics of a node are over its last NODE_HISTORY_WINDOW deployments, it
+# drifts if the rolling mean of an attribute moves from the mean of its first
+# deployments by more than NODE_DRIFT_TOLERANCE of the plot range of the attribute
+NODE_HISTORY_WINDOW = seis_config["general"].get("NODE_HISTORY_WINDOW", 5)
+NODE_DRIFT_TOLERANCE = seis_config["general"].get("NODE_DRIFT_TOLERANCE", 0.2)
+# pragmas set on every database connection by profile, SQLITE_PROFILE is the profile
+# used unless an app selects another one, like bulk_load for backfills
+SQLITE_PROFILES = seis_config.get(
+    "sqlite_profiles",
+    {
+        "default": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -65536,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+            "busy_timeout": 10000,
+        },
+        "bulk_load": {
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -262144,
+            "mmap_size": 1073741824,
+            "temp_store": "MEMORY",
+            "busy_timeout": 60000,
+        },
+    },
+)
+SQLITE_PROFILE = seis_config["general"].get("SQLITE_PROFILE", "default")
 
 EXPIRY_DATE = datetime.date(2024, 8, 31)
 LINK_VP_TO_VAPS = False
+# max difference between the VP and VAPS time breaks to link them, 0 is an exact match
+LINK_TIME_TOLERANCE = datetime.timedelta(milliseconds=0)
 DATABASE_TABLE = "VAPS"
 PROGRESS_SKIPS = 750
 GMT_OFFSET = datetime.timedelta(hours=+4)
@@ -68,6 +115,9 @@ node_plt_settings = seis_config["node_plt_settings"]
 class FilesNodeTable:
     file_name: str
     file_date: datetime.datetime
+    file_size: int
+    file_mtime: float
+    file_hash: str
 
 
 @dataclass
@@ -132,6 +182,9 @@ class FilesVpTable:
     id: int
     file_name: str
     file_date: datetime.datetime
+    file_size: int
+    file_mtime: float
+    file_hash: str
 
 
 @dataclass
@@ -167,6 +220,11 @@ class FilesVapsTable:
     id: int
     file_name: str
     file_date: datetime.datetime
+    file_offset: int
+    last_signature: str
+    file_size: int
+    file_mtime: float
+    file_hash: str
 
 
 @dataclass
@@ -205,6 +263,9 @@ class FilesSpsTable:
     file_name: str
     file_date: datetime.datetime
     block_name: str
+    file_size: int
+    file_mtime: float
+    file_hash: str
 
 
 @dataclass
@@ -229,6 +290,9 @@ class FilesWeatherTable:
     id: int
     file_name: str
     file_date: datetime.datetime
+    file_size: int
+    file_mtime: float
+    file_hash: str
 
 
 @dataclass
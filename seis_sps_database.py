@@ -1,7 +1,5 @@
 import numpy as np
 import pandas as pd
-from shapely.geometry import Point
-import seis_utils
 from seis_settings import EPSG_PSD93
 from seis_database import DbUtils
 
@@ -9,6 +7,13 @@ from seis_database import DbUtils
 class SpsDb:
     table_sps_files = "sps_files"
     table_sps = "sps_records"
+    # secondary indexes {index name: columns}, see also seis_migrate_db
+    sps_indexes = {
+        "idx_sps_time_break": "time_break",
+        "idx_sps_vibrator_time_break": "vibrator, time_break",
+        "idx_sps_line_point": "line, point",
+        "idx_sps_file_id": "file_id",
+    }
 
     @classmethod
     def create_database(cls):
@@ -36,9 +41,14 @@ class SpsDb:
             f"id INTEGER PRIMARY KEY, "
             f"file_name VARCHAR(100), "
             f"file_date TIMESTAMP, "
-            f"block_name VARCHAR(10));"
+            f"block_name VARCHAR(10), "
+            f"file_key VARCHAR(100), "
+            f"file_size INTEGER, "
+            f"file_mtime REAL, "
+            f"file_hash VARCHAR(32));"
         )
         cursor.execute(sql_string)
+        DbUtils.create_file_registry(cursor, cls.table_sps_files)
         print(f"create table {cls.table_sps_files}")
 
     @classmethod
@@ -69,82 +79,81 @@ class SpsDb:
             f'"geom", {EPSG_PSD93}, "POINT", "XY");'
         )
         cursor.execute(sql_string)
+        DbUtils.create_spatial_index(cursor, cls.table_sps)
+        DbUtils.create_indexes(cursor, cls.table_sps, cls.sps_indexes)
 
         print(f"create table {cls.table_sps}")
 
     @classmethod
     @DbUtils.connect
-    def update_sps_file(cls, sps_file, cursor):
-        """method to to check if file_name exists in the database, if it does not then
-        add the filename to the data base
-        returns:
-        -1, if file is found
-        n, new file_id number if no file is found
+    def get_sps_file_signature(cls, file_name, block_name, cursor):
+        """returns (file_size, file_mtime, file_hash) the sps file of the block is
+        registered with, None if it is not in the database
         """
-        # check if file exists
-        sql_string = (
-            f"SELECT id FROM {cls.table_sps_files} WHERE "
-            f"file_name like '%{sps_file.file_name}' ;"
+        return DbUtils.get_file_signature(
+            cursor, cls.table_sps_files, file_name, block_name
         )
-        cursor.execute(sql_string)
-        try:
-            # check if id exists
-            _ = cursor.fetchone()[0]
-            return -1
 
-        except TypeError:
-            # no id was found so go on to create one
-            pass
-
-        sql_string = (
-            f"INSERT INTO {cls.table_sps_files} ("
-            f"file_name, file_date, block_name) "
-            f"VALUES (?, ?, ?); "
-        )
-        cursor.execute(
-            sql_string, (sps_file.file_name, sps_file.file_date, sps_file.block_name)
+    @classmethod
+    @DbUtils.connect
+    def update_sps_file(cls, sps_file, cursor):
+        """method to register the sps file on its block and name, the records of a
+        changed file are deleted, see DbUtils.register_file
+        returns:
+        -1, if the file is found and unchanged
+        n, file_id of the new or changed file
+        """
+        return DbUtils.register_file(
+            cursor,
+            cls.table_sps_files,
+            sps_file,
+            {cls.table_sps: "file_id"},
+            sps_file.block_name,
         )
-        return cursor.lastrowid
 
     @classmethod
     @DbUtils.connect
     def update_sps(cls, sps_records, cursor):
-        progress_message = seis_utils.progress_message_generator(
-            f"populate database for table: {cls.table_sps}                   "
+        sps_columns = [
+            "file_id",
+            "sps_type",
+            "line",
+            "point",
+            "point_index",
+            "source_type",
+            "easting",
+            "northing",
+            "elevation",
+            "dpg_filename",
+            "time_break",
+            "vibrator",
+        ]
+        DbUtils.bulk_insert(
+            cursor, cls.table_sps, sps_columns, sps_records, geometry=True
         )
 
-        sql_vp_record = (
-            f"INSERT INTO {cls.table_sps} ("
-            f"file_id, sps_type, line, point, point_index, source_type, "
-            f"easting, northing, elevation, dpg_filename, time_break, "
-            f"vibrator, geom) "
-            f'VALUES ({", ".join(["?"]*12)}, MakePoint(?, ?, ?));'
-        )
+    @classmethod
+    @DbUtils.connect
+    def get_last_id(cls, cursor):
+        """returns the highest id in table_sps, 0 if the table is empty"""
+        cursor.execute(f"SELECT MAX(id) FROM {cls.table_sps};")
+        return cursor.fetchone()[0] or 0
 
-        for sps_record in sps_records:
-            point = Point(sps_record.easting, sps_record.northing)
-
-            cursor.execute(
-                sql_vp_record,
-                (
-                    sps_record.file_id,
-                    sps_record.sps_type,
-                    sps_record.line,
-                    sps_record.point,
-                    sps_record.point_index,
-                    sps_record.source_type,
-                    sps_record.easting,
-                    sps_record.northing,
-                    sps_record.elevation,
-                    sps_record.dpg_filename,
-                    sps_record.time_break,
-                    sps_record.vibrator,
-                    point.x,
-                    point.y,
-                    EPSG_PSD93,
-                ),
-            )
-            next(progress_message)
+    @classmethod
+    @DbUtils.connect
+    def delete_duplicates(cls, file_id, last_id, dpg_filenames, cursor):
+        """delete the records of file_id with an id greater than last_id and a
+        dpg_filename in dpg_filenames. Used when reading a file in chunks to remove a
+        record that has a duplicate in a later chunk
+        """
+        sql_string = (
+            f"DELETE FROM {cls.table_sps} WHERE "
+            f"id > ? AND file_id = ? AND dpg_filename = ?;"
+        )
+        cursor.executemany(
+            sql_string,
+            [(last_id, file_id, dpg_filename) for dpg_filename in dpg_filenames],
+        )
 
     @classmethod
     def get_sps_data_by_time(cls, start_time, end_time):
@@ -157,13 +166,15 @@ class SpsDb:
         """
         assert end_time >= start_time, "end time must be greater equal than start time"
 
-        engine = DbUtils().get_db_engine()
         sql_string = (
             f"SELECT * FROM {cls.table_sps} WHERE "
-            f"time_break BETWEEN '{start_time}' AND '{end_time}' "
+            f"time_break BETWEEN :start_time AND :end_time "
             f"ORDER BY time_break;"
         )
-        return pd.read_sql_query(sql_string, con=engine)
+        return DbUtils.read_sql_query(
+            sql_string,
+            params={"start_time": str(start_time), "end_time": str(end_time)},
+        )
 
     @classmethod
     def get_sps_data_by_date(cls, production_date):
@@ -174,12 +185,13 @@ class SpsDb:
         returns:
           pandas dataframe with vp attributes for production_date
         """
-        engine = DbUtils().get_db_engine()
         sql_string = (
             f"SELECT * FROM {cls.table_sps} WHERE "
-            f'DATE(time_break) = \'{production_date.strftime("%Y-%m-%d")}\';'
+            f"time_break >= :start_date AND time_break < :end_date;"
+        )
+        return DbUtils.read_sql_query(
+            sql_string, params=DbUtils.date_range(production_date)
         )
-        return pd.read_sql_query(sql_string, con=engine)
 
     @classmethod
     def get_vp_data_by_line(cls, line):
@@ -189,11 +201,35 @@ class SpsDb:
         returns:
           pandas dataframe with all database attributes
         """
-        engine = DbUtils().get_db_engine()
         sql_string = (
             f"SELECT * FROM {cls.table_sps} WHERE " f"line = {line} ORDER BY station;"
         )
-        return pd.read_sql_query(sql_string, con=engine)
+        return DbUtils.read_sql_query(sql_string)
+
+    @classmethod
+    def get_sps_data_in_bbox(
+        cls, bbox: tuple[float, float, float, float], columns: list[str] = None
+    ) -> pd.DataFrame:
+        """retrieve sps data inside bbox (min_easting, min_northing, max_easting,
+        max_northing)
+        """
+        return DbUtils.get_within_bbox(cls.table_sps, bbox, columns=columns)
+
+    @classmethod
+    def get_sps_data_in_radius(
+        cls, easting: float, northing: float, radius: float, columns: list[str] = None
+    ) -> pd.DataFrame:
+        """retrieve sps data within radius meters of (easting, northing)"""
+        return DbUtils.get_within_radius(
+            cls.table_sps, easting, northing, radius, columns=columns
+        )
+
+    @classmethod
+    def get_sps_data_in_polygon(
+        cls, polygon: any, columns: list[str] = None
+    ) -> pd.DataFrame:
+        """retrieve sps data inside polygon, a shapely Polygon or its WKT"""
+        return DbUtils.get_within_polygon(cls.table_sps, polygon, columns=columns)
 
     @classmethod
     @DbUtils.connect
@@ -204,7 +240,6 @@ class SpsDb:
             f"INNER JOIN {cls.table_sps_files} as f ON f.id = r.file_id "
             f'WHERE f.block_name = "{block_name}";'
         )
-        engine = DbUtils().get_db_engine()
-        sps_df = pd.read_sql_query(sql_string, con=engine)
+        sps_df = DbUtils.read_sql_query(sql_string)
 
         return sps_df
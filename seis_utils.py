@@ -2,13 +2,27 @@
 """
 import warnings
 import sys
+import time
 import datetime
+import itertools
+import collections
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from ntplib import NTPClient
 from progress.bar import Bar
 from seis_settings import EXPIRY_DATE
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
+# lookup tables by ascii code for decoding fixed width numbers, whitespace is what
+# int() and float() strip plus nul, which pads the lines of a character matrix
+WHITESPACE_TABLE = np.isin(np.arange(256), [0, 9, 10, 11, 12, 13, 32])
+DIGIT_TABLE = np.full(256, -1, dtype=np.int64)
+DIGIT_TABLE[48:58] = np.arange(10)
+# integers up to 15 digits are exact in a double
+MAX_DECODE_DIGITS = 15
+# bytes of the head and the tail of a file in its content hash
+FILE_HASH_SAMPLE = 1 << 20
 
 
 def set_progress_bar(max_value, filename, skip_factor):
@@ -128,6 +142,298 @@ def status_message_generator(key):
         key = key if received is None else received
 
 
+def epoch_ms_to_local(epoch_ms):
+    """vectorised equivalent of datetime.datetime.fromtimestamp(ms * 0.001) for an
+    array of epoch milliseconds, returns naive local times as datetime64[ms].
+    The utc offset is looked up once per quarter of an hour, the resolution at which
+    time zones change their offset
+    """
+    epoch_ms = np.asarray(epoch_ms, dtype=np.int64)
+    quarters, inverse = np.unique(epoch_ms // 900_000, return_inverse=True)
+    offsets = np.array(
+        [time.localtime(quarter * 900).tm_gmtoff for quarter in quarters.tolist()],
+        dtype=np.int64,
+    )
+    return (epoch_ms + offsets[inverse.ravel()] * 1000).astype("datetime64[ms]")
+
+
+def fixed_width_matrix(text_lines, width):
+    """convert text_lines to a character matrix of shape (len(text_lines), width),
+    lines are truncated or padded with nul characters to width
+    """
+    text_array = np.array(text_lines, dtype=f"U{width}")
+    return text_array.view("U1").reshape(len(text_lines), width)
+
+
+def fixed_width_field(char_matrix, start, end, dtype=str):
+    """vectorised equivalent of dtype(text_line[start:end]) for every line of a
+    character matrix made by fixed_width_matrix, dtype is str, int or float.
+    Plain decimal numbers are decoded with digit arithmetic, which gives the same
+    (correctly rounded) result as the python conversion. Anything else, like
+    exponents or invalid text, falls back to the python conversion for that line.
+    returns:
+      values: numpy array of the converted field
+      valid: boolean numpy array, False where the conversion raised a ValueError or
+        an int does not fit in 64 bits, as sqlite cannot store it
+    """
+    field = char_matrix[:, start:end]
+    rows, width = field.shape
+    valid = np.ones(rows, dtype=bool)
+    if dtype is str:
+        text = np.ascontiguousarray(field).view(f"U{width}").ravel()
+        return text.astype(object), valid
+
+    # ascii codes by column, anything beyond ascii is mapped to 255
+    codes = np.minimum(field.view(np.uint32), 255).astype(np.uint8).T.copy()
+    mantissa = np.zeros(rows, dtype=np.int64)
+    n_digits = np.zeros(rows, dtype=np.int64)
+    decimals = np.zeros(rows, dtype=np.int64)
+    started = np.zeros(rows, dtype=bool)
+    ended = np.zeros(rows, dtype=bool)
+    has_point = np.zeros(rows, dtype=bool)
+    negative = np.zeros(rows, dtype=bool)
+    decoded = np.ones(rows, dtype=bool)
+    for column in codes:
+        is_space = WHITESPACE_TABLE[column]
+        digit = DIGIT_TABLE[column]
+        is_digit = digit >= 0
+        is_sign = (column == 43) | (column == 45)
+        is_point = (column == 46) & (dtype is float)
+
+        # a sign is only allowed as the first character of the number
+        first = ~started & ~is_space
+        negative |= first & (column == 45)
+        in_number = started & ~ended | first & ~is_sign
+        decoded &= ~(ended & ~is_space)
+        decoded &= ~(in_number & ~is_space & ~is_digit & ~is_point)
+        decoded &= ~(in_number & is_point & has_point)
+        mantissa = np.where(in_number & is_digit, mantissa * 10 + digit, mantissa)
+        n_digits += in_number & is_digit
+        decimals += in_number & is_digit & has_point
+        has_point |= in_number & is_point
+        ended |= started & is_space
+        started |= first
+
+    decoded &= (n_digits > 0) & (n_digits <= MAX_DECODE_DIGITS)
+    if dtype is float:
+        values = mantissa / np.power(10.0, decimals)
+
+    else:
+        values = mantissa
+
+    values = np.where(negative, -values, values)
+    for i in np.flatnonzero(~decoded).tolist():
+        try:
+            values[i] = dtype(str(np.ascontiguousarray(field[i]).view(f"U{width}")[0]))
+
+        except (ValueError, OverflowError):
+            valid[i] = False
+
+    return values, valid
+
+
+def fixed_width_datetime(char_matrix, fields, separators=None, unit="ms"):
+    """vectorised decoding of timestamps made of fixed width digit fields of every
+    line of a character matrix made by fixed_width_matrix.
+    arguments:
+      fields: {name: (start, end)} with the names year, month, day, hour, minute,
+        second and optionally fraction, the fraction is the number of unit. A year of
+        2 digits is taken as by strptime %y, 69 - 99 in the 1900s and 00 - 68 in the
+        2000s. Other names, like the century of a 4 digit year only used by its last 2
+        digits, are only checked to be digits
+      separators: {position: character} the lines must have
+      unit: unit of the fraction and of the returned datetime64
+    Only lines with digits in all fields, the separators and a valid date and time
+    are decoded, the caller parses the other lines as it did before
+    returns:
+      times: numpy datetime64 array of the timestamps, NaT where not decoded
+      decoded: boolean numpy array, False where the line could not be decoded
+    """
+    rows = char_matrix.shape[0]
+    decoded = np.ones(rows, dtype=bool)
+    values = {}
+    for name, (start, end) in fields.items():
+        codes = np.minimum(char_matrix[:, start:end].view(np.uint32), 255)
+        digits = DIGIT_TABLE[codes]
+        decoded &= (digits >= 0).all(axis=1)
+        values[name] = digits @ 10 ** np.arange(end - start - 1, -1, -1)
+
+    for position, separator in (separators or {}).items():
+        decoded &= char_matrix[:, position] == separator
+
+    year = values["year"]
+    if fields["year"][1] - fields["year"][0] == 2:
+        year = np.where(year < 69, 2000 + year, 1900 + year)
+
+    if "century" in values:
+        # strptime %Y does not take year 0
+        decoded &= values["century"] * 100 + values["year"] > 0
+
+    month, day = values["month"], values["day"]
+    hour, minute, second = values["hour"], values["minute"], values["second"]
+    decoded &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    decoded &= (hour < 24) & (minute < 60) & (second < 60)
+
+    # the day must exist in its month, like the 29th of February of a leap year
+    months = np.where(decoded, (year - 1970) * 12 + month - 1, 0).astype(
+        "datetime64[M]"
+    )
+    days = months.astype("datetime64[D]") + np.where(decoded, day - 1, 0)
+    decoded &= days.astype("datetime64[M]") == months
+
+    times = days.astype(f"datetime64[{unit}]") + (
+        (hour * 3600 + minute * 60 + second) * np.timedelta64(1, "s")
+    ).astype(f"timedelta64[{unit}]")
+    if "fraction" in values:
+        times += values["fraction"].astype(f"timedelta64[{unit}]")
+
+    times[~decoded] = np.datetime64("NaT")
+    return times, decoded
+
+
+def read_lines(binary_file, start, end):
+    """generator yielding the lines of binary_file from byte offset start up to byte
+    offset end as text with universal newlines
+    """
+    binary_file.seek(start)
+    position = start
+    for line in binary_file:
+        position += len(line)
+        if position > end:
+            break
+
+        yield line.decode().replace("\r\n", "\n")
+
+
+def last_complete_line(binary_file, end, block_size=4096):
+    """returns the byte offset just after the last newline in the first end bytes of
+    binary_file and the text of the line ending there, (0, "") if there is none
+    """
+    position = end
+    data = b""
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        binary_file.seek(position)
+        data = binary_file.read(read_size) + data
+        line_end = data.rfind(b"\n")
+        if line_end == -1:
+            continue
+
+        line_start = data.rfind(b"\n", 0, line_end) + 1
+        if line_start > 0 or position == 0:
+            line = data[line_start:line_end].decode().rstrip("\r")
+            return position + line_end + 1, line
+
+    return 0, ""
+
+
+def read_chunks(text_file, chunk_size):
+    """generator yielding lists of at most chunk_size lines of text_file"""
+    while chunk := list(itertools.islice(text_file, chunk_size)):
+        yield chunk
+
+
+def file_hash(filename, sample_size=FILE_HASH_SAMPLE):
+    """fast content hash of the file, blake2b of its size and its first and last
+    sample_size bytes, files up to twice sample_size are hashed completely
+    """
+    file_size = filename.stat().st_size
+    content_hash = hashlib.blake2b(str(file_size).encode(), digest_size=16)
+    with open(filename, mode="rb") as binary_file:
+        content_hash.update(binary_file.read(sample_size))
+        if file_size > sample_size:
+            binary_file.seek(max(sample_size, file_size - sample_size))
+            content_hash.update(binary_file.read(sample_size))
+
+    return content_hash.hexdigest()
+
+
+def file_signature(filename, registered=None):
+    """returns the (size, mtime, hash) of the file and whether it is unchanged from
+    registered, the (size, mtime, hash) the file is registered with in the database or
+    None. The file is only hashed if its size or mtime differ from registered, it is
+    unchanged if its size and hash are the same. A file registered before the hash was
+    kept is taken as unchanged
+    """
+    if registered and registered[2] is None:
+        return registered, True
+
+    stat = filename.stat()
+    if registered and tuple(registered[:2]) == (stat.st_size, stat.st_mtime):
+        return registered, True
+
+    content_hash = file_hash(filename)
+    is_unchanged = bool(registered) and (registered[0], registered[2]) == (
+        stat.st_size,
+        content_hash,
+    )
+    return (stat.st_size, stat.st_mtime, content_hash), is_unchanged
+
+
+def report_rejects(filename, rejects_df):
+    """print the number of rows of filename that have been rejected by reason and
+    write the rows with their reason to rejects/<file name>_rejects.csv in the folder
+    of filename, rejects_df has the reason of each row in the column reason
+    """
+    if rejects_df.empty:
+        return
+
+    print(f"\n{len(rejects_df)} rows of {filename.name} have been rejected:")
+    for reason, count in rejects_df["reason"].value_counts().items():
+        print(f"  {count}: {reason}")
+
+    rejects_folder = filename.parent / "rejects"
+    rejects_folder.mkdir(exist_ok=True)
+    rejects_file = rejects_folder / f"{filename.stem}_rejects.csv"
+    rejects_df.to_csv(rejects_file, index=False)
+    print(f"rejected rows written to {rejects_file}")
+
+
+def parallel_parse(parse_file, files_args, workers):
+    """generator of parse_file(*file_args) for each file_args in files_args, in order.
+    With workers > 1 the files are parsed in a pool of that many processes up to
+    2 * workers files ahead of the file yielded, so the caller can store the files in
+    order in its own process while the next files are parsed. parse_file, its
+    arguments and its result must then be picklable
+    """
+    if workers <= 1:
+        for file_args in files_args:
+            yield parse_file(*file_args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsed_files = collections.deque()
+        for file_args in files_args:
+            parsed_files.append(executor.submit(parse_file, *file_args))
+            if len(parsed_files) >= 2 * workers:
+                yield parsed_files.popleft().result()
+
+        while parsed_files:
+            yield parsed_files.popleft().result()
+
+
+class RecordSignatures:
+    """signatures of the records in earlier chunks of a file, only a 64 bit hash is
+    kept per signature so memory use stays small regardless of the file size
+    """
+
+    def __init__(self):
+        self.hashes = np.array([], dtype=np.int64)
+
+    def update(self, signatures):
+        """add signatures, returns the list of signatures that were seen before"""
+        signatures = list(signatures)
+        hashes = np.fromiter(
+            (hash(signature) for signature in signatures),
+            dtype=np.int64,
+            count=len(signatures),
+        )
+        seen = np.isin(hashes, self.hashes)
+        self.hashes = np.union1d(self.hashes, hashes)
+        return [signature for signature, is_seen in zip(signatures, seen) if is_seen]
+
+
 def get_line():
     ASK_LINE = "Enter line number [q - quit]: "
 
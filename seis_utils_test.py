@@ -0,0 +1,225 @@
+""" test the vectorised fixed width parse of seis_utils against the python
+    conversion of the slices of the lines and the strptime it replaces, and the
+    signatures of the records of earlier chunks
+"""
+import math
+import datetime
+import pytest
+import seis_utils
+
+
+def python_field(text_lines, start, end, dtype):
+    """dtype(line[start:end]) of each line, None where it raises a ValueError"""
+    values = []
+    for text_line in text_lines:
+        try:
+            values.append(dtype(text_line[start:end]))
+
+        except ValueError:
+            values.append(None)
+
+    return values
+
+
+def assert_field_matches_python(text_lines, start, end, dtype, width=12):
+    char_matrix = seis_utils.fixed_width_matrix(text_lines, width)
+    values, valid = seis_utils.fixed_width_field(char_matrix, start, end, dtype)
+    expected = python_field(text_lines, start, end, dtype)
+    assert valid.tolist() == [value is not None for value in expected]
+    for value, is_valid, expected_value in zip(values.tolist(), valid, expected):
+        if is_valid:
+            assert type(value) is dtype
+            assert value == expected_value or (
+                math.isnan(value) and math.isnan(expected_value)
+            )
+
+
+FIELDS = [
+    # space padded
+    "A  123  xyz",
+    "A123     xyz",
+    "A     7 xyz",
+    "A\t  42\txyz",
+    # signed
+    "A  -42  xyz",
+    "A  +42  xyz",
+    "A -0    xyz",
+    "A-00012 xyz",
+    # blank and short lines
+    "A       xyz",
+    "A",
+    "A  12",
+    "",
+    # invalid
+    "A  1 2  xyz",
+    "A  --4  xyz",
+    "A  4-   xyz",
+    "A  0x1f xyz",
+    "A   -   xyz",
+    # beyond ascii, left to the python conversion
+    "A  ٣١  xyz",
+    "A  12  xyz",
+]
+
+
+@pytest.mark.parametrize("start, end", [(1, 8), (1, 4), (3, 6), (0, 12)])
+def test_int_field_matches_int(start, end):
+    assert_field_matches_python(FIELDS, start, end, int)
+
+
+@pytest.mark.parametrize("start, end", [(1, 8), (3, 6)])
+def test_float_field_matches_float(start, end):
+    assert_field_matches_python(
+        FIELDS
+        + [
+            "A 12.5   xyz",
+            "A -0.125 xyz",
+            "A  .5    xyz",
+            "A  5.    xyz",
+            "A 1.2.3  xyz",
+            "A  1e3   xyz",
+            "A  NaN   xyz",
+            "A -inf   xyz",
+            "A  .     xyz",
+        ],
+        start,
+        end,
+        float,
+    )
+
+
+def test_int_field_of_many_digits():
+    # more digits than are decoded with int64 arithmetic are left to int
+    assert_field_matches_python(
+        ["9" * 15, "-" + "9" * 18, "1" + "0" * 17], 0, 20, int, width=20
+    )
+    # an int that does not fit in 64 bits is not valid
+    char_matrix = seis_utils.fixed_width_matrix(["9" * 20, "1" * 19], 20)
+    _, valid = seis_utils.fixed_width_field(char_matrix, 0, 20, int)
+    assert valid.tolist() == [False, True]
+
+
+def test_str_field():
+    char_matrix = seis_utils.fixed_width_matrix(["A  OK  ", "B"], 7)
+    values, valid = seis_utils.fixed_width_field(char_matrix, 1, 5)
+    assert values.tolist() == ["  OK", ""]
+    assert valid.all()
+
+
+def python_datetime(text_line, time_format, fraction):
+    """the strptime of the date and time of the line plus its milliseconds, None
+    where it raises a ValueError. As the parse of the vp lines a year of 4 digits is
+    kept by its last 2 digits only
+    """
+    try:
+        time_break = datetime.datetime.strptime(text_line[: fraction[0]], time_format)
+        time_break = datetime.datetime.strptime(
+            time_break.strftime("%y%m%d%H%M%S"), "%y%m%d%H%M%S"
+        )
+        return time_break + datetime.timedelta(
+            milliseconds=int(text_line[slice(*fraction)])
+        )
+
+    except ValueError:
+        return None
+
+
+@pytest.mark.parametrize(
+    "text_lines, fields, separators, time_format, left_to_strptime",
+    [
+        (
+            [
+                "2021-03-05 10:20:30.123",
+                "2024-02-29 23:59:59.999",
+                "1999-12-31 00:00:00.000",
+                # the year is kept by its last 2 digits only
+                "0001-01-01 00:00:00.000",
+                "2070-01-01 12:00:00.000",
+                "1968-06-30 12:00:00.000",
+                # not a valid date or time
+                "2023-02-29 10:20:30.123",
+                "2021-04-31 10:20:30.123",
+                "2021-00-05 10:20:30.123",
+                "2021-03-00 10:20:30.123",
+                "2021-03-05 24:00:00.000",
+                "2021-03-05 10:60:30.123",
+                "2021-03-05 10:20:60.123",
+                "0000-03-05 10:20:30.123",
+                # not plain digits or separators, some strptime takes
+                "2021/03/05 10:20:30.123",
+                "2021-03-05T10:20:30.123",
+                "2021-03- 5 10:20:30.123",
+                "2021-03-05 10:20:30.12",
+                "2021-03-05 10:20:30.-12",
+                "2021-03-05",
+            ],
+            {
+                "century": (0, 2),
+                "year": (2, 4),
+                "month": (5, 7),
+                "day": (8, 10),
+                "hour": (11, 13),
+                "minute": (14, 16),
+                "second": (17, 19),
+                "fraction": (20, 23),
+            },
+            {4: "-", 7: "-", 10: " ", 13: ":", 16: ":", 19: "."},
+            "%Y-%m-%d %H:%M:%S.",
+            [16, 17, 18],
+        ),
+        (
+            [
+                "210305102030123",
+                "680101000000000",
+                "690101000000000",
+                "991231235959999",
+                "000229000000000",
+                "010229000000000",
+                "2103051020301x3",
+                "21030510203",
+            ],
+            {
+                "year": (0, 2),
+                "month": (2, 4),
+                "day": (4, 6),
+                "hour": (6, 8),
+                "minute": (8, 10),
+                "second": (10, 12),
+                "fraction": (12, 15),
+            },
+            None,
+            "%y%m%d%H%M%S",
+            [],
+        ),
+    ],
+)
+def test_datetime_matches_strptime(
+    text_lines, fields, separators, time_format, left_to_strptime
+):
+    char_matrix = seis_utils.fixed_width_matrix(text_lines, 23)
+    times, decoded = seis_utils.fixed_width_datetime(char_matrix, fields, separators)
+    expected = [
+        python_datetime(text_line, time_format, fields["fraction"])
+        for text_line in text_lines
+    ]
+    assert decoded.tolist() == [
+        time is not None and i not in left_to_strptime
+        for i, time in enumerate(expected)
+    ]
+    for time, is_decoded, expected_time in zip(times.tolist(), decoded, expected):
+        assert time == expected_time if is_decoded else time is None
+
+
+def test_record_signatures_of_earlier_chunks():
+    signatures = seis_utils.RecordSignatures()
+    assert signatures.update([(1001, 2002, 7), (1001, 2002, 8)]) == []
+    # only the signatures of an earlier chunk are returned, in the order of the chunk
+    assert signatures.update(
+        iter([(1001, 2004, 7), (1001, 2002, 8), (1001, 2002, 7)])
+    ) == [(1001, 2002, 8), (1001, 2002, 7)]
+    assert signatures.update([]) == []
+    assert signatures.update([(1001, 2004, 7), (1001, 2004, 8)]) == [(1001, 2004, 7)]
+    assert len(signatures.hashes) == 4
+    # the dpg filenames of the sps records are signatures too
+    assert signatures.update(["210305_102030123_07"]) == []
+    assert signatures.update(["210305_102030123_07"]) == ["210305_102030123_07"]
@@ -1,14 +1,14 @@
 import datetime
 import numpy as np
 import pandas as pd
-from shapely.geometry import Point
-import seis_utils
 from seis_settings import (
     FLEETS,
     SWEEP_TIME,
     PAD_DOWN_TIME,
     DENSE_CRITERIUM,
     EPSG_PSD93,
+    LINK_TIME_TOLERANCE,
+    vp_plt_settings,
     VapsTable,
     VpTable,
 )
@@ -20,6 +20,78 @@ class VpDb:
     table_vp = "vp_records"
     table_vaps_files = "vaps_files"
     table_vaps = "vaps_records"
+    # vaps summaries by (production_date, vibrator) and (production_date, hour,
+    # vibrator), the groups of deleted or updated records are marked in
+    # table_vaps_dirty by a trigger and computed again, see update_vaps_summary
+    table_vaps_daily = "vaps_daily_summary"
+    table_vaps_hourly = "vaps_hourly_summary"
+    table_vaps_dirty = "vaps_summary_dirty"
+    summary_attributes = [
+        "avg_phase",
+        "peak_phase",
+        "avg_dist",
+        "peak_dist",
+        "avg_force",
+        "peak_force",
+    ]
+    # secondary indexes {index name: columns}, see also seis_migrate_db
+    vp_indexes = {
+        "idx_vp_time_break": "time_break",
+        "idx_vp_vibrator_time_break": "vibrator, time_break",
+        "idx_vp_line_station": "line, station",
+        "idx_vp_file_id": "file_id",
+    }
+    vaps_indexes = {
+        "idx_vaps_time_break": "time_break",
+        "idx_vaps_vibrator_time_break": "vibrator, time_break",
+        "idx_vaps_line_point": "line, point",
+        "idx_vaps_file_id": "file_id",
+    }
+    # table columns and the corresponding VpTable and VapsTable attributes
+    vp_columns = {
+        "file_id": "file_id",
+        "vaps_id": "vaps_id",
+        "line": "line",
+        "station": "station",
+        "vibrator": "vibrator",
+        "time_break": "time_break",
+        "planned_easting": "planned_easting",
+        "planned_northing": "planned_northing",
+        "easting": "easting",
+        "northing": "northing",
+        "elevation": "elevation",
+        "_offset": "offset",
+        "peak_force": "peak_force",
+        "avg_force": "avg_force",
+        "peak_dist": "peak_dist",
+        "avg_dist": "avg_dist",
+        "peak_phase": "peak_phase",
+        "avg_phase": "avg_phase",
+        "qc_flag": "qc_flag",
+    }
+    vaps_columns = {
+        "file_id": "file_id",
+        "line": "line",
+        "point": "station",
+        "fleet_nr": "fleet_nr",
+        "vibrator": "vibrator",
+        "drive": "drive",
+        "avg_phase": "avg_phase",
+        "peak_phase": "peak_phase",
+        "avg_dist": "avg_dist",
+        "peak_dist": "peak_dist",
+        "avg_force": "avg_force",
+        "peak_force": "peak_force",
+        "avg_stiffness": "avg_stiffness",
+        "avg_viscosity": "avg_viscosity",
+        "easting": "easting",
+        "northing": "northing",
+        "elevation": "elevation",
+        "time_break": "time_break",
+        "hdop": "hdop",
+        "tb_date": "tb_date",
+        "positioning": "positioning",
+    }
 
     @classmethod
     @DbUtils.connect
@@ -56,10 +128,15 @@ class VpDb:
             f"CREATE TABLE {cls.table_vp_files} ("
             f"id INTEGER PRIMARY KEY, "
             f"file_name VARCHAR(100), "
-            f"file_date TIMESTAMP);"
+            f"file_date TIMESTAMP, "
+            f"file_key VARCHAR(100), "
+            f"file_size INTEGER, "
+            f"file_mtime REAL, "
+            f"file_hash VARCHAR(32));"
         )
 
         cursor.execute(sql_string)
+        DbUtils.create_file_registry(cursor, cls.table_vp_files)
         print(f"create table {cls.table_vp_files}")
 
     @classmethod
@@ -101,6 +178,8 @@ class VpDb:
             f'"geom", {EPSG_PSD93}, "POINT", "XY");'
         )
         cursor.execute(sql_string)
+        DbUtils.create_spatial_index(cursor, cls.table_vp)
+        DbUtils.create_indexes(cursor, cls.table_vp, cls.vp_indexes)
 
         print(f"create table {cls.table_vp}")
 
@@ -111,10 +190,17 @@ class VpDb:
             f"CREATE TABLE {cls.table_vaps_files} ("
             f"id INTEGER PRIMARY KEY, "
             f"file_name VARCHAR(100), "
-            f"file_date TIMESTAMP);"
+            f"file_date TIMESTAMP, "
+            f"file_offset INTEGER, "
+            f"last_signature VARCHAR(255), "
+            f"file_key VARCHAR(100), "
+            f"file_size INTEGER, "
+            f"file_mtime REAL, "
+            f"file_hash VARCHAR(32));"
         )
 
         cursor.execute(sql_string)
+        DbUtils.create_file_registry(cursor, cls.table_vaps_files)
         print(f"create table {cls.table_vaps_files}")
 
     @classmethod
@@ -157,183 +243,350 @@ class VpDb:
             f'"geom", {EPSG_PSD93}, "POINT", "XY");'
         )
         cursor.execute(sql_string)
+        DbUtils.create_spatial_index(cursor, cls.table_vaps)
+        DbUtils.create_indexes(cursor, cls.table_vaps, cls.vaps_indexes)
+        cls.create_vaps_summary(cursor)
 
         print(f"create table {cls.table_vaps}")
 
     @classmethod
-    @DbUtils.connect
-    def update_vp_file(cls, vp_file, cursor):
-        """method to to check if file_name exists in the database, if it does not then
-        add the filename to the data base
-        returns:
-        -1, if file is found
-        n, new file_id number if no file is found
+    def summary_aggregates(cls) -> dict[str, str]:
+        """{column: aggregate} of the vaps summaries. Per attribute the count, sum, sum
+        of squares, min, max and the number of records out of the tolerances of
+        vp_plt_settings
         """
-        # check if file exists
-        sql_string = (
-            f"SELECT id FROM {cls.table_vp_files} WHERE "
-            f"file_name like '%{vp_file.file_name}' ;"
-        )
-        cursor.execute(sql_string)
-        try:
-            # check if id exists
-            _ = cursor.fetchone()[0]
-            return -1
-
-        except TypeError:
-            # no id was found so go on to create one
-            pass
+        aggregates = {"records": "COUNT(*)"}
+        for attribute in cls.summary_attributes:
+            setting = vp_plt_settings[attribute]
+            out_of_spec = [
+                f"{attribute} {operator} {setting[tolerance]}"
+                for tolerance, operator in [("tol_min", "<"), ("tol_max", ">")]
+                if setting.get(tolerance) is not None
+            ]
+            aggregates.update(
+                {
+                    f"{attribute}_count": f"COUNT({attribute})",
+                    f"{attribute}_sum": f"TOTAL({attribute})",
+                    f"{attribute}_sum_sq": f"TOTAL({attribute} * {attribute})",
+                    f"{attribute}_min": f"MIN({attribute})",
+                    f"{attribute}_max": f"MAX({attribute})",
+                    f"{attribute}_out_of_spec": (
+                        f"COUNT(CASE WHEN {' OR '.join(out_of_spec)} THEN 1 END)"
+                        if out_of_spec
+                        else "0"
+                    ),
+                }
+            )
+        return aggregates
 
-        sql_string = (
-            f"INSERT INTO {cls.table_vp_files} ("
-            f"file_name, file_date) "
-            f"VALUES (?, ?); "
-        )
-        cursor.execute(sql_string, (vp_file.file_name, vp_file.file_date))
+    @classmethod
+    def summary_groups(cls, hourly: bool) -> dict[str, str]:
+        """{column: expression} of the keys of the daily or hourly summary"""
+        groups = {"production_date": "DATE(r.time_break)"}
+        if hourly:
+            groups["hour"] = "CAST(STRFTIME('%H', r.time_break) AS INTEGER)"
 
-        return cursor.lastrowid
+        groups["vibrator"] = "r.vibrator"
+        return groups
 
     @classmethod
-    @DbUtils.connect
-    def update_vp(cls, vp_records: VpTable, cursor: any, link_vaps=False) -> None:
-        progress_message = seis_utils.progress_message_generator(
-            f"populate database for table: {cls.table_vp}                   "
-        )
+    def create_vaps_summary(cls, cursor: any) -> None:
+        """create the summary tables and the triggers that mark the groups of deleted
+        or updated vaps records, and compute the summaries of the vaps records in the
+        table
+        """
+        for table, hourly in [
+            (cls.table_vaps_daily, False),
+            (cls.table_vaps_hourly, True),
+        ]:
+            groups = cls.summary_groups(hourly)
+            definitions = [
+                f"{column} {'DATE' if column == 'production_date' else 'INTEGER'}"
+                for column in groups
+            ]
+            for column in cls.summary_aggregates():
+                is_count = column == "records" or column.endswith(
+                    ("_count", "_out_of_spec")
+                )
+                definitions.append(f"{column} {'INTEGER' if is_count else 'REAL'}")
 
-        sql_vp_record = (
-            f"INSERT INTO {cls.table_vp} ("
-            f"file_id, vaps_id, line, station, vibrator, time_break, "
-            f"planned_easting, planned_northing, easting, northing, elevation, _offset, "
-            f"peak_force, avg_force, peak_dist, avg_dist, peak_phase, avg_phase, "
-            f'qc_flag, geom) VALUES ({", ".join(["?"]*19)}, MakePoint(?, ?, ?));'
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(definitions)}, "
+                f"PRIMARY KEY ({', '.join(groups)}));"
+            )
+
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {cls.table_vaps_dirty} ("
+            f"production_date DATE, vibrator INTEGER, "
+            f"PRIMARY KEY (production_date, vibrator));"
+        )
+        mark_dirty = (
+            f"INSERT OR IGNORE INTO {cls.table_vaps_dirty} "
+            f"SELECT DATE(old.time_break), old.vibrator "
+            f"WHERE old.time_break NOT NULL AND old.vibrator NOT NULL;"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {cls.table_vaps}_summary_delete "
+            f"AFTER DELETE ON {cls.table_vaps} BEGIN {mark_dirty} END;"
         )
-        for vp_record in vp_records:
-            point = Point(vp_record.easting, vp_record.northing)
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {cls.table_vaps}_summary_update "
+            f"AFTER UPDATE OF time_break, vibrator, "
+            f"{', '.join(cls.summary_attributes)} ON {cls.table_vaps} BEGIN "
+            f"{mark_dirty} "
+            f"{mark_dirty.replace('old.', 'new.')} END;"
+        )
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {cls.table_vaps_dirty} "
+            f"SELECT DISTINCT DATE(time_break), vibrator FROM {cls.table_vaps} "
+            f"WHERE time_break NOT NULL AND vibrator NOT NULL;"
+        )
+        cls.update_vaps_summary(cursor)
 
-            if link_vaps:
-                vp_record = cls.get_vaps_id(vp_record)
+    @classmethod
+    def update_vaps_summary(cls, cursor: any, last_id: int = None) -> None:
+        """add the vaps records with an id greater than last_id to the summaries and
+        compute the groups marked in table_vaps_dirty again from the records, so the
+        summaries change in the same transaction as the records. Without last_id only
+        the marked groups are computed again
+        """
+        aggregates = cls.summary_aggregates()
+        for table, hourly in [
+            (cls.table_vaps_daily, False),
+            (cls.table_vaps_hourly, True),
+        ]:
+            groups = cls.summary_groups(hourly)
+            select_columns = ", ".join(
+                f"{expression} AS {column}"
+                for column, expression in {**groups, **aggregates}.items()
+            )
+            columns = ", ".join([*groups, *aggregates])
+            if last_id is not None:
+                merge = []
+                for column in aggregates:
+                    excluded = f"excluded.{column}"
+                    if column.endswith(("_min", "_max")):
+                        function = column[-3:].upper()
+                        merge.append(
+                            f"{column} = {function}(COALESCE({column}, {excluded}), "
+                            f"COALESCE({excluded}, {column}))"
+                        )
+                    else:
+                        merge.append(f"{column} = {column} + {excluded}")
+
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) "
+                    f"SELECT {select_columns} FROM {cls.table_vaps} AS r "
+                    f"WHERE r.id > ? AND r.time_break NOT NULL AND r.vibrator NOT NULL "
+                    f"AND (DATE(r.time_break), r.vibrator) NOT IN "
+                    f"(SELECT production_date, vibrator FROM {cls.table_vaps_dirty}) "
+                    f"GROUP BY {', '.join(groups.values())} "
+                    f"ON CONFLICT ({', '.join(groups)}) DO UPDATE SET "
+                    f"{', '.join(merge)};",
+                    (last_id,),
+                )
 
             cursor.execute(
-                sql_vp_record,
-                (
-                    vp_record.file_id,
-                    vp_record.vaps_id,
-                    vp_record.line,
-                    vp_record.station,
-                    vp_record.vibrator,
-                    vp_record.time_break,
-                    vp_record.planned_easting,
-                    vp_record.planned_northing,
-                    vp_record.easting,
-                    vp_record.northing,
-                    vp_record.elevation,
-                    vp_record.offset,
-                    vp_record.peak_force,
-                    vp_record.avg_force,
-                    vp_record.peak_dist,
-                    vp_record.avg_dist,
-                    vp_record.peak_phase,
-                    vp_record.avg_phase,
-                    vp_record.qc_flag,
-                    point.x,
-                    point.y,
-                    EPSG_PSD93,
-                ),
+                f"DELETE FROM {table} WHERE (production_date, vibrator) IN "
+                f"(SELECT production_date, vibrator FROM {cls.table_vaps_dirty});"
+            )
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) {cls.dirty_summary_sql(hourly)};"
             )
 
-            next(progress_message)
+        cursor.execute(f"DELETE FROM {cls.table_vaps_dirty};")
+
+    @classmethod
+    def dirty_summary_sql(cls, hourly: bool) -> str:
+        """SELECT of the daily or hourly summary of the groups marked in
+        table_vaps_dirty computed from the vaps records
+        """
+        groups = cls.summary_groups(hourly)
+        select_columns = ", ".join(
+            f"{expression} AS {column}"
+            for column, expression in {**groups, **cls.summary_aggregates()}.items()
+        )
+        return (
+            f"SELECT {select_columns} FROM {cls.table_vaps_dirty} AS d "
+            f"INNER JOIN {cls.table_vaps} AS r ON r.vibrator = d.vibrator "
+            f"AND r.time_break >= d.production_date "
+            f"AND r.time_break < DATE(d.production_date, '+1 day') "
+            f"GROUP BY {', '.join(groups.values())}"
+        )
 
     @classmethod
     @DbUtils.connect
-    def update_vaps_file(cls, vaps_file, cursor):
-        """method to to check if file_name exists in the database, if it does not then
-        add the filename to the data base
+    def rebuild_vaps_summary(cls, cursor: any) -> None:
+        """compute the summaries again from all vaps records, after the tolerances in
+        vp_plt_settings have changed
+        """
+        for table in [cls.table_vaps_daily, cls.table_vaps_hourly]:
+            cursor.execute(f"DROP TABLE IF EXISTS {table};")
+
+        cls.create_vaps_summary(cursor)
+
+    @classmethod
+    @DbUtils.connect
+    def get_vp_file_signature(cls, file_name, cursor):
+        """returns (file_size, file_mtime, file_hash) the vp file is registered with,
+        None if it is not in the database
+        """
+        return DbUtils.get_file_signature(cursor, cls.table_vp_files, file_name)
+
+    @classmethod
+    @DbUtils.connect
+    def update_vp_file(cls, vp_file, cursor):
+        """method to register the vp file, the records of a changed file are deleted,
+        see DbUtils.register_file
         returns:
-        -1, if file is found
-        n, new file_id number if no file is found
+        -1, if the file is found and unchanged
+        n, file_id of the new or changed file
         """
-        # check if file exists
-        sql_string = (
-            f"SELECT id FROM {cls.table_vaps_files} WHERE "
-            f"file_name like '%{vaps_file.file_name}' ;"
+        return DbUtils.register_file(
+            cursor, cls.table_vp_files, vp_file, {cls.table_vp: "file_id"}
         )
-        cursor.execute(sql_string)
 
-        try:
-            # check if id exists
-            _ = cursor.fetchone()[0]
-            return -1
+    @classmethod
+    @DbUtils.connect
+    def update_vp(cls, vp_records: list[VpTable], cursor: any) -> None:
+        DbUtils.bulk_insert(
+            cursor, cls.table_vp, cls.vp_columns, vp_records, geometry=True
+        )
 
-        except TypeError:
-            # no id was found so go on to create one
-            pass
+    @classmethod
+    @DbUtils.connect
+    def update_vaps_file(cls, vaps_file, cursor):
+        """method to register the vaps file, the records of a changed file are
+        deleted, see DbUtils.register_file
+        returns:
+        -1, if the file is found and unchanged
+        n, file_id of the new or changed file
+        """
+        return DbUtils.register_file(
+            cursor, cls.table_vaps_files, vaps_file, {cls.table_vaps: "file_id"}
+        )
 
-        sql_string = (
-            f"INSERT INTO {cls.table_vaps_files} ("
-            f"file_name, file_date) "
-            f"VALUES (?, ?); "
+    @classmethod
+    @DbUtils.connect
+    def update_vaps(
+        cls, vaps_records: list[VapsTable] | pd.DataFrame, cursor: any
+    ) -> any:
+        """insert vaps records, either a list of VapsTable or a DataFrame with the
+        VapsTable attributes as columns, and update the summaries
+        """
+        cursor.execute(f"SELECT MAX(id) FROM {cls.table_vaps};")
+        last_id = cursor.fetchone()[0] or 0
+        DbUtils.bulk_insert(
+            cursor, cls.table_vaps, cls.vaps_columns, vaps_records, geometry=True
         )
+        cls.update_vaps_summary(cursor, last_id)
+
+    @classmethod
+    @DbUtils.connect
+    def get_last_id(cls, database_table: str, cursor: any) -> int:
+        """returns the highest id in the database_table, 0 if the table is empty"""
+        table = cls.table_vaps if database_table == "VAPS" else cls.table_vp
+        cursor.execute(f"SELECT MAX(id) FROM {table};")
+        return cursor.fetchone()[0] or 0
+
+    @classmethod
+    @DbUtils.connect
+    def delete_duplicates(
+        cls,
+        database_table: str,
+        file_id: int,
+        last_id: int,
+        signatures: list[tuple[int, int, int]],
+        cursor: any,
+    ) -> None:
+        """delete the records of file_id with an id greater than last_id and a
+        signature (line, station, vibrator) in signatures. Used when reading a file in
+        chunks to remove a record that has a duplicate in a later chunk
+        """
+        if database_table == "VAPS":
+            table, station = cls.table_vaps, "point"
 
-        cursor.execute(sql_string, (vaps_file.file_name, vaps_file.file_date))
+        else:
+            table, station = cls.table_vp, "station"
 
-        return cursor.lastrowid
+        sql_string = (
+            f"DELETE FROM {table} WHERE "
+            f"id > ? AND file_id = ? AND line = ? AND {station} = ? AND vibrator = ?;"
+        )
+        cursor.executemany(
+            sql_string, [(last_id, file_id, *signature) for signature in signatures]
+        )
+        return cursor.rowcount
 
     @classmethod
     @DbUtils.connect
-    def update_vaps(cls, vaps_records: VapsTable, cursor: any) -> any:
-        progress_message = seis_utils.progress_message_generator(
-            f"populate database for table: {cls.table_vaps}                             "
+    def get_vaps_file_state(cls, file_name: str, cursor: any) -> tuple | None:
+        """returns (id, file_offset, last_signature, file_size, file_mtime, file_hash)
+        of the vaps file, None if the file is not in the database. file_offset is the
+        byte offset up to where the file has been read and last_signature the text of
+        the last line read, both None if the file was read before they were kept
+        """
+        sql_string = (
+            f"SELECT id, file_offset, last_signature, file_size, file_mtime, file_hash "
+            f"FROM {cls.table_vaps_files} WHERE file_key = ?;"
         )
+        cursor.execute(sql_string, (DbUtils.file_key(file_name),))
+        return cursor.fetchone()
+
+    @classmethod
+    @DbUtils.connect
+    def update_vaps_file_state(
+        cls,
+        file_id: int,
+        file_offset: int,
+        last_signature: str,
+        file_signature: tuple,
+        cursor: any,
+    ) -> None:
+        """store the byte offset and text of the last line read and the (file_size,
+        file_mtime, file_hash) of the vaps file
+        """
         sql_string = (
-            f"INSERT INTO {cls.table_vaps} ("
-            f"file_id, line, point, fleet_nr, vibrator, drive, "
-            f"avg_phase, peak_phase, avg_dist, peak_dist, avg_force, peak_force, "
-            f"avg_stiffness, avg_viscosity, easting, northing, elevation, "
-            f"time_break, hdop, tb_date, positioning, geom) "
-            f'VALUES ({", ".join(["?"]*21)}, MakePoint(?, ?, ?));'
+            f"UPDATE {cls.table_vaps_files} SET file_offset = ?, last_signature = ?, "
+            f"file_size = ?, file_mtime = ?, file_hash = ? WHERE id = ?;"
+        )
+        cursor.execute(
+            sql_string, (file_offset, last_signature, *file_signature, file_id)
         )
-        for vaps_record in vaps_records:
-            point = Point(vaps_record.easting, vaps_record.northing)
 
-            cursor.execute(
-                sql_string,
-                (
-                    vaps_record.file_id,
-                    vaps_record.line,
-                    vaps_record.station,
-                    vaps_record.fleet_nr,
-                    vaps_record.vibrator,
-                    vaps_record.drive,
-                    vaps_record.avg_phase,
-                    vaps_record.peak_phase,
-                    vaps_record.avg_dist,
-                    vaps_record.peak_dist,
-                    vaps_record.avg_force,
-                    vaps_record.peak_force,
-                    vaps_record.avg_stiffness,
-                    vaps_record.avg_viscosity,
-                    vaps_record.easting,
-                    vaps_record.northing,
-                    vaps_record.elevation,
-                    vaps_record.time_break,
-                    vaps_record.hdop,
-                    vaps_record.tb_date,
-                    vaps_record.positioning,
-                    point.x,
-                    point.y,
-                    EPSG_PSD93,
-                ),
-            )
-            next(progress_message)
+    @classmethod
+    @DbUtils.connect
+    def delete_vaps_file_records(cls, file_id: int, cursor: any) -> set:
+        """delete the vaps records of file_id, returns the production dates of the
+        deleted records
+        """
+        cursor.execute(
+            f"SELECT DISTINCT DATE(time_break) FROM {cls.table_vaps} WHERE file_id = ?;",
+            (file_id,),
+        )
+        prod_dates = {
+            datetime.date.fromisoformat(prod_date)
+            for (prod_date,) in cursor.fetchall()
+            if prod_date
+        }
+        cursor.execute(f"DELETE FROM {cls.table_vaps} WHERE file_id = ?;", (file_id,))
+        return prod_dates
 
     @classmethod
     @DbUtils.connect
     def update_vp_distance(
-        cls, database_table: str, prod_date: datetime.datetime, cursor: any
+        cls,
+        database_table: str,
+        prod_dates: datetime.date | set[datetime.date],
+        cursor: any,
+        vibrators: set[int] = None,
     ) -> None:
         """Add values for distance, time, velocity, denseflag to the database_table
         This can only be done after all vps have been added to the database
-        as only then it be sorted by consecutive vp points by vibrator
+        as only then it be sorted by consecutive vp points by vibrator.
+        Values are for the next vp of the vibrator on the same production date, the
+        last vp of a vibrator on a date has no values and the dense_flag of the one
+        before. If vibrators is given only those vibrators are updated
         """
         if database_table == "VAPS":
             table = cls.table_vaps
@@ -341,6 +594,64 @@ class VpDb:
         else:
             table = cls.table_vp
 
+        if isinstance(prod_dates, datetime.date):
+            prod_dates = {prod_dates}
+
+        prod_dates = sorted(prod_dates)
+        print(
+            f"\nadd dist, time, vel, dense_flag to {table} for "
+            f'{", ".join(prod_date.strftime("%d-%m-%Y") for prod_date in prod_dates)}'
+        )
+        vp_records_df = pd.concat(
+            [
+                cls.get_vp_data_by_date(database_table, prod_date)
+                for prod_date in prod_dates
+            ]
+        )
+        vp_records_df = vp_records_df[vp_records_df["vibrator"].between(1, FLEETS)]
+        if vibrators is not None:
+            vp_records_df = vp_records_df[vp_records_df["vibrator"].isin(vibrators)]
+
+        if vp_records_df.empty:
+            return
+
+        vp_records_df = vp_records_df.assign(
+            prod_date=vp_records_df["time_break"].dt.normalize()
+        ).sort_values(["prod_date", "vibrator", "time_break", "id"], kind="stable")
+
+        # consecutive vps of the same vibrator on the same production date
+        prod_date = vp_records_df["prod_date"].to_numpy()
+        vibrator = vp_records_df["vibrator"].to_numpy()
+        next_in_group = (prod_date[1:] == prod_date[:-1]) & (
+            vibrator[1:] == vibrator[:-1]
+        )
+
+        dist = np.hypot(
+            np.diff(vp_records_df["easting"].to_numpy(dtype=float)),
+            np.diff(vp_records_df["northing"].to_numpy(dtype=float)),
+        )
+        # whole seconds between time breaks as timedelta.seconds
+        time_break_us = vp_records_df["time_break"].to_numpy().astype("datetime64[us]")
+        seconds = np.diff(time_break_us.astype(np.int64)) // 1_000_000
+        time = np.maximum(0, seconds - SWEEP_TIME - PAD_DOWN_TIME)
+        velocity = np.divide(dist, time, out=np.zeros_like(dist), where=time > 0)
+
+        n_records = vp_records_df.shape[0]
+        distance = np.full(n_records, np.nan)
+        duration = np.full(n_records, np.nan)
+        speed = np.full(n_records, np.nan)
+        dense_flag = np.zeros(n_records, dtype=bool)
+        distance[:-1] = np.where(next_in_group, dist, np.nan)
+        duration[:-1] = np.where(next_in_group, time, np.nan)
+        speed[:-1] = np.where(next_in_group, velocity, np.nan)
+        dense_flag[:-1] = next_in_group & (dist < DENSE_CRITERIUM)
+
+        # the last vp of a vibrator takes the dense_flag of the vp before it
+        last_vp = np.flatnonzero(
+            np.r_[~next_in_group, True] & np.r_[False, next_in_group]
+        )
+        dense_flag[last_vp] = dense_flag[last_vp - 1]
+
         sql_string = (
             f"UPDATE {table} "
             f"SET"
@@ -350,90 +661,67 @@ class VpDb:
             f"    dense_flag = ? "
             f"WHERE id = ?;"
         )
-        progress_message = seis_utils.progress_message_generator(
-            f"add dist, time, vel, dense_flag to {table} for "
-            f'{prod_date.strftime("%d-%m-%Y")}                          '
-        )
-        vp_records_df = cls.get_vp_data_by_date(database_table, prod_date)
-
-        for vib in range(1, FLEETS + 1):
-            vib_df = vp_records_df[vp_records_df["vibrator"] == vib]
-            vp_pts = [
-                (val[0], Point(val[1], val[2]), val[3])
-                for val in zip(
-                    vib_df["id"].to_list(),
-                    vib_df["easting"].to_list(),
-                    vib_df["northing"].to_list(),
-                    vib_df["time_break"].to_list(),
-                )
-            ]
-            # use consecutive vp's
-            dense_flag = False
-            for vp_a, vp_b in zip(vp_pts, vp_pts[1:]):
-                index = vp_a[0]
-                dx = vp_b[1].x - vp_a[1].x
-                dy = vp_b[1].y - vp_a[1].y
-                dist = np.sqrt(dx * dx + dy * dy)
-                try:
-                    t2 = datetime.datetime.strptime(vp_b[2], "%Y-%m-%d %H:%M:%S.%f")
-
-                except ValueError:
-                    t2 = datetime.datetime.strptime(vp_b[2], "%Y-%m-%d %H:%M:%S")
-
-                try:
-                    t1 = datetime.datetime.strptime(vp_a[2], "%Y-%m-%d %H:%M:%S.%f")
-
-                except ValueError:
-                    t1 = datetime.datetime.strptime(vp_a[2], "%Y-%m-%d %H:%M:%S")
-
-                time = max(0, ((t2 - t1).seconds - SWEEP_TIME - PAD_DOWN_TIME))
-
-                velocity = dist / time if time > 0 else 0
-                dense_flag = True if dist < DENSE_CRITERIUM else False
-
-                cursor.execute(
-                    sql_string,
-                    (
-                        dist,
-                        time,
-                        velocity,
-                        dense_flag,
-                        index,
-                    ),
-                )
-                next(progress_message)
-
-            # handle data for last element if there is one
-            if vp_pts:
-                index = vp_pts[-1][0]
-                cursor.execute(
-                    sql_string,
-                    (
-                        np.nan,
-                        np.nan,
-                        np.nan,
-                        dense_flag,
-                        index,
-                    ),
-                )
+        cursor.executemany(
+            sql_string,
+            zip(
+                distance.tolist(),
+                duration.tolist(),
+                speed.tolist(),
+                dense_flag.tolist(),
+                vp_records_df["id"].tolist(),
+            ),
+        )
 
     @classmethod
     @DbUtils.connect
-    def get_vaps_id(cls, vp_record: VpTable, cursor: any) -> VpTable:
-        """get vaps_id from the database and insert into vp_record"""
-        sql_string = (
-            f"SELECT id FROM {cls.table_vaps} WHERE "
-            f"time_break='{vp_record.time_break}' AND "
-            f"vibrator={vp_record.vibrator};"
-        )
-        cursor.execute(sql_string)
-        try:
-            vp_record.vaps_id = cursor.fetchone()[0]
+    def link_vp_to_vaps(
+        cls,
+        file_id: int,
+        cursor: any,
+        tolerance: datetime.timedelta = LINK_TIME_TOLERANCE,
+    ) -> int:
+        """set vaps_id of the vp records of file_id to the id of the vaps record of the
+        same vibrator with the same time break, or with tolerance the vaps record with
+        the nearest time break within tolerance. Returns the number of linked records
+        """
+        if tolerance:
+            # string bounds so the (vibrator, time_break) index is used, widened to
+            # whole seconds as a time break without microseconds is stored without
+            # fraction, the tolerance itself is compared in milliseconds of julianday
+            seconds = tolerance.total_seconds()
+            milliseconds = round(seconds * 1000)
+            time_break_condition = (
+                f"v.time_break >= "
+                f"strftime('%Y-%m-%d %H:%M:%S', p.time_break, '-{seconds:f} seconds') "
+                f"AND v.time_break < "
+                f"strftime('%Y-%m-%d %H:%M:%S', p.time_break, '+{seconds + 1:f} seconds') "
+                f"AND ROUND(ABS(julianday(v.time_break) - julianday(p.time_break)) "
+                f"* 86400000) <= {milliseconds}"
+            )
 
-        except TypeError:
-            pass
+        else:
+            time_break_condition = "v.time_break = p.time_break"
 
-        return vp_record
+        cursor.execute(
+            f"UPDATE {cls.table_vp} SET vaps_id = NULL WHERE file_id = ?;", (file_id,)
+        )
+        # for each vp record the vaps record with the nearest time break is ranked first
+        sql_string = (
+            f"UPDATE {cls.table_vp} SET vaps_id = link.vaps_id FROM ("
+            f"SELECT p.id AS vp_id, v.id AS vaps_id, ROW_NUMBER() OVER ("
+            f"PARTITION BY p.id ORDER BY "
+            f"ABS(julianday(v.time_break) - julianday(p.time_break)), v.id) AS rank "
+            f"FROM {cls.table_vp} AS p "
+            f"INNER JOIN {cls.table_vaps} AS v "
+            f"ON v.vibrator = p.vibrator AND {time_break_condition} "
+            f"WHERE p.file_id = ?) AS link "
+            f"WHERE {cls.table_vp}.id = link.vp_id AND link.rank = 1;"
+        )
+        cursor.execute(sql_string, (file_id,))
+        cursor.execute(
+            f"SELECT COUNT(vaps_id) FROM {cls.table_vp} WHERE file_id = ?;", (file_id,)
+        )
+        return cursor.fetchone()[0]
 
     @classmethod
     def get_vp_data_by_time(
@@ -445,35 +733,132 @@ class VpDb:
         """retrieve vp data by time interval"""
         assert end_time >= start_time, "end time must be greater equal than start time"
         table = cls.table_vaps if database_table == "VAPS" else cls.table_vp
-        engine = DbUtils().get_db_engine()
         sql_string = (
             f"SELECT * FROM {table} WHERE "
-            f"time_break BETWEEN '{start_time}' AND '{end_time}' "
+            f"time_break BETWEEN :start_time AND :end_time "
             f"ORDER BY time_break;"
         )
-        return pd.read_sql_query(sql_string, con=engine)
+        return DbUtils.read_sql_query(
+            sql_string,
+            params={"start_time": str(start_time), "end_time": str(end_time)},
+        )
 
     @classmethod
     def get_vp_data_by_date(
         cls, database_table, production_date: datetime.datetime
     ) -> pd.DataFrame:
         """retrieve vp data by date"""
+        return cls.get_vp_data_between(database_table, production_date, production_date)
+
+    @classmethod
+    def get_vp_data_between(
+        cls,
+        database_table: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        columns: list[str] = None,
+        database: any = None,
+    ) -> pd.DataFrame:
+        """retrieve vp data from start_date up to and including end_date, with only
+        columns if given, ordered by time_break, from database if it is not the
+        project database
+        """
         table = cls.table_vaps if database_table == "VAPS" else cls.table_vp
-        engine = DbUtils().get_db_engine()
+        select_columns = ", ".join(columns) if columns else "*"
         sql_string = (
-            f"SELECT * FROM {table} WHERE "
-            f'DATE(time_break) = \'{production_date.strftime("%Y-%m-%d")}\' '
+            f"SELECT {select_columns} FROM {table} WHERE "
+            f"time_break >= :start_date AND time_break < :end_date "
             f"ORDER BY time_break;"
         )
-        return pd.read_sql_query(sql_string, con=engine)
+        return DbUtils.read_sql_query(
+            sql_string,
+            params=DbUtils.date_range(start_date, end_date),
+            database=database,
+        )
 
     @classmethod
     def get_vp_data_by_line(cls, database_table: str, line: int) -> pd.DataFrame:
         """retrieve vp data by line number"""
         table = cls.table_vaps if database_table == "VAPS" else cls.table_vp
-        engine = DbUtils().get_db_engine()
         sql_string = f"SELECT * FROM {table} WHERE " f"line = {line} ORDER BY station;"
-        return pd.read_sql_query(sql_string, con=engine)
+        return DbUtils.read_sql_query(sql_string)
+
+    @classmethod
+    def get_vp_data_in_bbox(
+        cls,
+        database_table: str,
+        bbox: tuple[float, float, float, float],
+        columns: list[str] = None,
+    ) -> pd.DataFrame:
+        """retrieve vp data inside bbox (min_easting, min_northing, max_easting,
+        max_northing)
+        """
+        table = cls.table_vaps if database_table == "VAPS" else cls.table_vp
+        return DbUtils.get_within_bbox(table, bbox, columns=columns)
+
+    @classmethod
+    def get_vp_data_in_radius(
+        cls,
+        database_table: str,
+        easting: float,
+        northing: float,
+        radius: float,
+        columns: list[str] = None,
+    ) -> pd.DataFrame:
+        """retrieve vp data within radius meters of (easting, northing)"""
+        table = cls.table_vaps if database_table == "VAPS" else cls.table_vp
+        return DbUtils.get_within_radius(
+            table, easting, northing, radius, columns=columns
+        )
+
+    @classmethod
+    def get_vp_data_in_polygon(
+        cls, database_table: str, polygon: any, columns: list[str] = None
+    ) -> pd.DataFrame:
+        """retrieve vp data inside polygon, a shapely Polygon or its WKT"""
+        table = cls.table_vaps if database_table == "VAPS" else cls.table_vp
+        return DbUtils.get_within_polygon(table, polygon, columns=columns)
+
+    @classmethod
+    def get_vaps_summary(
+        cls,
+        start_date: datetime.date,
+        end_date: datetime.date = None,
+        hourly: bool = False,
+    ) -> pd.DataFrame:
+        """retrieve the daily, or hourly, vaps summary by vibrator from start_date up
+        to and including end_date (default start_date) with the mean and standard
+        deviation of the attributes. The groups marked by a delete or update outside
+        update_vaps are computed from the vaps records, the summary is only read
+        """
+        table = cls.table_vaps_hourly if hourly else cls.table_vaps_daily
+        end_date = end_date or start_date
+        groups = cls.summary_groups(hourly)
+        columns = ", ".join([*groups, *cls.summary_aggregates()])
+        sql_string = (
+            f"SELECT * FROM ("
+            f"SELECT {columns} FROM {table} WHERE (production_date, vibrator) NOT IN "
+            f"(SELECT production_date, vibrator FROM {cls.table_vaps_dirty}) "
+            f"UNION ALL {cls.dirty_summary_sql(hourly)}) "
+            f"WHERE production_date BETWEEN :start_date AND :end_date "
+            f"ORDER BY {', '.join(groups)};"
+        )
+        summary_df = DbUtils.read_sql_query(
+            sql_string,
+            params={
+                "start_date": start_date.strftime("%Y-%m-%d"),
+                "end_date": end_date.strftime("%Y-%m-%d"),
+            },
+        )
+
+        for attribute in cls.summary_attributes:
+            count = summary_df[f"{attribute}_count"]
+            mean = summary_df[f"{attribute}_sum"] / count
+            variance = summary_df[f"{attribute}_sum_sq"] / count - mean**2
+            summary_df[f"{attribute}_mean"] = mean
+            summary_df[f"{attribute}_std"] = np.sqrt(variance.clip(lower=0))
+
+        return summary_df
 
     @classmethod
     @DbUtils.connect
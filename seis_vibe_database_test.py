@@ -0,0 +1,188 @@
+""" test the link of vp records to the vaps records
+"""
+import datetime
+import pytest
+from seis_database import DbUtils
+from seis_vibe_database import VpDb
+
+TIME_BREAK = datetime.datetime(2021, 3, 5, 10, 20, 30, 500000)
+
+
+def time_break(milliseconds):
+    return str(TIME_BREAK + datetime.timedelta(milliseconds=milliseconds))
+
+
+@pytest.fixture
+def vp_database(project_database):
+    with DbUtils.session() as connection:
+        connection.execute(
+            f"CREATE TABLE {VpDb.table_vaps} (id INTEGER PRIMARY KEY, "
+            f"vibrator INTEGER, time_break TIMESTAMP);"
+        )
+        connection.execute(
+            f"CREATE TABLE {VpDb.table_vp} (id INTEGER PRIMARY KEY, file_id INTEGER, "
+            f"vaps_id INTEGER, vibrator INTEGER, time_break TIMESTAMP);"
+        )
+        connection.executemany(
+            f"INSERT INTO {VpDb.table_vaps} (id, vibrator, time_break) VALUES (?, ?, ?);",
+            [
+                # two vaps records inside a window of 500 ms of vp 1, one outside
+                (1, 7, time_break(400)),
+                (2, 7, time_break(-300)),
+                (3, 7, time_break(-600)),
+                # of another vibrator
+                (4, 8, time_break(0)),
+                # exactly on the bounds of vp 3, stored without a fraction
+                (5, 7, time_break(9500)),
+                (6, 7, time_break(60000)),
+                (7, 7, time_break(60000)),
+            ],
+        )
+        connection.executemany(
+            f"INSERT INTO {VpDb.table_vp} (id, file_id, vibrator, time_break) "
+            f"VALUES (?, 1, ?, ?);",
+            [
+                (1, 7, time_break(0)),
+                (2, 7, time_break(-2000)),
+                (3, 7, time_break(10000)),
+                (4, 7, time_break(60000)),
+            ],
+        )
+
+    return project_database
+
+
+def vaps_ids():
+    with DbUtils.session() as connection:
+        return dict(connection.execute(f"SELECT id, vaps_id FROM {VpDb.table_vp};"))
+
+
+def test_link_nearest_vaps_within_tolerance(vp_database):
+    assert VpDb.link_vp_to_vaps(1, tolerance=datetime.timedelta(milliseconds=500)) == 3
+    assert vaps_ids() == {1: 2, 2: None, 3: 5, 4: 6}
+
+
+def baseline_vaps_id(connection, vibrator, vp_time_break):
+    """the vaps id of the vp record as the per record lookup before the link"""
+    vaps_row = connection.execute(
+        f"SELECT id FROM {VpDb.table_vaps} WHERE time_break = ? AND vibrator = ?;",
+        (vp_time_break, vibrator),
+    ).fetchone()
+    return vaps_row[0] if vaps_row else None
+
+
+def test_link_exact_time_break(vp_database):
+    with DbUtils.session() as connection:
+        expected = {
+            vp_id: baseline_vaps_id(connection, vibrator, vp_time_break)
+            for vp_id, vibrator, vp_time_break in connection.execute(
+                f"SELECT id, vibrator, time_break FROM {VpDb.table_vp};"
+            ).fetchall()
+        }
+
+    assert VpDb.link_vp_to_vaps(1, tolerance=datetime.timedelta(0)) == 1
+    assert vaps_ids() == expected == {1: None, 2: None, 3: None, 4: 6}
+
+
+@pytest.fixture
+def vaps_database(project_database):
+    with DbUtils.session() as connection:
+        connection.execute(
+            f"CREATE TABLE {VpDb.table_vaps} (id INTEGER PRIMARY KEY, "
+            f"vibrator INTEGER, time_break TIMESTAMP, "
+            f"{', '.join(f'{column} INTEGER' for column in VpDb.summary_attributes)});"
+        )
+        VpDb.create_vaps_summary(connection.cursor())
+
+    return project_database
+
+
+def insert_vaps(rows):
+    """insert the vaps rows (vibrator, time break, value of the attributes) and add
+    them to the summaries like update_vaps
+    """
+    with DbUtils.session() as connection:
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT MAX(id) FROM {VpDb.table_vaps};")
+        last_id = cursor.fetchone()[0] or 0
+        cursor.executemany(
+            f"INSERT INTO {VpDb.table_vaps} (vibrator, time_break, "
+            f"{', '.join(VpDb.summary_attributes)}) "
+            f"VALUES (?, ?{', ?' * len(VpDb.summary_attributes)});",
+            [
+                (vibrator, time_break, *[value] * len(VpDb.summary_attributes))
+                for vibrator, time_break, value in rows
+            ],
+        )
+        VpDb.update_vaps_summary(cursor, last_id)
+
+
+def summaries(hourly):
+    """the summary table and the summary grouped from the vaps records"""
+    table = VpDb.table_vaps_hourly if hourly else VpDb.table_vaps_daily
+    groups = VpDb.summary_groups(hourly)
+    aggregates = VpDb.summary_aggregates()
+    columns = ", ".join([*groups, *aggregates])
+    with DbUtils.session() as connection:
+        summary = connection.execute(
+            f"SELECT {columns} FROM {table} ORDER BY {', '.join(groups)};"
+        ).fetchall()
+        grouped = connection.execute(
+            f"SELECT "
+            f"{', '.join(f'{sql} AS {column}' for column, sql in groups.items())}, "
+            f"{', '.join(aggregates.values())} FROM {VpDb.table_vaps} AS r "
+            f"GROUP BY {', '.join(groups.values())} ORDER BY {', '.join(groups)};"
+        ).fetchall()
+
+    return summary, grouped
+
+
+def test_vaps_summary_follows_inserts_and_deletes(vaps_database):
+    insert_vaps(
+        [
+            (7, "2021-03-05 10:20:30.123000", 10),
+            (7, "2021-03-05 11:20:30", 30),
+            (8, "2021-03-05 10:20:31", 20),
+            (7, "2021-03-06 00:00:00", 40),
+        ]
+    )
+    # records added to groups in the summaries
+    insert_vaps([(7, "2021-03-05 10:59:59.999000", 5), (8, "2021-03-06 23:00:00", 50)])
+    for hourly in [False, True]:
+        summary, grouped = summaries(hourly)
+        assert summary == grouped
+
+    summary, _ = summaries(False)
+    assert [row[:3] for row in summary] == [
+        ("2021-03-05", 7, 3),
+        ("2021-03-05", 8, 1),
+        ("2021-03-06", 7, 1),
+        ("2021-03-06", 8, 1),
+    ]
+
+    # a delete outside update_vaps marks the group, the summary read computes it
+    with DbUtils.session() as connection:
+        connection.execute(
+            f"DELETE FROM {VpDb.table_vaps} WHERE vibrator = 7 AND avg_phase <= 10;"
+        )
+
+    summary_df = VpDb.get_vaps_summary(datetime.date(2021, 3, 5))
+    assert summary_df["records"].tolist() == [1, 1]
+    assert summary_df["avg_phase_min"].tolist() == [30, 20]
+    assert summary_df["avg_phase_mean"].tolist() == [30, 20]
+    with DbUtils.session() as connection:
+        # the read does not write the summary
+        assert connection.execute(
+            f"SELECT COUNT(*) FROM {VpDb.table_vaps_dirty};"
+        ).fetchone() == (1,)
+
+    # the next insert computes the marked group again
+    insert_vaps([(8, "2021-03-07 08:00:00", 60)])
+    for hourly in [False, True]:
+        summary, grouped = summaries(hourly)
+        assert summary == grouped
+
+    with DbUtils.session() as connection:
+        assert connection.execute(
+            f"SELECT COUNT(*) FROM {VpDb.table_vaps_dirty};"
+        ).fetchone() == (0,)
@@ -0,0 +1,288 @@
+""" watch the data folders of file_paths in seis_config for new and changed vaps, vp,
+    sps, node and weather files and ingest them in the database while they come in.
+    A file is ingested once it is unchanged between two scans, it is parsed by a pool
+    of WATCH_WORKERS threads and stored by a single writer thread in one transaction
+    per file. With watchdog installed (inotify on Linux) the folders are only scanned
+    after a change, else they are polled every WATCH_INTERVAL seconds. The queue depth
+    and throughput are written to WATCH_STATUS_FILE.
+    The tables must exist, see seis_create_db.py
+"""
+import os
+import json
+import time
+import queue
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import seis_utils
+import node_quantum_update
+import node_nuseis_update
+from seis_database import DbUtils
+from vp_update import Vaps, Vp
+from sps_vp_final_update import Sps
+from weather_update import Weather
+from seis_settings import (
+    DATA_FILES_VAPS,
+    DATA_FILES_VP,
+    DATA_FILES_SPS,
+    DATA_FILES_QUANTUM,
+    DATA_FILES_NUSEIS,
+    DATA_FILES_WEATHER,
+    WATCH_INTERVAL,
+    WATCH_WORKERS,
+    WATCH_STATUS_FILE,
+)
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# (folder, glob pattern, ingest class), sps files are in a folder per block
+INGEST_FOLDERS = [
+    (DATA_FILES_VAPS, "*.*", Vaps),
+    (DATA_FILES_VP, "*.*", Vp),
+    (DATA_FILES_SPS, "*/*.*", Sps),
+    (DATA_FILES_QUANTUM, "*.*", node_quantum_update.Rcv),
+    (DATA_FILES_NUSEIS, "*.*", node_nuseis_update.Rcv),
+    (DATA_FILES_WEATHER, "*.*", Weather),
+]
+
+
+class WakeHandler(FileSystemEventHandler):
+    """sets the wake event on any change in a watched folder"""
+
+    def __init__(self, wake: threading.Event):
+        self.wake = wake
+
+    def on_any_event(self, event):
+        self.wake.set()
+
+
+class Watcher:
+    """ingest of the files of the folders in INGEST_FOLDERS. The ingest class of a
+    folder has the file suffixes it reads in suffixes, a parse_file(filename) that
+    does not write to the database and returns the arguments of store_file, or None
+    if there is nothing to store, and a store_file that writes them to the database
+    """
+
+    def __init__(
+        self,
+        interval: float = WATCH_INTERVAL,
+        workers: int = WATCH_WORKERS,
+        status_file: any = WATCH_STATUS_FILE,
+        ingest_folders: list = None,
+    ):
+        self.interval = interval
+        self.status_file = status_file
+        self.folders = [
+            (folder, pattern, ingest)
+            for folder, pattern, ingest in ingest_folders or INGEST_FOLDERS
+            if folder and folder.is_dir()
+        ]
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # files being parsed or waiting to be stored, so parsed files held in memory
+        # are bounded
+        self.slots = threading.Semaphore(2 * workers)
+        self.store_queue = queue.Queue()
+        self.writer = threading.Thread(target=self.store, daemon=True)
+        self.observer = None
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        # {filename: (size, mtime)} of the last scan and of the last dispatch
+        self.scanned = {}
+        self.dispatched = {}
+        self.in_flight = set()
+        self.waiting = 0
+        self.start_time = time.monotonic()
+        self.stats = {
+            "files_done": 0,
+            "files_skipped": 0,
+            "files_failed": 0,
+            "bytes_done": 0,
+            "last_file": None,
+            "last_error": None,
+        }
+
+    @property
+    def mode(self) -> str:
+        return "watchdog" if self.observer else "polling"
+
+    def scan(self) -> None:
+        """dispatch the files that have not been dispatched with their current size and
+        mtime and are unchanged since the previous scan. A file is dispatched again
+        after it has changed or its store has failed, but never while it is being
+        ingested
+        """
+        scanned = {}
+        waiting = 0
+        for folder, pattern, ingest in self.folders:
+            for filename in folder.glob(pattern):
+                if filename.suffix.lower() not in ingest.suffixes:
+                    continue
+
+                try:
+                    stat = filename.stat()
+
+                except FileNotFoundError:
+                    continue
+
+                file_stat = (stat.st_size, stat.st_mtime_ns)
+                with self.lock:
+                    is_dispatched = self.dispatched.get(filename) == file_stat
+                    is_in_flight = filename in self.in_flight
+
+                if is_dispatched:
+                    continue
+
+                # a file that changed since the previous scan may still be written
+                if self.scanned.get(filename) != file_stat or is_in_flight:
+                    scanned[filename] = file_stat
+                    continue
+
+                if not self.slots.acquire(blocking=False):
+                    scanned[filename] = file_stat
+                    waiting += 1
+                    continue
+
+                with self.lock:
+                    self.dispatched[filename] = file_stat
+                    self.in_flight.add(filename)
+                self.executor.submit(self.parse, filename, ingest, stat.st_size)
+
+        self.scanned = scanned
+        self.waiting = waiting
+
+    def parse(self, filename, ingest, file_size: int) -> None:
+        """parse the file in a worker thread and queue it for the writer"""
+        try:
+            parsed = ingest.parse_file(filename)
+
+        except Exception as error:
+            self.finish(filename, error=error)
+            return
+
+        if parsed is None:
+            self.finish(filename)
+            return
+
+        self.store_queue.put((filename, ingest, parsed, file_size))
+
+    def store(self) -> None:
+        """the single writer, stores the parsed files in one transaction per file
+        until it gets None. The session is strict, so a database error rolls back the
+        file and the file is counted as failed and dispatched again at a next scan
+        """
+        while (job := self.store_queue.get()) is not None:
+            filename, ingest, parsed, file_size = job
+            try:
+                with DbUtils.session(strict=True):
+                    ingest.store_file(*parsed)
+
+            except Exception as error:
+                self.finish(filename, error=error, retry=True)
+                continue
+
+            self.finish(filename, file_size=file_size)
+
+    def finish(
+        self,
+        filename,
+        file_size: int = None,
+        error: Exception = None,
+        retry: bool = False,
+    ) -> None:
+        with self.lock:
+            self.in_flight.discard(filename)
+            self.stats["last_file"] = filename.name
+            if error:
+                self.stats["files_failed"] += 1
+                self.stats["last_error"] = f"{filename.name}: {error}"
+                if retry:
+                    self.dispatched.pop(filename, None)
+
+            elif file_size is None:
+                self.stats["files_skipped"] += 1
+
+            else:
+                self.stats["files_done"] += 1
+                self.stats["bytes_done"] += file_size
+
+        self.slots.release()
+
+    def write_status(self) -> None:
+        """write the queue depth and throughput since the start to the status file"""
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        with self.lock:
+            status = {
+                "updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "mode": self.mode,
+                "folders": [str(folder) for folder, _, _ in self.folders],
+                "queue_depth": self.waiting + len(self.in_flight),
+                "waiting": self.waiting,
+                "in_flight": len(self.in_flight),
+                "to_store": self.store_queue.qsize(),
+                **self.stats,
+                "files_per_hour": round(self.stats["files_done"] * 3600 / elapsed, 1),
+                "mb_per_second": round(self.stats["bytes_done"] / 1e6 / elapsed, 3),
+            }
+
+        status_tmp = self.status_file.with_suffix(".tmp")
+        status_tmp.write_text(json.dumps(status, indent=4))
+        os.replace(status_tmp, self.status_file)
+
+    def run(self) -> None:
+        """scan and ingest until interrupted with ctrl-c"""
+        self.writer.start()
+        if Observer:
+            self.observer = Observer()
+            for folder, _, _ in self.folders:
+                self.observer.schedule(
+                    WakeHandler(self.wake), str(folder), recursive=True
+                )
+            self.observer.start()
+
+        print(
+            f"watching {len(self.folders)} folders by {self.mode}, "
+            f"status in {self.status_file}"
+        )
+        last_scan = 0
+        try:
+            while True:
+                time.sleep(max(0, last_scan + self.interval - time.monotonic()))
+                self.wake.clear()
+                last_scan = time.monotonic()
+                self.scan()
+                self.write_status()
+                # with watchdog an idle watcher only scans again after a change
+                while (
+                    self.observer
+                    and not self.scanned
+                    and not self.wake.wait(self.interval)
+                ):
+                    pass
+
+        except KeyboardInterrupt:
+            print("\nstop watching ...")
+
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """finish the files in flight and stop the workers and the writer"""
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+
+        self.executor.shutdown(wait=True)
+        self.store_queue.put(None)
+        self.writer.join()
+        self.write_status()
+
+
+if __name__ == "__main__":
+    seis_utils.check_expiry_date()
+    Watcher().run()
@@ -0,0 +1,80 @@
+""" test that the watcher counts a file of which the store fails and ingests it again
+    at a next scan
+"""
+import time
+import pytest
+from seis_database import DbUtils
+from seis_watcher import Watcher
+
+
+class Ingest:
+    """stores the name of a file in the table files, the first store of a file fails
+    in a decorated method that prints its error outside a strict session
+    """
+
+    suffixes = [".txt"]
+    failed = set()
+
+    @staticmethod
+    def parse_file(filename):
+        return (filename.name,)
+
+    @classmethod
+    @DbUtils.connect
+    def store_file(cls, file_name, cursor):
+        cursor.execute("INSERT INTO files (file_name) VALUES (?);", (file_name,))
+        if file_name not in cls.failed:
+            cls.failed.add(file_name)
+            cursor.execute("INSERT INTO no_table VALUES (1);")
+
+
+@pytest.fixture
+def watcher(project_database, tmp_path):
+    with DbUtils.session() as connection:
+        connection.execute("CREATE TABLE files (file_name TEXT);")
+
+    folder = tmp_path / "data"
+    folder.mkdir()
+    (folder / "file_1.txt").write_text("records")
+    Ingest.failed = set()
+    watcher = Watcher(
+        interval=0,
+        workers=1,
+        status_file=tmp_path / "status.json",
+        ingest_folders=[(folder, "*.*", Ingest)],
+    )
+    watcher.writer.start()
+    yield watcher
+    watcher.stop()
+
+
+def stored_files():
+    with DbUtils.session() as connection:
+        return connection.execute("SELECT file_name FROM files;").fetchall()
+
+
+def scan(watcher):
+    """scan and wait until the dispatched files are stored"""
+    watcher.scan()
+    while watcher.in_flight:
+        time.sleep(0.01)
+
+
+def test_failed_store_is_counted_and_retried(watcher):
+    # a file is dispatched once it is unchanged between two scans
+    scan(watcher)
+    scan(watcher)
+    assert watcher.stats["files_failed"] == 1
+    assert watcher.stats["files_done"] == 0
+    assert "no_table" in watcher.stats["last_error"]
+    # the store of the file is rolled back
+    assert stored_files() == []
+
+    scan(watcher)
+    scan(watcher)
+    assert watcher.stats["files_done"] == 1
+    assert stored_files() == [("file_1.txt",)]
+
+    scan(watcher)
+    scan(watcher)
+    assert watcher.stats["files_done"] == 1
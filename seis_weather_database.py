@@ -1,6 +1,5 @@
 import datetime
 import pandas as pd
-import seis_utils
 from seis_database import DbUtils
 
 
@@ -31,9 +30,14 @@ class WeatherDb:
             f'CREATE TABLE {cls.table_weather_files} ('
             f'id INTEGER PRIMARY KEY, '
             f'file_name VARCHAR(100), '
-            f'file_date TIMESTAMP);'
+            f'file_date TIMESTAMP, '
+            f'file_key VARCHAR(100), '
+            f'file_size INTEGER, '
+            f'file_mtime REAL, '
+            f'file_hash VARCHAR(32));'
         )
         cursor.executescript(sql_string)
+        DbUtils.create_file_registry(cursor, cls.table_weather_files)
         print(f'create table {cls.table_weather_files}')
 
     @classmethod
@@ -57,65 +61,42 @@ class WeatherDb:
         print(f'create table {cls.table_weather_data}')
 
 
+    @classmethod
+    @DbUtils.connect
+    def get_weather_file_signature(cls, file_name, cursor):
+        ''' returns (file_size, file_mtime, file_hash) the weather file is registered
+            with, None if it is not in the database
+        '''
+        return DbUtils.get_file_signature(cursor, cls.table_weather_files, file_name)
+
     @classmethod
     @DbUtils.connect
     def update_weather_file(cls, weather_file, cursor):
-        ''' method to to check if file_name exists in the database, if it does not then
-            add the filename to the data base
+        ''' method to register the weather file, the records of a changed file are
+            deleted, see DbUtils.register_file
             returns:
-            -1, if file is found
-            n, new file_id number if no file is found
+            -1, if the file is found and unchanged
+            n, file_id of the new or changed file
         '''
-        # check if file exists
-        sql_string = (
-            f'SELECT id FROM {cls.table_weather_files} WHERE '
-            f'file_name like \'%{weather_file.file_name}\' ;'
-        )
-        cursor.execute(sql_string)
-        try:
-            _ = cursor.fetchone()[0]
-            return -1
-
-        except TypeError:
-            # no id was found so go on to create one
-            pass
-
-        sql_string = (
-            f'INSERT INTO {cls.table_weather_files} ('
-            f'file_name, file_date) '
-            f'VALUES (?, ?) '
+        return DbUtils.register_file(
+            cursor, cls.table_weather_files, weather_file,
+            {cls.table_weather_data: 'file_id'},
         )
-        cursor.execute(sql_string, (weather_file.file_name, weather_file.file_date))
-        return cursor.lastrowid
 
     @classmethod
     @DbUtils.connect
     def update_weather_records(cls, weather_records, cursor):
         date_ = weather_records[0].date_time.strftime('%d-%b-%Y')
-        progress_message = seis_utils.progress_message_generator(
-            f'{date_} populate database for table: {cls.table_weather_data}                        ')
-
-        sql_insert_string = (
-            f'INSERT INTO {cls.table_weather_data} ('
-            f'file_id, date_time, wind_speed, wind_gust, pulse_count, '
-            f'counter_value, input_voltage, temperature) '
-            f'VALUES ({", ".join(["?"]*8)}); '
+        print(f'{date_} populate database for table: {cls.table_weather_data}')
+
+        weather_columns = [
+            'file_id', 'date_time', 'wind_speed', 'wind_gust', 'pulse_count',
+            'counter_value', 'input_voltage', 'temperature',
+        ]
+        DbUtils.bulk_insert(
+            cursor, cls.table_weather_data, weather_columns, weather_records
         )
 
-        for weather_record in weather_records:
-
-            cursor.execute(sql_insert_string, (
-                weather_record.file_id,
-                weather_record.date_time,
-                weather_record.wind_speed,
-                weather_record.wind_gust,
-                weather_record.pulse_count,
-                weather_record.counter_value,
-                weather_record.input_voltage,
-                weather_record.temperature,
-            ))
-            next(progress_message)
-
     @classmethod
     @DbUtils.connect
     def delete_weather_file(cls, file_id, cursor):
@@ -135,12 +116,11 @@ class WeatherDb:
             returns:
               pandas dataframe with weather data
         '''
-        engine = DbUtils().get_db_engine()
         sql_string = (
             f'SELECT * FROM {cls.table_weather_data} WHERE '
-            f'DATE(date_time) BETWEEN '
-            f'\'{start_date.strftime("%Y-%m-%d")}\' AND '
-            f'\'{end_date.strftime("%Y-%m-%d")}\' '
+            f'date_time >= :start_date AND date_time < :end_date '
             f'ORDER BY date_time;'
         )
-        return pd.read_sql_query(sql_string, con=engine)
+        return DbUtils.read_sql_query(
+            sql_string, params=DbUtils.date_range(start_date, end_date)
+        )
@@ -4,89 +4,191 @@
     Copyright: 2021
 
 '''
+import sys
 import datetime
-import numpy as np
 import seis_utils
+from seis_database import DbUtils
 from seis_sps_database import SpsDb
 from seis_settings import (
-    DATA_FILES_SPS, PROGRESS_SKIPS, GMT_OFFSET, FilesSpsTable, SpsTable,
+    DATA_FILES_SPS, CHUNK_SIZE, PARSE_WORKERS, GMT_OFFSET, FilesSpsTable, SpsTable,
 )
 
-HEADER_ROWS = 89
+# the time break of an sps line ends with its milliseconds at column 96
+SPS_TIME_BREAK_WIDTH = 96
 
 
 class Sps:
     sps_base_folder = DATA_FILES_SPS
+    suffixes = ['.sps']
     sps_db = SpsDb()
 
     @classmethod
-    def read_sps(cls, block_name):
+    def read_sps(cls, block_name, chunk_size=CHUNK_SIZE, workers=PARSE_WORKERS):
+        ''' read the sps files of the block that are not yet in the database. With
+            workers > 1 the files are parsed in that many processes while this
+            process stores them in the order of the files
+        '''
         sps_folder = cls.sps_base_folder / block_name
 
-        for filename in sps_folder.glob('*.*'):
-            if not filename.is_file() or filename.suffix.lower() != '.sps':
-                continue
-
-            sps_file = FilesSpsTable(*[None]*4)
+        sps_files = seis_utils.parallel_parse(
+            cls.parse_file,
+            [
+                (filename, block_name, chunk_size, workers <= 1)
+                for filename in sps_folder.glob('*.*')
+                if filename.is_file() and filename.suffix.lower() in cls.suffixes
+            ],
+            workers,
+        )
+        for sps_file in sps_files:
+            if sps_file:
+                # one connection and transaction for the whole file
+                with DbUtils.session():
+                    cls.store_file(*sps_file)
 
-            sps_file.file_name = filename.name
-            sps_file.file_date = (
-                datetime.datetime.fromtimestamp(filename.stat().st_mtime)
-            )
-            sps_file.block_name = block_name
-            file_id = cls.sps_db.update_sps_file(sps_file)
+    @classmethod
+    def parse_file(cls, filename, block_name=None, chunk_size=CHUNK_SIZE, lazy=False):
+        ''' parse the sps file if it is new or has changed without writing to the
+            database, so it can run in a worker process of parallel_parse or a thread
+            of seis_watcher. In a process its arguments and result must be
+            picklable, so lazy is only used in the process that stores the file.
+            The block name is the block name entered by the user, as the watcher
+            has none it defaults to the folder of the file relative to
+            sps_base_folder. With lazy the chunks are parsed as store_file stores
+            them
+            returns:
+              the arguments of store_file, None if the file is in the database and
+              unchanged
+        '''
+        if block_name is None:
+            block_name = filename.parent.relative_to(cls.sps_base_folder).as_posix()
 
-            if file_id == -1:
-                continue
+        file_signature, is_unchanged = seis_utils.file_signature(
+            filename, cls.sps_db.get_sps_file_signature(filename.name, block_name)
+        )
+        if is_unchanged:
+            return None
 
-            sps_records = []
-            sps_signatures = np.array([])
-            count = 0
-            with open(filename, mode='rt') as sps:
+        sps_chunks = cls.parse_sps_chunks(filename, chunk_size)
+        return (
+            filename, file_signature, block_name,
+            sps_chunks if lazy else list(sps_chunks),
+        )
 
-                sps_lines = sps.readlines()
-                progress_bar = seis_utils.set_progress_bar(
-                    len(sps_lines) - HEADER_ROWS, sps_file.file_name, PROGRESS_SKIPS
-                )
-                for sps_line in sps_lines:
+    @classmethod
+    def parse_sps_chunks(cls, filename, chunk_size):
+        ''' generator of (number of lines, sps records by dpg_filename) of chunks of
+            chunk_size lines of the sps file
+        '''
+        with open(filename, mode='rt') as sps:
+            for sps_lines in seis_utils.read_chunks(sps, chunk_size):
+                sps_lines = [sps_line for sps_line in sps_lines if sps_line[0] == 'S']
+                sps_records = {}
+                for sps_line, time_break in zip(
+                    sps_lines, cls.parse_time_breaks(sps_lines)
+                ):
+                    sps_record = cls.parse_sps_line(sps_line, None, time_break)
+                    sps_records = cls.update_sps_records(sps_records, sps_record)
+
+                yield len(sps_lines), sps_records
 
-                    if sps_line[0] != 'S':
-                        continue
+    @classmethod
+    def store_file(cls, filename, file_signature, block_name, sps_chunks):
+        ''' store the chunks parsed by parse_file, each chunk is written to the
+            database before the next chunk is stored. The records of a changed file
+            are replaced. Records of earlier chunks with a duplicate in a later chunk
+            are deleted from the database, so the last record wins
+        '''
+        sps_file = FilesSpsTable(*[None]*7)
+        sps_file.file_name = filename.name
+        sps_file.file_size, sps_file.file_mtime, sps_file.file_hash = file_signature
+        sps_file.file_date = datetime.datetime.fromtimestamp(sps_file.file_mtime)
+        sps_file.block_name = block_name
+        file_id = cls.sps_db.update_sps_file(sps_file)
+
+        if file_id == -1:
+            return
+
+        progress_message = seis_utils.progress_message_generator(
+            f'reading chunks of lines from {filename.name}'
+        )
+        last_id = cls.sps_db.get_last_id()
+        signatures = seis_utils.RecordSignatures()
+        count = 0
+        total_records = 0
+        for chunk_count, sps_records in sps_chunks:
+            count += chunk_count
+            if not sps_records:
+                continue
 
-                    sps_record = cls.parse_sps_line(sps_line, file_id)
-                    sps_records, sps_signatures = cls.update_sps_records(
-                        sps_records, sps_signatures, sps_record)
+            duplicates = signatures.update(sps_records.keys())
+            if duplicates:
+                cls.sps_db.delete_duplicates(file_id, last_id, duplicates)
 
-                    if count % PROGRESS_SKIPS == 0:
-                        progress_bar.next()
-                    count += 1
+            sps_records = list(sps_records.values())
+            for sps_record in sps_records:
+                sps_record.file_id = file_id
 
-            print(f'\n{count - len(sps_records)} '
-                  f'duplicates have been deleted ...', end='')
+            cls.sps_db.update_sps(sps_records)
+            total_records += len(sps_records) - len(duplicates)
+            next(progress_message)
 
-            if sps_records:
-                cls.sps_db.update_sps(sps_records)
+        print(f'\n{count - total_records} '
+              f'duplicates have been deleted ...', end='')
 
-            progress_bar.finish()
+    @staticmethod
+    def parse_time_breaks(sps_lines):
+        ''' vectorised time breaks of sps_lines as parse_sps_line makes them, decoded
+            from the fixed width date and time of the dpg filename. As parse_sps_line
+            the milliseconds are taken as microseconds and the time is not adjusted
+            to local time, so they are decoded to datetime64[us]
+            returns:
+              list of the time break of each line, None for a line that is not a
+              plain date and time and is left to parse_sps_line
+        '''
+        char_matrix = seis_utils.fixed_width_matrix(sps_lines, SPS_TIME_BREAK_WIDTH)
+        time_breaks, decoded = seis_utils.fixed_width_datetime(
+            char_matrix,
+            {
+                'year': (80, 82),
+                'month': (82, 84),
+                'day': (84, 86),
+                'hour': (87, 89),
+                'minute': (89, 91),
+                'second': (91, 93),
+                'fraction': (93, 96),
+            },
+            unit='us',
+        )
+        return [
+            time_break if is_decoded else None
+            for time_break, is_decoded in zip(
+                time_breaks.astype(object), decoded.tolist()
+            )
+        ]
 
     @classmethod
-    def parse_sps_line(cls, sps_line, file_id):
+    def parse_sps_line(cls, sps_line, file_id, time_break=None):
+        ''' parse the attributes of sps_line, time_break is the time break of the
+            line by parse_time_breaks, if None it is parsed from the line
+        '''
         sps_record = SpsTable(*[None]*13)
 
         try:
-            # create time break date
-            time_break_str = ''.join([
-                sps_line[84:86], '-',    # day
-                sps_line[82:84], '-',    # month
-                sps_line[80:82], ' ',    # year
-                sps_line[87:89],         # hour
-                sps_line[89:91],         # minute
-                sps_line[91:93], '.000', # second
-                sps_line[93:96]          # millisecond
-            ])
-            time_break_time = datetime.datetime.strptime(
-                time_break_str, '%d-%m-%y %H%M%S.%f'
-            )
+            time_break_time = time_break
+            if time_break_time is None:
+                # create time break date
+                time_break_str = ''.join([
+                    sps_line[84:86], '-',    # day
+                    sps_line[82:84], '-',    # month
+                    sps_line[80:82], ' ',    # year
+                    sps_line[87:89],         # hour
+                    sps_line[89:91],         # minute
+                    sps_line[91:93], '.000', # second
+                    sps_line[93:96]          # millisecond
+                ])
+                time_break_time = datetime.datetime.strptime(
+                    time_break_str, '%d-%m-%y %H%M%S.%f'
+                )
             sps_record.file_id = file_id
             sps_record.sps_type = sps_line[0:1]
             sps_record.line = int(float(sps_line[6:11]))
@@ -106,43 +208,30 @@ class Sps:
         return sps_record
 
     @staticmethod
-    def update_sps_records(sps_records, record_signatures, sps_record):
-        ''' function that adds sps_record to the list sps_records. It keeps a list
-            of duplicate dpg_filesnames
+    def update_sps_records(sps_records, sps_record):
+        ''' function that adds sps_record to the dict sps_records, keyed on the
+            dpg_filename. A record with the dpg_filename of an earlier record
+            replaces it and moves to the end, so the last record wins
             arguments:
-              sps_records: list of vp_records
-              record_signatures: np array of record signatures
-              duplicates: np array of duplicate indexes
+              sps_records: dict of sps_records by dpg_filename
               sps_record: sps attributes of type SpsRecord
             return:
-              sps_records: list of sps_records of type SpsRecord
-              record_signatures: np array of record signatures of type string
-              duplicates: np array of indexes of type int
+              sps_records: dict of sps_records by dpg_filename
         '''
         if not sps_record.line:
-            return sps_records, record_signatures
+            return sps_records
 
-        # search duplicate records and remove
         record_signature = sps_record.dpg_filename
-
-        # remove a duplicate. Note there should only be zero or one duplicate, as a duplicate
-        # gets removed on first instance
-        duplicate = np.where(record_signatures == record_signature)[0]
-
-        # bug fix: if duplicate: returns False if first and only element of the array has a
-        # a value of 0!! Therefore test on numpy size the array.
-        if  duplicate.size != 0:
-            sps_records.pop(duplicate[0])
-            record_signatures = np.delete(record_signatures, duplicate)
-
-        # add the record ...
-        sps_records.append(sps_record)
-        record_signatures = np.append(record_signatures, record_signature)
-
-        return sps_records, record_signatures
+        sps_records.pop(record_signature, None)
+        sps_records[record_signature] = sps_record
+        return sps_records
 
 
 if __name__ == '__main__':
+    # with --bulk-load the database is written with the bulk_load profile for backfills
+    if '--bulk-load' in sys.argv[1:]:
+        DbUtils.use_profile('bulk_load')
+
     sps_db = SpsDb()
     sps_db.create_table_sps_files()
     sps_db.create_table_sps()
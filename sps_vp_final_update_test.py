@@ -0,0 +1,118 @@
+""" test the vectorised time breaks of sps_vp_final_update against parse_sps_line
+    and the registration of the sps files by block
+"""
+import datetime
+import sqlite3
+from sps_vp_final_update import Sps
+from seis_database import DbUtils
+from seis_sps_database import SpsDb
+from seis_settings import FilesSpsTable
+
+
+def sps_line(dpg_filename):
+    line = f"S{1001:10.1f}{2002:10.1f}  1V1   ".ljust(46)
+    line += f"{500000.5:9.1f}{2500000.5:10.1f}{120.5:6.1f}".ljust(34)
+    return line + dpg_filename.ljust(23) + "\n"
+
+
+def test_time_breaks_match_parse_sps_line():
+    sps_lines = [
+        sps_line("210305_102030123_07"),
+        sps_line("240229_235959999_07"),
+        sps_line("991231_000000000_07"),
+    ]
+    time_breaks = Sps.parse_time_breaks(sps_lines)
+    assert None not in time_breaks
+    for line, time_break in zip(sps_lines, time_breaks):
+        # the milliseconds are taken as microseconds by parse_sps_line
+        assert time_break == Sps.parse_sps_line(line, None).time_break
+        assert Sps.parse_sps_line(line, None, time_break) == Sps.parse_sps_line(
+            line, None
+        )
+
+
+def test_time_breaks_left_to_parse_sps_line():
+    sps_lines = [
+        sps_line("230229_102030123_07"),
+        sps_line("211305_102030123_07"),
+        sps_line("210305_246030123_07"),
+        sps_line("2103x5_102030123_07"),
+        sps_line("210305_1020301_07"),
+    ]
+    assert Sps.parse_time_breaks(sps_lines) == [None] * len(sps_lines)
+
+
+def sps_file(block_name, file_size, file_hash):
+    return FilesSpsTable(
+        None,
+        "Block.sps",
+        datetime.datetime(2021, 3, 5),
+        block_name,
+        file_size,
+        1614939630.0,
+        file_hash,
+    )
+
+
+def test_same_file_name_in_two_blocks(tmp_path, monkeypatch):
+    # the registry does not need spatialite, so a plain sqlite database will do
+    database = tmp_path / "sps.sqlite"
+    monkeypatch.setattr(
+        DbUtils, "open_connection", classmethod(lambda cls: sqlite3.connect(database))
+    )
+    SpsDb.create_table_sps_files()
+    with DbUtils.session() as connection:
+        connection.execute(
+            f"CREATE TABLE {SpsDb.table_sps} (id INTEGER PRIMARY KEY, file_id INTEGER);"
+        )
+
+    file_id_a = SpsDb.update_sps_file(sps_file("block_a", 100, "a" * 32))
+    with DbUtils.session() as connection:
+        connection.execute(
+            f"INSERT INTO {SpsDb.table_sps} (file_id) VALUES (?);", (file_id_a,)
+        )
+
+    file_id_b = SpsDb.update_sps_file(sps_file("block_b", 200, "b" * 32))
+    assert file_id_b not in (-1, file_id_a)
+    assert SpsDb.update_sps_file(sps_file("block_a", 100, "a" * 32)) == -1
+    assert SpsDb.get_sps_file_signature("Block.sps", "block_a")[::2] == (100, "a" * 32)
+    assert SpsDb.get_sps_file_signature("Block.sps", "block_b")[::2] == (200, "b" * 32)
+
+    with DbUtils.session() as connection:
+        assert connection.execute(
+            f"SELECT id, block_name FROM {SpsDb.table_sps_files} ORDER BY id;"
+        ).fetchall() == [(file_id_a, "block_a"), (file_id_b, "block_b")]
+        assert connection.execute(
+            f"SELECT file_id FROM {SpsDb.table_sps};"
+        ).fetchall() == [(file_id_a,)]
+
+
+class SpsDbRecorder:
+    """records the block names the file signatures are looked up for"""
+
+    def __init__(self):
+        self.block_names = []
+
+    def get_sps_file_signature(self, file_name, block_name):
+        self.block_names.append(block_name)
+        return None
+
+
+def test_block_name_of_nested_folder(project_database, tmp_path, monkeypatch):
+    sps_folder = tmp_path / "block_a" / "final"
+    sps_folder.mkdir(parents=True)
+    (sps_folder / "Block.sps").write_text(sps_line("210305_102030123_07"))
+    sps_db = SpsDbRecorder()
+    monkeypatch.setattr(Sps, "sps_base_folder", tmp_path)
+    monkeypatch.setattr(Sps, "sps_db", sps_db)
+    stored = []
+    monkeypatch.setattr(
+        Sps, "store_file", classmethod(lambda cls, *sps_file: stored.append(sps_file))
+    )
+
+    # the block name entered by the user is kept
+    Sps.read_sps("block_a/final", workers=1)
+    assert [sps_file[2] for sps_file in stored] == ["block_a/final"]
+    # without a block name, as in the watcher, it is the folder of the file
+    assert Sps.parse_file(sps_folder / "Block.sps")[2] == "block_a/final"
+    assert sps_db.block_names == ["block_a/final", "block_a/final"]
@@ -17,7 +17,7 @@ from pandas.plotting import register_matplotlib_converters
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import seis_utils
-from seis_vibe_database import VpDb
+from seis_cache import DataCache
 from seis_settings import (
     FLEETS,
     DATABASE_TABLE,
@@ -40,9 +40,7 @@ class VpActive:
         self.vps_by_interval_df = None
 
     def select_data(self, database_table, interval):
-        self.vp_records_df = VpDb().get_vp_data_by_date(
-            database_table, self.production_date
-        )
+        self.vp_records_df = DataCache().read(database_table, self.production_date)
 
         self.populate_vps_by_second()
         self.aggregate_vps_by_interval(interval)
@@ -53,15 +51,9 @@ class VpActive:
         )
 
         for vib in range(1, FLEETS + 1):
-            # get time strings and convert to datetime objects
             vib_data = self.vp_records_df[self.vp_records_df["vibrator"] == vib][
                 "time_break"
-            ]
-            if not vib_data.empty:
-                vib_data = pd.to_datetime(vib_data, format="ISO8601").to_list()
-
-            else:
-                vib_data = []
+            ].to_list()
 
             for vp_time in vib_data:
                 vp_seconds = int(
@@ -8,7 +8,7 @@ from scipy import stats
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
 import seis_utils
-from seis_vibe_database import VpDb
+from seis_cache import DataCache
 from seis_settings import (
     FLEETS,
     DATABASE_TABLE,
@@ -45,7 +45,7 @@ class VpAttributes:
         self._production_date = val
 
     def select_data(self):
-        self.vp_records_df = VpDb().get_vp_data_by_date(
+        self.vp_records_df = DataCache().read(
             self.database_table, self._production_date
         )
 
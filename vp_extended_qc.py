@@ -18,9 +18,6 @@ class VpExtendedQc:
     def get_location(self, production_date, vibrator_id, time_break):
         if self.vaps_df is None:
             self.vaps_df = VpDb().get_vp_data_by_date("VAPS", production_date)
-            self.vaps_df["time_break"] = pd.to_datetime(
-                self.vaps_df["time_break"], format="ISO8601"
-            )
         try:
             s_line, s_point, easting, northing, elevation = self.vaps_df[
                 (self.vaps_df["time_break"] == time_break)
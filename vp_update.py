@@ -4,15 +4,20 @@
     Copyright: 2021
 
 """
+import sys
 import warnings
 import datetime
 import numpy as np
+import pandas as pd
 import seis_utils
+from seis_database import DbUtils
 from seis_vibe_database import VpDb
+from seis_cache import DataCache
 from seis_settings import (
     DATA_FILES_VAPS,
     DATA_FILES_VP,
-    PROGRESS_SKIPS,
+    CHUNK_SIZE,
+    PARSE_WORKERS,
     LINK_VP_TO_VAPS,
     GMT_OFFSET,
     FilesVpTable,
@@ -23,66 +28,250 @@ from seis_settings import (
 
 # ignore warning velocity =  dist / time in method update_vo_distance
 warnings.filterwarnings("ignore", category=RuntimeWarning)
-HEADER_ROWS = 71
+VAPS_LINE_WIDTH = 225
+# the time break of a vp line ends with its milliseconds at column 55
+VP_TIME_BREAK_WIDTH = 55
+VP_SIGNATURE = ["line", "station", "vibrator"]
 
 
 class Vaps:
     vaps_base_folder = DATA_FILES_VAPS
+    suffixes = [".vaps", ".txt"]
     vp_db = VpDb()
 
     @classmethod
-    def read_vaps(cls):
-        for filename in cls.vaps_base_folder.glob("*.*"):
-            if not filename.is_file() or filename.suffix.lower() not in [
-                ".vaps",
-                ".txt",
-            ]:
-                continue
+    def read_vaps(cls, chunk_size=CHUNK_SIZE, incremental=False, workers=PARSE_WORKERS):
+        """read the vaps files that are new or have changed. With incremental
+        files in the database are read again from where the previous run stopped, so
+        records appended to a file that is still being recorded are added. With
+        workers > 1 the files are parsed in that many processes while this process
+        stores them in the order of the files
+        """
+        vaps_files = seis_utils.parallel_parse(
+            cls.parse_file,
+            [
+                (filename, chunk_size, incremental, workers <= 1)
+                for filename in cls.vaps_base_folder.glob("*.*")
+                if filename.is_file() and filename.suffix.lower() in cls.suffixes
+            ],
+            workers,
+        )
+        for vaps_file in vaps_files:
+            if vaps_file:
+                # one connection and transaction for the whole file
+                with DbUtils.session():
+                    cls.store_file(*vaps_file)
+
+    @classmethod
+    def parse_file(cls, filename, chunk_size=CHUNK_SIZE, incremental=True, lazy=False):
+        """parse the part of the vaps file that is not yet in the database without
+        writing to the database, so it can run in a worker process of parallel_parse
+        or a thread of seis_watcher. In a process its arguments and result must be
+        picklable, so lazy is only used in the process that stores the file.
+        A new file is parsed from the start and a file in the database is parsed
+        again if it has changed.
+        With incremental a file in the database is parsed from where the previous read
+        stopped, or from the start if it no longer has last_signature as the line
+        ending at the stored offset, as it has been changed.
+        With lazy the chunks are parsed as store_file stores them.
+        returns:
+          the arguments of store_file, None if there is nothing to read
+        """
+        vaps_file_state = cls.vp_db.get_vaps_file_state(filename.name)
+        file_id, offset, last_signature = (vaps_file_state or (None, 0, None))[:3]
+        file_signature, is_unchanged = seis_utils.file_signature(
+            filename, vaps_file_state[3:] if vaps_file_state else None
+        )
+        replace = False
+        file_size = file_signature[0]
+        with open(filename, mode="rb") as vaps:
+            if file_id is not None and incremental:
+                replace = offset is None or (
+                    seis_utils.last_complete_line(vaps, offset)
+                    != (offset, last_signature)
+                )
+
+            elif file_id is not None:
+                if is_unchanged:
+                    return None
+
+                replace = True
 
-            vaps_file = FilesVapsTable(*[None] * 3)
+            end_offset, last_signature = seis_utils.last_complete_line(vaps, file_size)
 
+        # with incremental a last line that may still be being written is left
+        end = end_offset if incremental else file_size
+        if replace:
+            offset = 0
+
+        elif end <= offset:
+            return None
+
+        vaps_chunks = cls.parse_vaps_chunks(filename, chunk_size, offset, end)
+        return (
+            filename,
+            file_id,
+            file_signature,
+            offset,
+            replace,
+            end_offset,
+            last_signature,
+            vaps_chunks if lazy else list(vaps_chunks),
+        )
+
+    @classmethod
+    def parse_vaps_chunks(cls, filename, chunk_size, start, end):
+        """generator of the records between byte offsets start and end of the vaps
+        file in DataFrames of chunks of chunk_size lines, deduplicated in the chunk
+        """
+        with open(filename, mode="rb") as vaps:
+            lines = seis_utils.read_lines(vaps, start, end)
+            for vaps_lines in seis_utils.read_chunks(lines, chunk_size):
+                vaps_df = cls.parse_vaps_lines(vaps_lines, None)
+                yield vaps_df.drop_duplicates(subset=VP_SIGNATURE, keep="last")
+
+    @classmethod
+    def store_file(
+        cls,
+        filename,
+        file_id,
+        file_signature,
+        offset,
+        replace,
+        end_offset,
+        last_signature,
+        vaps_chunks,
+    ):
+        """store the chunks parsed by parse_file, each chunk is written to the
+        database before the next chunk is stored. A new file is first added to the
+        files and the records of a changed file are replaced. Records of earlier
+        chunks with a duplicate in a later chunk are deleted from the database, so the
+        last record wins as if the file was read in one go. With an offset a record
+        replaces any record of the file with the same signature and only the vibrators
+        in the new records get their distances updated. The byte offset and text of
+        the last complete line read are kept in the database to continue from,
+        together with the (size, mtime, hash) of the file
+        """
+        if file_id is None:
+            vaps_file = FilesVapsTable(*[None] * 8)
             vaps_file.file_name = filename.name
-            vaps_file.file_date = datetime.datetime.fromtimestamp(
-                filename.stat().st_mtime
+            vaps_file.file_size, vaps_file.file_mtime, vaps_file.file_hash = (
+                file_signature
             )
+            vaps_file.file_date = datetime.datetime.fromtimestamp(vaps_file.file_mtime)
             file_id = cls.vp_db.update_vaps_file(vaps_file)
 
             if file_id == -1:
+                return
+
+        prod_dates = set()
+        if replace:
+            print(f"\n{filename.name} has changed and is read again ...", end="")
+            prod_dates = cls.vp_db.delete_vaps_file_records(file_id)
+
+        progress_message = seis_utils.progress_message_generator(
+            f"reading chunks of lines from {filename.name}"
+        )
+        # a duplicate of a record of a previous read can have any id of the file
+        last_id = 0 if offset else cls.vp_db.get_last_id("VAPS")
+        signatures = seis_utils.RecordSignatures()
+        count = 0
+        total_records = 0
+        vibrators = set()
+        for vaps_df in vaps_chunks:
+            count += vaps_df.attrs["count"]
+            if vaps_df.empty:
                 continue
 
-            vaps_records = []
-            vaps_signatures = np.array([])
-            count = 0
-            with open(filename, mode="rt") as vaps:
-                vaps_lines = vaps.readlines()
-                progress_bar = seis_utils.set_progress_bar(
-                    len(vaps_lines) - HEADER_ROWS, vaps_file.file_name, PROGRESS_SKIPS
+            vaps_df["file_id"] = file_id
+            chunk_signatures = vaps_df[VP_SIGNATURE].itertuples(index=False, name=None)
+            if offset:
+                duplicates = list(chunk_signatures)
+
+            else:
+                duplicates = signatures.update(chunk_signatures)
+
+            deleted = 0
+            if duplicates:
+                deleted = cls.vp_db.delete_duplicates(
+                    "VAPS", file_id, last_id, duplicates
                 )
-                for vaps_line in vaps_lines:
-                    if vaps_line[0] != "A":
-                        continue
 
-                    vaps_record = cls.parse_vaps_line(vaps_line, file_id)
-                    vaps_records, vaps_signatures = cls.update_vp_records(
-                        vaps_records, vaps_signatures, vaps_record
-                    )
+            cls.vp_db.update_vaps(vaps_df)
+            total_records += vaps_df.shape[0] - deleted
+            prod_dates.update(vaps_df["time_break"].dt.date)
+            vibrators.update(vaps_df["vibrator"])
+            next(progress_message)
 
-                    if count % PROGRESS_SKIPS == 0:
-                        progress_bar.next()
-                    count += 1
+        cls.vp_db.update_vaps_file_state(
+            file_id, end_offset, last_signature, file_signature
+        )
+        print(f"\n{count - total_records} duplicates have been deleted ...", end="")
 
-                print(
-                    f"\n{count - len(vaps_records)} "
-                    f"duplicates have been deleted ...",
-                    end="",
-                )
+        if prod_dates:
+            cls.vp_db.update_vp_distance(
+                "VAPS", prod_dates, vibrators=vibrators if offset else None
+            )
+            DataCache().update("VAPS", prod_dates)
 
-                if vaps_records:
-                    cls.vp_db.update_vaps(vaps_records)
-                    cls.vp_db.update_vp_distance(
-                        "VAPS", vaps_records[0].time_break.date()
-                    )
-                progress_bar.finish()
+    @classmethod
+    def parse_vaps_lines(cls, vaps_lines, file_id):
+        """columnar version of parse_vaps_line, parses all "A" records of vaps_lines
+        in one pass using the same fixed width offsets.
+        returns:
+          DataFrame with the VapsTable attributes as columns. Like parse_vaps_line,
+          records with a field that cannot be converted are dropped. The number of
+          "A" records is stored in attrs["count"]
+        """
+        vaps_lines = [vaps_line for vaps_line in vaps_lines if vaps_line[:1] == "A"]
+        char_matrix = seis_utils.fixed_width_matrix(vaps_lines, VAPS_LINE_WIDTH)
+        valid = np.ones(len(vaps_lines), dtype=bool)
+
+        def field(start, end, dtype=str):
+            nonlocal valid
+            values, valid_values = seis_utils.fixed_width_field(
+                char_matrix, start, end, dtype
+            )
+            valid &= valid_values
+            return values
+
+        line = field(1, 17, float)
+        station = field(17, 25, float)
+        valid &= np.isfinite(line) & np.isfinite(station)
+        vaps_df = pd.DataFrame(
+            {
+                "file_id": file_id,
+                "line": np.trunc(line),
+                "station": np.trunc(station),
+                "fleet_nr": field(26, 27),
+                "vibrator": field(27, 29, int),
+                "drive": field(29, 32, int),
+                "avg_phase": field(32, 36, int),
+                "peak_phase": field(36, 40, int),
+                "avg_dist": field(40, 42, int),
+                "peak_dist": field(42, 44, int),
+                "avg_force": field(44, 46, int),
+                "peak_force": field(46, 49, int),
+                "avg_stiffness": field(49, 52, int),
+                "avg_viscosity": field(52, 55, int),
+                "easting": field(55, 64, float),
+                "northing": field(64, 74, float),
+                "elevation": field(74, 80, float),
+                "time_break": field(134, 147, int),
+                "hdop": field(126, 130, float),
+                "tb_date": field(130, 150),
+                "positioning": field(150, 225),
+            }
+        )
+        # records without a line number are ignored
+        vaps_df = vaps_df[valid & (vaps_df["line"] != 0)].reset_index(drop=True)
+        vaps_df = vaps_df.astype({"line": "int64", "station": "int64"})
+        vaps_df["time_break"] = (
+            pd.Series(seis_utils.epoch_ms_to_local(vaps_df["time_break"]))
+            + GMT_OFFSET
+        )
+        vaps_df.attrs["count"] = len(vaps_lines)
+        return vaps_df
 
     @classmethod
     def parse_vaps_line(cls, vaps_line, file_id):
@@ -122,114 +311,167 @@ class Vaps:
 
         return vaps_record
 
-    @staticmethod
-    def update_vp_records(vp_records, record_signatures, vp_record):
-        """function to add vp_record to the list vp_records. For each record it makes a 10
-        digits 'signature' being <line (4)><stations (4)><vibrator (2)>. It keeps a list
-        of the indexes of duplicates
-        arguments:
-            vp_records: list of vp_records
-            record_signatures: np array of record signatures
-            duplicates: np array of duplicae indexes
-            vp_record: vp attributes of type VpRecord
-        return:
-            vp_records: list of vp_records of type VpRecord
-            record_signatures: np array of record signatures of type string
-            duplicates: np array of indexes of type int
-        """
-        if not vp_record.line:
-            return vp_records, record_signatures
 
-        # search duplicate records and remove
-        line, station, vib = vp_record.line, vp_record.station, vp_record.vibrator
-        record_signature = f"{line:04}" + f"{station:04}" + f"{vib:02}"
+class Vp:
+    vp_base_folder = DATA_FILES_VP
+    suffixes = [".txt"]
+    vp_db = VpDb()
 
-        # remove a duplicate. Note there should only be zero or one duplicate, as a duplicate
-        # gets removed on first instance
-        duplicate = np.where(record_signatures == record_signature)[0]
+    @classmethod
+    def read_vp(cls, chunk_size=CHUNK_SIZE, workers=PARSE_WORKERS):
+        vp_files = seis_utils.parallel_parse(
+            cls.parse_file,
+            [
+                (filename, chunk_size, workers <= 1)
+                for filename in cls.vp_base_folder.glob("*.*")
+                if filename.is_file() and filename.suffix.lower() in cls.suffixes
+            ],
+            workers,
+        )
+        for vp_file in vp_files:
+            if vp_file:
+                # one connection and transaction for the whole file
+                with DbUtils.session():
+                    cls.store_file(*vp_file)
 
-        # bug fix: if duplicate: returns False if first and only element of the array has a
-        # a value of 0!! Therefore test on numpy size the array.
-        if duplicate.size != 0:
-            vp_records.pop(duplicate[0])
-            record_signatures = np.delete(record_signatures, duplicate)
+    @classmethod
+    def parse_file(cls, filename, chunk_size=CHUNK_SIZE, lazy=False):
+        """parse the vp file if it is new or has changed, see Vaps.parse_file"""
+        file_signature, is_unchanged = seis_utils.file_signature(
+            filename, cls.vp_db.get_vp_file_signature(filename.name)
+        )
+        if is_unchanged:
+            return None
 
-        # add the record ...
-        vp_records.append(vp_record)
-        record_signatures = np.append(record_signatures, record_signature)
+        vp_chunks = cls.parse_vp_chunks(filename, chunk_size)
+        return filename, file_signature, vp_chunks if lazy else list(vp_chunks)
 
-        return vp_records, record_signatures
+    @classmethod
+    def parse_vp_chunks(cls, filename, chunk_size):
+        """generator of (number of lines, vp records by signature) of chunks of
+        chunk_size lines of the vp file, records without a line number are ignored
+        """
+        with open(filename, mode="rt") as vp:
+            for vp_lines in seis_utils.read_chunks(vp, chunk_size):
+                vp_lines = [
+                    vp_line for vp_line in vp_lines if vp_line[0:9].strip() != "Line"
+                ]
+                vp_records = {}
+                for vp_line, time_break in zip(
+                    vp_lines, cls.parse_time_breaks(vp_lines)
+                ):
+                    vp_record = cls.parse_vp_line(vp_line, None, time_break)
+                    if not vp_record.line:
+                        continue
 
+                    # a record with the signature of an earlier record replaces it
+                    # and moves to the end, so the last record wins
+                    signature = (vp_record.line, vp_record.station, vp_record.vibrator)
+                    vp_records.pop(signature, None)
+                    vp_records[signature] = vp_record
 
-class Vp:
-    vp_base_folder = DATA_FILES_VP
-    vp_db = VpDb()
+                yield len(vp_lines), vp_records
 
     @classmethod
-    def read_vp(cls):
-        for filename in cls.vp_base_folder.glob("*.*"):
-            if not filename.is_file() or filename.suffix.lower != ".txt":
+    def store_file(cls, filename, file_signature, vp_chunks):
+        """store the chunks parsed by parse_file, see Vaps.store_file"""
+        vp_file = FilesVpTable(*[None] * 6)
+        vp_file.file_name = filename.name
+        vp_file.file_size, vp_file.file_mtime, vp_file.file_hash = file_signature
+        vp_file.file_date = datetime.datetime.fromtimestamp(vp_file.file_mtime)
+        file_id = cls.vp_db.update_vp_file(vp_file)
+
+        if file_id == -1:
+            return
+
+        progress_message = seis_utils.progress_message_generator(
+            f"reading chunks of lines from {filename.name}"
+        )
+        last_id = cls.vp_db.get_last_id("VP")
+        signatures = seis_utils.RecordSignatures()
+        count = 0
+        total_records = 0
+        prod_dates = set()
+        for chunk_count, vp_records in vp_chunks:
+            count += chunk_count
+            if not vp_records:
                 continue
 
-            vp_file = FilesVpTable(*[None] * 3)
+            duplicates = signatures.update(vp_records.keys())
+            if duplicates:
+                cls.vp_db.delete_duplicates("VP", file_id, last_id, duplicates)
 
-            vp_file.file_name = filename.name
-            vp_file.file_date = datetime.datetime.fromtimestamp(
-                filename.stat().st_mtime
-            )
-            file_id = cls.vp_db.update_vp_file(vp_file)
+            vp_records = list(vp_records.values())
+            for vp_record in vp_records:
+                vp_record.file_id = file_id
 
-            if file_id == -1:
-                continue
-
-            vp_records = []
-            vp_signatures = np.array([])
-            count = 0
-            with open(filename, mode="rt") as vp:
-                vp_lines = vp.readlines()
-                progress_bar = seis_utils.set_progress_bar(
-                    len(vp_lines) - HEADER_ROWS, vp_file.file_name, PROGRESS_SKIPS
-                )
-                for vp_line in vp_lines:
-                    if vp_line[0:9].strip() == "Line":
-                        continue
+            cls.vp_db.update_vp(vp_records)
+            total_records += len(vp_records) - len(duplicates)
+            prod_dates.update(vp_record.time_break.date() for vp_record in vp_records)
+            next(progress_message)
 
-                    vp_record = cls.parse_vp_line(vp_line, file_id)
-                    vp_records, vp_signatures = cls.update_vp_records(
-                        vp_records, vp_signatures, vp_record
-                    )
+        print(f"\n{count - total_records} duplicates have been deleted ...", end="")
 
-                    if count % PROGRESS_SKIPS == 0:
-                        progress_bar.next()
-                    count += 1
+        if LINK_VP_TO_VAPS:
+            linked = cls.vp_db.link_vp_to_vaps(file_id)
+            print(
+                f"\n{linked} of {total_records} vp records linked to vaps ...", end=""
+            )
 
-                print(
-                    f"\n{count - len(vp_records)} " f"duplicates have been deleted ...",
-                    end="",
-                )
+        if prod_dates:
+            cls.vp_db.update_vp_distance("VP", prod_dates)
+            DataCache().update("VP", prod_dates)
 
-                if vp_records:
-                    cls.vp_db.update_vp(vp_records, link_vaps=LINK_VP_TO_VAPS)
-                    cls.vp_db.update_vp_distance("VP", vp_records[0].time_break.date())
-                progress_bar.finish()
+    @staticmethod
+    def parse_time_breaks(vp_lines):
+        """vectorised time breaks of vp_lines as parse_vp_line makes them, decoded
+        from the fixed width date and time to datetime64[ms] and adjusted to local
+        time. As parse_vp_line the year is kept by its last 2 digits only.
+        returns:
+          list of the time break of each line, None for a line that is not a plain
+          date and time and is left to parse_vp_line
+        """
+        char_matrix = seis_utils.fixed_width_matrix(vp_lines, VP_TIME_BREAK_WIDTH)
+        time_breaks, decoded = seis_utils.fixed_width_datetime(
+            char_matrix,
+            {
+                "century": (32, 34),
+                "year": (34, 36),
+                "month": (37, 39),
+                "day": (40, 42),
+                "hour": (43, 45),
+                "minute": (46, 48),
+                "second": (49, 51),
+                "fraction": (52, 55),
+            },
+            separators={36: "-", 39: "-", 42: " ", 45: ":", 48: ":"},
+        )
+        time_breaks = (time_breaks + np.timedelta64(GMT_OFFSET)).astype(object)
+        return [
+            time_break if is_decoded else None
+            for time_break, is_decoded in zip(time_breaks, decoded.tolist())
+        ]
 
     @staticmethod
-    def parse_vp_line(vp_line, file_id):
+    def parse_vp_line(vp_line, file_id, time_break=None):
+        """parse the attributes of vp_line, time_break is the time break of the line
+        by parse_time_breaks, if None it is parsed from the line
+        """
         vp_record = VpTable(*[None] * 24)
 
         try:
-            # create time break date and adjust to local time
-            time_break = datetime.datetime.strptime(
-                datetime.datetime.strptime(
-                    vp_line[32:51], "%Y-%m-%d %H:%M:%S"
-                ).strftime("%d-%m-%y %H:%M:%S")
-                + "."
-                + vp_line[52:55]
-                + "000",
-                "%d-%m-%y %H:%M:%S.%f",
-            )
-
-            time_break += GMT_OFFSET
+            if time_break is None:
+                # create time break date and adjust to local time
+                time_break = datetime.datetime.strptime(
+                    datetime.datetime.strptime(
+                        vp_line[32:51], "%Y-%m-%d %H:%M:%S"
+                    ).strftime("%d-%m-%y %H:%M:%S")
+                    + "."
+                    + vp_line[52:55]
+                    + "000",
+                    "%d-%m-%y %H:%M:%S.%f",
+                )
+                time_break += GMT_OFFSET
 
             vp_record.line = int(vp_line[0:9])
             vp_record.station = int(vp_line[9:19])
@@ -256,55 +498,22 @@ class Vp:
 
         return vp_record
 
-    @staticmethod
-    def update_vp_records(vp_records, record_signatures, vp_record):
-        """function to add vp_record to the list vp_records. For each record it makes a 10
-        digits 'signature' being <line (4)><stations (4)><vibrator (2)>. It keeps a list
-        of the indexes of duplicates
-        arguments:
-            vp_records: list of vp_records
-            record_signatures: np array of record signatures
-            duplicates: np array of duplicae indexes
-            vp_record: vp attributes of type VpRecord
-        return:
-            vp_records: list of vp_records of type VpRecord
-            record_signatures: np array of record signatures of type string
-            duplicates: np array of indexes of type int
-        """
-        if not vp_record.line:
-            return vp_records, record_signatures
-
-        # search duplicate records and remove
-        line, station, vib = vp_record.line, vp_record.station, vp_record.vibrator
-        record_signature = f"{line:04}" + f"{station:04}" + f"{vib:02}"
-
-        # remove a duplicate. Note there should only be zero or one duplicate, as a duplicate
-        # gets removed on first instance
-        duplicate = np.where(record_signatures == record_signature)[0]
-
-        # bug fix: if duplicate: returns False if first and only element of the array has a
-        # a value of 0!! Therefore test on numpy size the array.
-        if duplicate.size != 0:
-            vp_records.pop(duplicate[0])
-            record_signatures = np.delete(record_signatures, duplicate)
-
-        # add the record ...
-        vp_records.append(vp_record)
-        record_signatures = np.append(record_signatures, record_signature)
-
-        return vp_records, record_signatures
-
 
 if __name__ == "__main__":
     seis_utils.check_expiry_date()
+    # with --bulk-load the database is written with the bulk_load profile for backfills
+    if "--bulk-load" in sys.argv[1:]:
+        DbUtils.use_profile("bulk_load")
+
     vp_db = VpDb()
     vp_db.create_table_vaps_files()
     vp_db.create_table_vaps()
     # vp_db.create_table_vp_files()
     # vp_db.create_table_vp()
 
+    # with --incremental files already in the database are followed for new records
     vaps = Vaps()
-    vaps.read_vaps()
+    vaps.read_vaps(incremental="--incremental" in sys.argv[1:])
 
     # vp = Vp()
     # vp.read_vp()
@@ -0,0 +1,145 @@
+"""benchmark of inserting vaps records in the database, row by row with a cursor.execute
+per record as before versus DbUtils.bulk_insert with executemany in batches. For the
+bulk insert the geometry made by MakePoint in the insert is compared with plain
+inserts followed by one UPDATE of the geometry per batch.
+Runs on a synthetic vaps table in a temporary database, the project database is not
+touched
+"""
+
+import time
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+from seis_database import DbUtils
+from seis_vibe_database import VpDb
+from seis_settings import EPSG_PSD93, BATCH_SIZE
+
+N_ROWS = 500_000
+
+
+def synthetic_vaps_df(n_rows: int, seed: int = 42) -> pd.DataFrame:
+    """vaps records with the VapsTable attributes as columns"""
+    rng = np.random.default_rng(seed)
+    time_break = pd.Timestamp("2023-11-15") + pd.to_timedelta(
+        np.sort(rng.integers(0, 86_400_000, n_rows)), unit="ms"
+    )
+    return pd.DataFrame(
+        {
+            "file_id": 1,
+            "line": rng.integers(1000, 1500, n_rows),
+            "station": rng.integers(1000, 3000, n_rows),
+            "fleet_nr": "1",
+            "vibrator": rng.integers(1, 11, n_rows),
+            "drive": rng.integers(0, 100, n_rows),
+            "avg_phase": rng.integers(0, 10, n_rows),
+            "peak_phase": rng.integers(0, 20, n_rows),
+            "avg_dist": rng.integers(0, 30, n_rows),
+            "peak_dist": rng.integers(0, 60, n_rows),
+            "avg_force": rng.integers(50, 80, n_rows),
+            "peak_force": rng.integers(60, 90, n_rows),
+            "avg_stiffness": rng.integers(0, 500, n_rows),
+            "avg_viscosity": rng.integers(0, 100, n_rows),
+            "easting": rng.uniform(700_000, 800_000, n_rows).round(1),
+            "northing": rng.uniform(2_400_000, 2_500_000, n_rows).round(1),
+            "elevation": rng.uniform(0, 500, n_rows).round(1),
+            "time_break": time_break,
+            "hdop": rng.uniform(0, 2, n_rows).round(1),
+            "tb_date": time_break.strftime("%a %b %d %H:%M:%S %Y"),
+            "positioning": "PPS",
+        }
+    )
+
+
+@DbUtils.connect
+def insert_row_by_row(vaps_df: pd.DataFrame, cursor: any) -> None:
+    """the insert as it was: a cursor.execute and a shapely Point per record"""
+    sql_string = (
+        f"INSERT INTO {VpDb.table_vaps} ({', '.join(VpDb.vaps_columns)}, geom) "
+        f'VALUES ({", ".join(["?"]*21)}, MakePoint(?, ?, ?));'
+    )
+    fields = list(VpDb.vaps_columns.values())
+    easting_index = fields.index("easting")
+    northing_index = fields.index("northing")
+    for vaps_row in DbUtils.df_to_rows(vaps_df, fields):
+        point = Point(vaps_row[easting_index], vaps_row[northing_index])
+        cursor.execute(sql_string, (*vaps_row, point.x, point.y, EPSG_PSD93))
+
+
+@DbUtils.connect
+def insert_geometry_in_insert(vaps_df: pd.DataFrame, cursor: any) -> None:
+    """executemany in batches with the geometry made by MakePoint in the insert"""
+    DbUtils.bulk_insert(
+        cursor, VpDb.table_vaps, VpDb.vaps_columns, vaps_df, geometry=True
+    )
+
+
+@DbUtils.connect
+def insert_geometry_per_batch(vaps_df: pd.DataFrame, cursor: any) -> None:
+    """executemany in batches without the geometry, followed by one UPDATE per batch
+    that makes the geometry of the records just inserted
+    """
+    for start in range(0, vaps_df.shape[0], BATCH_SIZE):
+        cursor.execute(f"SELECT MAX(id) FROM {VpDb.table_vaps};")
+        last_id = cursor.fetchone()[0] or 0
+        DbUtils.bulk_insert(
+            cursor,
+            VpDb.table_vaps,
+            VpDb.vaps_columns,
+            vaps_df.iloc[start : start + BATCH_SIZE],
+        )
+        cursor.execute(
+            f"UPDATE {VpDb.table_vaps} "
+            f"SET geom = MakePoint(easting, northing, {EPSG_PSD93}) WHERE id > ?;",
+            (last_id,),
+        )
+
+
+@DbUtils.connect
+def get_geometries(cursor: any) -> list:
+    cursor.execute(f"SELECT id, AsBinary(geom) FROM {VpDb.table_vaps} ORDER BY id;")
+    return cursor.fetchall()
+
+
+def time_insert(insert_function, vaps_df: pd.DataFrame, database: Path) -> float:
+    """returns rows/s of insert_function in a new database"""
+    DbUtils.database = database
+    DbUtils.create_database()
+    VpDb.create_table_vaps_files()
+    VpDb.create_table_vaps()
+    start = time.perf_counter()
+    insert_function(vaps_df)
+    return len(vaps_df) / (time.perf_counter() - start)
+
+
+def main():
+    vaps_df = synthetic_vaps_df(N_ROWS)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        row_by_row = time_insert(
+            insert_row_by_row, vaps_df, Path(tmp_dir) / "row_by_row.sqlite3"
+        )
+        bulk = time_insert(VpDb.update_vaps, vaps_df, Path(tmp_dir) / "bulk.sqlite3")
+        geometry_in_insert = time_insert(
+            insert_geometry_in_insert, vaps_df, Path(tmp_dir) / "in_insert.sqlite3"
+        )
+        geometries = get_geometries()
+        geometry_per_batch = time_insert(
+            insert_geometry_per_batch, vaps_df, Path(tmp_dir) / "per_batch.sqlite3"
+        )
+        identical = geometries == get_geometries()
+
+    print(
+        f"\n\ninsert {N_ROWS:,} vaps records\n"
+        f"row by row: {row_by_row:12,.0f} rows/s\n"
+        f"bulk:       {bulk:12,.0f} rows/s\n"
+        f"speed up:   {bulk / row_by_row:12.1f} x\n\n"
+        f"bulk without the summaries\n"
+        f"geometry in insert: {geometry_in_insert:12,.0f} rows/s\n"
+        f"geometry per batch: {geometry_per_batch:12,.0f} rows/s\n"
+        f"identical geometry: {identical}"
+    )
+
+
+if __name__ == "__main__":
+    main()
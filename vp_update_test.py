@@ -0,0 +1,296 @@
+""" test the vectorised time breaks of vp_update against parse_vp_line and the
+    columnar parse of vaps lines against parse_vaps_line, the chunks of a vaps file,
+    the incremental parse of a growing vaps file and how store_file writes them
+"""
+import pandas as pd
+import pytest
+from seis_cache import DataCache
+from vp_update import Vaps, Vp, VP_SIGNATURE
+
+
+def vp_line(time_break, milliseconds="123"):
+    line = f"{1001:9d}{2002:10d}{'   VIB07':>10}   {time_break}.{milliseconds}"
+    line = line.ljust(64) + f"{500000.0:15.1f}{2500000.0:15.1f}".ljust(45)
+    line += f"{500001.5:15.1f}{2500001.5:15.1f}{120.5:15.1f}{2.5:12.1f}"
+    return line + "".join(f"{value:12d}" for value in range(60, 66)) + "    OK    \n"
+
+
+def test_time_breaks_match_parse_vp_line():
+    vp_lines = [
+        vp_line("2021-03-05 10:20:30"),
+        vp_line("2024-02-29 23:59:59", "999"),
+        vp_line("1999-12-31 00:00:00", "000"),
+        # the year is kept by its last 2 digits only
+        vp_line("2070-01-01 12:00:00"),
+        vp_line("1968-06-30 12:00:00"),
+    ]
+    time_breaks = Vp.parse_time_breaks(vp_lines)
+    assert None not in time_breaks
+    for line, time_break in zip(vp_lines, time_breaks):
+        assert time_break == Vp.parse_vp_line(line, None).time_break
+        assert Vp.parse_vp_line(line, None, time_break) == Vp.parse_vp_line(line, None)
+
+
+def test_time_breaks_left_to_parse_vp_line():
+    vp_lines = [
+        vp_line("2023-02-29 10:20:30"),
+        vp_line("2021-13-05 10:20:30"),
+        vp_line("2021-03-05 24:20:30"),
+        vp_line("2021/03/05 10:20:30"),
+        vp_line("0000-03-05 10:20:30"),
+        vp_line("2021-03-05 10:20:30", "12"),
+        vp_line("2021-03-05 10:20:30", "1x3"),
+        vp_line("2021-03-05 10:20:30")[:40],
+    ]
+    assert Vp.parse_time_breaks(vp_lines) == [None] * len(vp_lines)
+    assert Vp.parse_time_breaks([]) == []
+
+
+def vaps_line(line="1001.0", hdop="1.5", time_break="1614939630123", vibrator="07"):
+    line = f"A{line:>16}{'2002.0':>8} 1{vibrator}100  12  25102070080050040"
+    line += f"{500000.5:9.1f}{2500000.5:10.1f}{120.5:6.1f}".ljust(71)
+    line += f"{hdop:>4}    {time_break:>13}   "
+    return line + "GPS OK".ljust(75) + "\n"
+
+
+def test_parse_vaps_lines_match_parse_vaps_line():
+    vaps_lines = [
+        vaps_line(),
+        vaps_line("1002.7", "12.5", "1709251199999", "12"),
+        vaps_line(hdop="NaN"),
+        # records without a line number are ignored
+        vaps_line("-0.0"),
+        vaps_line("0"),
+        # records with a field that cannot be converted are dropped
+        vaps_line(vibrator="0x"),
+        vaps_line("", "1.5"),
+        vaps_line(time_break="161493963012x"),
+        vaps_line()[:120],
+        vaps_line()[:20],
+        "A\n",
+        "\n",
+        "",
+        "H header line\n",
+    ]
+    vaps_df = Vaps.parse_vaps_lines(vaps_lines, 7)
+    vaps_records = [
+        vaps_record
+        for vaps_record in (
+            Vaps.parse_vaps_line(line, 7) for line in vaps_lines if line[:1] == "A"
+        )
+        if vaps_record.line
+    ]
+    assert vaps_df.attrs["count"] == 11
+    assert len(vaps_df) == len(vaps_records) == 3
+    for vaps_row, vaps_record in zip(vaps_df.to_dict("records"), vaps_records):
+        for column, value in vaps_row.items():
+            expected = getattr(vaps_record, column)
+            assert value == expected or (pd.isna(value) and pd.isna(expected)), column
+
+
+@pytest.fixture
+def vaps_file(tmp_path):
+    vaps_lines = [
+        "H header line\n",
+        vaps_line("1001.0", vibrator="07"),
+        vaps_line("1001.0", vibrator="08"),
+        vaps_line("1001.0", "2.5", vibrator="07"),
+        vaps_line("1002.0", vibrator="07"),
+        vaps_line("1001.0", "3.5", vibrator="08"),
+    ]
+    filename = tmp_path / "test.vaps"
+    filename.write_text("".join(vaps_lines))
+    return filename, vaps_lines
+
+
+def test_parse_vaps_chunks_dedupes_in_chunk(vaps_file):
+    filename, vaps_lines = vaps_file
+    vaps_chunks = list(Vaps.parse_vaps_chunks(filename, 4, 0, filename.stat().st_size))
+    assert [vaps_df.attrs["count"] for vaps_df in vaps_chunks] == [3, 2]
+    # the last record of a signature in the chunk wins
+    assert [
+        vaps_df[[*VP_SIGNATURE, "hdop"]].values.tolist() for vaps_df in vaps_chunks
+    ] == [
+        [[1001, 2002, 8, 1.5], [1001, 2002, 7, 2.5]],
+        [[1002, 2002, 7, 1.5], [1001, 2002, 8, 3.5]],
+    ]
+
+
+def test_parse_vaps_chunks_between_offsets(vaps_file):
+    filename, vaps_lines = vaps_file
+    start = len("".join(vaps_lines[:2]))
+    end = len("".join(vaps_lines[:4]))
+    vaps_chunks = list(Vaps.parse_vaps_chunks(filename, 4, start, end))
+    assert len(vaps_chunks) == 1
+    assert vaps_chunks[0][[*VP_SIGNATURE, "hdop"]].values.tolist() == [
+        [1001, 2002, 8, 1.5],
+        [1001, 2002, 7, 2.5],
+    ]
+
+
+class VpDbRecorder:
+    """records the calls of store_file to the database"""
+
+    def __init__(self):
+        self.calls = []
+        self.file_state = None
+
+    def get_vaps_file_state(self, file_name):
+        return self.file_state
+
+    def update_vaps_file(self, vaps_file):
+        self.calls.append(("update_vaps_file", vaps_file.file_name))
+        return 3
+
+    def delete_vaps_file_records(self, file_id):
+        self.calls.append(("delete_vaps_file_records", file_id))
+        return set()
+
+    def get_last_id(self, database_table):
+        return 10
+
+    def delete_duplicates(self, database_table, file_id, last_id, signatures):
+        self.calls.append(("delete_duplicates", file_id, last_id, signatures))
+        return len(signatures)
+
+    def update_vaps(self, vaps_df):
+        self.calls.append(("update_vaps", vaps_df["file_id"].unique().tolist()))
+
+    def update_vaps_file_state(self, file_id, end_offset, last_signature, signature):
+        self.calls.append(("update_vaps_file_state", file_id, end_offset))
+
+    def update_vp_distance(self, database_table, prod_dates, vibrators=None):
+        self.calls.append(("update_vp_distance", vibrators))
+
+
+@pytest.fixture
+def vp_db(monkeypatch):
+    vp_db = VpDbRecorder()
+    monkeypatch.setattr(Vaps, "vp_db", vp_db)
+    monkeypatch.setattr(DataCache, "update", lambda self, table, prod_dates: None)
+    return vp_db
+
+
+def store_file(filename, file_id, offset, replace, chunk_size=4):
+    file_size = filename.stat().st_size
+    Vaps.store_file(
+        filename,
+        file_id,
+        (file_size, 0.0, "hash"),
+        offset,
+        replace,
+        file_size,
+        "",
+        Vaps.parse_vaps_chunks(filename, chunk_size, offset, file_size),
+    )
+
+
+def test_store_file_deletes_duplicates_of_earlier_chunks(vaps_file, vp_db):
+    filename, _ = vaps_file
+    store_file(filename, None, 0, False)
+    assert vp_db.calls == [
+        ("update_vaps_file", "test.vaps"),
+        ("update_vaps", [3]),
+        # the record of vibrator 8 of the first chunk is deleted
+        ("delete_duplicates", 3, 10, [(1001, 2002, 8)]),
+        ("update_vaps", [3]),
+        ("update_vaps_file_state", 3, filename.stat().st_size),
+        ("update_vp_distance", None),
+    ]
+
+
+def test_store_file_from_offset_replaces_any_record(vaps_file, vp_db):
+    filename, vaps_lines = vaps_file
+    store_file(filename, 3, len("".join(vaps_lines[:4])), False)
+    # a record of a previous read can have any id of the file
+    assert vp_db.calls == [
+        ("delete_duplicates", 3, 0, [(1002, 2002, 7), (1001, 2002, 8)]),
+        ("update_vaps", [3]),
+        ("update_vaps_file_state", 3, filename.stat().st_size),
+        ("update_vp_distance", {7, 8}),
+    ]
+
+
+def test_store_changed_file_replaces_records(vaps_file, vp_db):
+    filename, _ = vaps_file
+    store_file(filename, 3, 0, True, chunk_size=10)
+    assert vp_db.calls == [
+        ("delete_vaps_file_records", 3),
+        ("update_vaps", [3]),
+        ("update_vaps_file_state", 3, filename.stat().st_size),
+        ("update_vp_distance", None),
+    ]
+
+
+def test_parse_vp_chunks_last_record_wins(tmp_path):
+    filename = tmp_path / "test.txt"
+    first = vp_line("2021-03-05 10:20:30")
+    filename.write_text(
+        "Line     Station\n" + first + vp_line("2021-03-05 10:21:30") + first[:9] + "\n"
+    )
+    ((chunk_count, vp_records),) = Vp.parse_vp_chunks(filename, 10)
+    assert chunk_count == 3
+    assert list(vp_records) == [(1001, 2002, 7)]
+    assert vp_records[(1001, 2002, 7)] == Vp.parse_vp_line(
+        vp_line("2021-03-05 10:21:30"), None
+    )
+
+
+def parsed_signatures(vaps_chunks):
+    return [
+        signature
+        for vaps_df in vaps_chunks
+        for signature in vaps_df[VP_SIGNATURE].itertuples(index=False, name=None)
+    ]
+
+
+def test_parse_file_follows_growing_file(vaps_file, vp_db):
+    filename, vaps_lines = vaps_file
+    # a last line that is still being written
+    with open(filename, mode="at") as vaps:
+        vaps.write(vaps_line("1003.0")[:100])
+
+    # a new file is read up to its last complete line
+    offset = len("".join(vaps_lines))
+    parsed = Vaps.parse_file(filename, chunk_size=10)
+    file_id, _, start, replace, end_offset, last_signature, vaps_chunks = parsed[1:]
+    assert (file_id, start, replace) == (None, 0, False)
+    assert (end_offset, last_signature) == (offset, vaps_lines[-1].rstrip("\n"))
+    assert parsed_signatures(vaps_chunks) == [
+        (1001, 2002, 7),
+        (1002, 2002, 7),
+        (1001, 2002, 8),
+    ]
+
+    # a file in the database is read from where the previous read stopped
+    vp_db.file_state = (3, len("".join(vaps_lines[:4])), vaps_lines[3].rstrip("\n"))
+    vp_db.file_state += parsed[2]
+    parsed = Vaps.parse_file(filename, chunk_size=10)
+    assert parsed[1:6] == (3, parsed[2], vp_db.file_state[1], False, offset)
+    assert parsed_signatures(parsed[7]) == [(1002, 2002, 7), (1001, 2002, 8)]
+
+    # nothing is read until the last line is complete
+    vp_db.file_state = (3, offset, vaps_lines[-1].rstrip("\n")) + parsed[2]
+    assert Vaps.parse_file(filename, chunk_size=10) is None
+
+    # a file of which the line at the offset has changed is read again
+    vp_db.file_state = (3, len("".join(vaps_lines[:4])), "A changed line")
+    vp_db.file_state += parsed[2]
+    parsed = Vaps.parse_file(filename, chunk_size=10)
+    assert parsed[3:5] == (0, True)
+    assert len(parsed_signatures(parsed[7])) == 3
+
+
+def test_parse_file_not_incremental(vaps_file, vp_db):
+    filename, vaps_lines = vaps_file
+    file_signature = Vaps.parse_file(filename, incremental=False)[2]
+    vp_db.file_state = (3, len("".join(vaps_lines[:2])), None) + file_signature
+    assert Vaps.parse_file(filename, incremental=False) is None
+
+    # a changed file is read again from the start
+    with open(filename, mode="at") as vaps:
+        vaps.write(vaps_line("1003.0"))
+
+    parsed = Vaps.parse_file(filename, incremental=False)
+    assert parsed[3:5] == (0, True)
+    assert (1003, 2002, 7) in parsed_signatures(parsed[7])
@@ -46,7 +46,6 @@ wind_gust_series = np.array(new_wind_gust_series)
 
 weather_df['wind_speed'] = wind_speed_series
 weather_df['wind_gust'] = wind_gust_series
-weather_df['date_time'] = pd.to_datetime(weather_df['date_time'])
 weather_df.to_csv(csv_file_daily)
 
 df = weather_df.groupby([weather_df['date_time'].dt.date])['temperature'].min().reset_index()
@@ -6,6 +6,7 @@
 import warnings
 import datetime
 import pandas as pd
+import seis_utils
 from seis_weather_database import WeatherDb
 from seis_settings import DATA_FILES_WEATHER, FilesWeatherTable, WeatherTable
 
@@ -18,50 +19,80 @@ class Weather:
         in the production database
     '''
     weather_base_folder = DATA_FILES_WEATHER
+    suffixes = ['.csv']
     weather_db = WeatherDb()
 
     @classmethod
     def read_store_weather(cls):
         for filename in cls.weather_base_folder.glob('*.*'):
-            if not filename.is_file() or filename.suffix.lower() != '.csv':
+            if not filename.is_file() or filename.suffix.lower() not in cls.suffixes:
                 continue
 
-            weather_file = FilesWeatherTable(*[None]*3)
+            if weather_file := cls.parse_file(filename):
+                cls.store_file(*weather_file)
 
-            weather_file.file_name = filename.name
-            weather_file.file_date = (
-                datetime.datetime.fromtimestamp(filename.stat().st_mtime)
+    @classmethod
+    def parse_file(cls, filename):
+        ''' parse the weather file if it is new or has changed without writing
+            to the database, so it can run in a worker thread
+            returns:
+              the arguments of store_file, None if the file is in the database and
+              unchanged
+        '''
+        file_signature, is_unchanged = seis_utils.file_signature(
+            filename, cls.weather_db.get_weather_file_signature(filename.name)
+        )
+        if is_unchanged:
+            return None
+
+        weather_df = pd.read_csv(
+                filename, skiprows=1,
+                usecols=[0, 1, 2, 3, 10, 14, 17],
+                names=[
+                    'date_time', 'wind_speed', 'gust', 'pulse_count',
+                    'counter_value', 'input_voltage', 'temperature'
+                ]
             )
-            file_id = cls.weather_db.update_weather_file(weather_file)
+        weather_df.date_time = pd.to_datetime(weather_df.date_time)
 
-            if file_id == -1:
-                continue
+        weather_records = []
+        for _, weather_row in weather_df.iterrows():
+            weather_record = WeatherTable(*[None]*9)
+            weather_record.date_time = weather_row.date_time.to_pydatetime()
+            weather_record.wind_speed = weather_row.wind_speed
+            weather_record.wind_gust = weather_row.gust
+            weather_record.pulse_count = weather_row.pulse_count
+            weather_record.counter_value = weather_row.counter_value
+            weather_record.input_voltage = weather_row.input_voltage
+            weather_record.temperature = weather_row.temperature
+            weather_records.append(weather_record)
+
+        return filename, file_signature, weather_records
+
+    @classmethod
+    def store_file(cls, filename, file_signature, weather_records):
+        ''' add the weather file and store the records parsed by parse_file, a
+            changed file replaces its records
+        '''
+        weather_file = FilesWeatherTable(*[None]*6)
+
+        weather_file.file_name = filename.name
+        weather_file.file_size, weather_file.file_mtime, weather_file.file_hash = (
+            file_signature
+        )
+        weather_file.file_date = (
+            datetime.datetime.fromtimestamp(weather_file.file_mtime)
+        )
+        file_id = cls.weather_db.update_weather_file(weather_file)
+
+        if file_id == -1:
+            return
+
+        for weather_record in weather_records:
+            weather_record.file_id = file_id
 
-            weather_df = pd.read_csv(
-                    filename, skiprows=1,
-                    usecols=[0, 1, 2, 3, 10, 14, 17],
-                    names=[
-                        'date_time', 'wind_speed', 'gust', 'pulse_count',
-                        'counter_value', 'input_voltage', 'temperature'
-                    ]
-                )
-            weather_df.date_time = pd.to_datetime(weather_df.date_time)
-
-            weather_records = []
-            for _, weather_row in weather_df.iterrows():
-                weather_record = WeatherTable(*[None]*9)
-                weather_record.file_id = file_id
-                weather_record.date_time = weather_row.date_time.to_pydatetime()
-                weather_record.wind_speed = weather_row.wind_speed
-                weather_record.wind_gust = weather_row.gust
-                weather_record.pulse_count = weather_row.pulse_count
-                weather_record.counter_value = weather_row.counter_value
-                weather_record.input_voltage = weather_row.input_voltage
-                weather_record.temperature = weather_row.temperature
-                weather_records.append(weather_record)
-
-            if weather_records:
-                cls.weather_db.update_weather_records(weather_records)
+        if weather_records:
+            cls.weather_db.update_weather_records(weather_records)
 
 
 if __name__ == '__main__':